@@ -0,0 +1,299 @@
+"""
+    Batch simulator for balance and load studies.
+    Many independent headless games are played in parallel by a pool of processes, every game with its own seed
+    and a scripted player policy. Summary of every game is streamed to a JSON lines file as soon as it is done,
+    aggregate statistics are printed at the end:
+
+        python batch.py --games 10000 --policy collector --output runs.jsonl
+        python batch.py --games 500 --set EnemyWeak.max_velocity=150 --set SpawnEngine.enemy_spawn_interval=2,4
+
+    Settings of EnemyWeak change EnemyFast too, its stats are derived from EnemyWeak.
+
+    Game with seed S is the same game as "python main.py --headless --seed S" with the player's input
+    given by the policy.
+"""
+__author__ = 'Krystian'
+import io
+import os
+import sys
+import ast
+import json
+import math
+import time
+import random
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+
+DT = 1.0 / 70.0  # time step of one simulated frame
+SETTING_CLASSES = dict((cls.__name__, cls) for cls in (
+    main.Player, main.AttackWave, main.EnemyWeak, main.EnemyFast, main.EnemyStrong,
+    main.Gold, main.HpBonus, main.AttackBonus, main.GameObjectsGroup.SpawnEngine))
+
+
+def parse_setting(text):
+    """
+        "Class.attribute=value" -> (class name, attribute, value), value is a Python literal,
+        e.g. "EnemyWeak.max_velocity=150" or "SpawnEngine.gold_spawn_interval=0.5,1.0"
+    """
+    name, value = text.split("=", 1)
+    class_name, attribute = name.strip().split(".", 1)
+    if class_name not in SETTING_CLASSES:
+        raise argparse.ArgumentTypeError("unknown class " + class_name)
+    if not hasattr(SETTING_CLASSES[class_name], attribute):
+        raise argparse.ArgumentTypeError(class_name + " has no attribute " + attribute)
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError("value of " + name + " is not a number or tuple")
+    return class_name, attribute, value
+
+
+def apply_settings(settings):
+    for class_name, attribute, value in settings:
+        setattr(SETTING_CLASSES[class_name], attribute, value)
+
+
+def nearest(pos, objects):
+    """
+    :return: (nearest object, squared distance), (None, inf) if there are no objects
+    """
+    best = None
+    best_distance = float("inf")
+    for object in objects:
+        distance = (object.pos[0] - pos[0]) ** 2 + (object.pos[1] - pos[1]) ** 2
+        if distance < best_distance:
+            best = object
+            best_distance = distance
+    return best, best_distance
+
+
+def go_to(pos, target, attack=False, dead_zone=4.0):
+    """
+        InputState which moves player from pos to target.
+    """
+    return main.InputState(left=target[0] < pos[0] - dead_zone, right=target[0] > pos[0] + dead_zone,
+                           up=target[1] < pos[1] - dead_zone, down=target[1] > pos[1] + dead_zone,
+                           attack=attack)
+
+
+def idle_policy(rng):
+    no_input = main.InputState()
+    return lambda group, tick: no_input
+
+
+def random_policy(rng, hold_ticks=35):
+    """
+        Random keys held for hold_ticks updates.
+    """
+    state = [main.InputState()]
+
+    def policy(group, tick):
+        if tick % hold_ticks == 0:
+            state[0] = main.InputState(*[rng.random() < 0.4 for flag in range(5)])
+        return state[0]
+    return policy
+
+
+def collector_policy(rng, attack_distance=80.0):
+    """
+        Go to the nearest bonus, attack when enemy is close.
+    """
+    def policy(group, tick):
+        player = group.player
+        enemy, enemy_distance = nearest(player.pos, group.enemies)
+        bonus, bonus_distance = nearest(player.pos, group.bonuses)
+        attack = enemy_distance < attack_distance ** 2
+        if bonus is None:
+            return main.InputState(attack=attack)
+        return go_to(player.pos, bonus.pos, attack)
+    return policy
+
+
+def kiter_policy(rng, danger_distance=150.0, attack_distance=80.0):
+    """
+        Run away from the nearest enemy when it is close, otherwise behave like collector_policy.
+    """
+    collector = collector_policy(rng, attack_distance)
+
+    def policy(group, tick):
+        player = group.player
+        enemy, enemy_distance = nearest(player.pos, group.enemies)
+        if enemy_distance < danger_distance ** 2:
+            away = (2 * player.pos[0] - enemy.pos[0], 2 * player.pos[1] - enemy.pos[1])
+            return go_to(player.pos, away, enemy_distance < attack_distance ** 2)
+        return collector(group, tick)
+    return policy
+
+
+POLICIES = dict([
+    ("idle", idle_policy),
+    ("random", random_policy),
+    ("collector", collector_policy),
+    ("kiter", kiter_policy),
+])
+
+worker_app = None  # headless App of this worker process, it is reused by every game
+worker_error = None  # messages of App which couldn't be created, they are raised by play_game()
+
+
+def init_worker(settings):
+    """
+        Initializer of worker process. Exception raised here would only break the pool, so error of App is
+        kept and raised by play_game() in the parent process.
+    """
+    global worker_app, worker_error
+    apply_settings(settings)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):  # hide resource loading messages
+            worker_app = main.App((800, 600), headless=True)
+    except SystemExit:
+        worker_error = output.getvalue().strip()
+
+
+def play_game(job):
+    """
+        Play one game until player dies or max_time passes.
+    :param job: (seed, policy name, max_time, gold_goal)
+    :return: dict with summary of the game
+    """
+    seed, policy_name, max_time, gold_goal = job
+    app = worker_app
+    if app is None:
+        raise RuntimeError("worker couldn't create App: " + str(worker_error))
+    app.seed_random.seed(seed)
+    app.init_game()
+    app.gold_goal = gold_goal
+    app.game_mode = main.App.GameMode.GAME_MAIN
+    group = app.game_objects_group
+    policy = POLICIES[policy_name](random.Random(seed))
+    max_ticks = int(round(max_time / DT))
+    frame_times = []
+    peak_entities = 0
+    goal_time = None
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    tick = 0
+    while tick < max(1, max_ticks) and app.game_mode == main.App.GameMode.GAME_MAIN:
+        input_state = policy(group, tick)
+        frame_start = perf_counter()
+        app.update(DT, input_state)
+        frame_times.append(perf_counter() - frame_start)
+        tick += 1
+        if len(group) > peak_entities:
+            peak_entities = len(group)
+        if goal_time is None and app.player.gold >= gold_goal:
+            goal_time = tick * DT
+    elapsed = perf_counter() - start
+    frame_times.sort()
+    return {
+        "seed": seed,
+        "policy": policy_name,
+        "survived": app.game_mode == main.App.GameMode.GAME_MAIN,
+        "survival_time": tick * DT,
+        "gold": app.player.gold,
+        "goal_time": goal_time,
+        "peak_entities": peak_entities,
+        "entities": len(group),
+        "mean_frame_ms": sum(frame_times) / len(frame_times) * 1000.0,
+        "p99_frame_ms": frame_times[int(0.99 * (len(frame_times) - 1))] * 1000.0,
+        "max_frame_ms": frame_times[-1] * 1000.0,
+        "elapsed_s": elapsed,
+    }
+
+
+def describe(values):
+    """
+    :return: dict with mean, std, min, percentiles and max of values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    mean = sum(values) / len(values)
+    std = math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))
+
+    def percentile(fraction):
+        return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+    return {"mean": mean, "std": std, "min": values[0], "p10": percentile(0.1), "p50": percentile(0.5),
+            "p90": percentile(0.9), "max": values[-1]}
+
+
+def aggregate(summaries):
+    """
+    :return: dict with statistics of every metric of game summaries
+    """
+    summaries = list(summaries)
+    games = len(summaries)
+    results = {
+        "games": games,
+        "survival_rate": sum(summary["survived"] for summary in summaries) / float(games),
+        "goal_rate": sum(summary["goal_time"] is not None for summary in summaries) / float(games),
+    }
+    for metric in ("survival_time", "gold", "goal_time", "peak_entities", "mean_frame_ms", "p99_frame_ms",
+                   "max_frame_ms"):
+        results[metric] = describe([summary[metric] for summary in summaries if summary[metric] is not None])
+    return results
+
+
+def print_aggregate(results):
+    print("")
+    print("%d games, survived %.1f%%, reached goal %.1f%%" %
+          (results["games"], results["survival_rate"] * 100.0, results["goal_rate"] * 100.0))
+    print("%-16s %10s %10s %10s %10s %10s %10s" % ("metric", "mean", "std", "min", "p50", "p90", "max"))
+    for metric, stats in results.items():
+        if isinstance(stats, dict):
+            print("%-16s %10.2f %10.2f %10.2f %10.2f %10.2f %10.2f" %
+                  (metric, stats["mean"], stats["std"], stats["min"], stats["p50"], stats["p90"], stats["max"]))
+
+
+def main_batch():
+    parser = argparse.ArgumentParser(description="Play many headless ECTS games in parallel")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="seed of game seeds")
+    parser.add_argument("--policy", default="collector", choices=sorted(POLICIES.keys()),
+                        help="scripted player")
+    parser.add_argument("--max-time", type=float, default=120.0, help="game seconds after which game is stopped")
+    parser.add_argument("--gold-goal", type=int, default=2000)
+    parser.add_argument("--set", dest="settings", action="append", type=parse_setting, default=[],
+                        metavar="CLASS.ATTRIBUTE=VALUE", help="change class attribute, e.g. EnemyWeak.max_hp=3")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=4, help="games sent to a worker at once")
+    parser.add_argument("--output", default="batch_results.jsonl", help="summary of every game, one per line")
+    parser.add_argument("--aggregate-output", default="", help="save aggregate statistics to this JSON file")
+    options = parser.parse_args()
+
+    seeds = random.Random(options.seed)
+    jobs = [(seeds.getrandbits(32), options.policy, options.max_time, options.gold_goal)
+            for game in range(options.games)]
+    summaries = []
+    start = time.perf_counter()
+    with open(options.output, "w") as output_file, \
+            ProcessPoolExecutor(options.workers, initializer=init_worker, initargs=(options.settings,)) as executor:
+        for summary in executor.map(play_game, jobs, chunksize=options.chunk_size):
+            summaries.append(summary)
+            output_file.write(json.dumps(summary, sort_keys=True) + "\n")
+            if len(summaries) % 100 == 0 or len(summaries) == len(jobs):
+                output_file.flush()
+                elapsed = time.perf_counter() - start
+                print("%d/%d games in %.1f s (%.1f games/s)" %
+                      (len(summaries), len(jobs), elapsed, len(summaries) / elapsed))
+    print("Summaries saved to " + options.output + ".")
+
+    results = aggregate(summaries)
+    results["settings"] = [[class_name + "." + attribute, value] for class_name, attribute, value in options.settings]
+    results["policy"] = options.policy
+    results["elapsed_s"] = time.perf_counter() - start
+    results["workers"] = options.workers
+    print_aggregate(results)
+    if options.aggregate_output:
+        with open(options.aggregate_output, "w") as aggregate_file:
+            json.dump(results, aggregate_file, indent=2, sort_keys=True)
+        print("Aggregate statistics saved to " + options.aggregate_output + ".")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_batch())
@@ -0,0 +1,497 @@
+"""
+    Microbenchmarks for simulation and rendering hot paths.
+    Every benchmark runs headless for each entity count and reports calls per second, latency percentiles
+    and memory allocated by one call. Results are saved as JSON and can be compared with older results:
+
+        python benchmark.py --counts 10,100,1000 --output new.json --baseline old.json
+
+    It fails if p99 of a benchmark with BUDGETS is above its budget, e.g. snapshot save, restore and rewind.
+"""
+__author__ = 'Krystian'
+import sys
+import io
+import gc
+import copy
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+import contextlib
+
+import pygame
+import main
+
+DT = 1.0 / 70.0  # time step of one simulated frame
+
+
+def create_app():
+    """
+        Headless App with hidden resource loading messages. They are printed if App can't load resources.
+    """
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):  # hide resource loading messages
+            app = main.App((800, 600), headless=True)
+    except SystemExit:
+        sys.stderr.write(output.getvalue())
+        sys.exit(1)
+    app.game_mode = main.App.GameMode.GAME_MAIN
+    return app
+
+
+@contextlib.contextmanager
+def immortal_players():
+    """
+        Player stays immortal after the first hit while benchmarks run. It is set on the class, because an
+        attribute set on an instance would fail (instances have no __dict__).
+    """
+    immortal_time_duration = main.Player.immortal_time_duration
+    main.Player.immortal_time_duration = float("inf")
+    try:
+        yield
+    finally:
+        main.Player.immortal_time_duration = immortal_time_duration
+
+
+def new_game(app, count, vectorized_physics=False, bonuses_ratio=0.2):
+    """
+        Fresh GameObjectsGroup with immortal player and count enemies and bonuses on random positions.
+        Benchmarks run inside immortal_players().
+    """
+    group = main.GameObjectsGroup([0, 100, app.window.get_width(), app.window.get_height()], app,
+                                  vectorized_physics, seed=random.getrandbits(32))
+    play_area_center = (group.play_area[2] / 2, group.play_area[3] / 2)
+    player = main.Player(app.get_resource("player"), app.get_resource("player_low_hp"),
+                         app.get_resource("player_very_low_hp"), play_area_center, group)
+    group.add_player(player)
+    app.game_objects_group = group
+    app.player = player
+    player.immortal = True
+    bonuses = int(count * bonuses_ratio)
+    for index in range(count - bonuses):
+        if index % 5 == 0:
+            group.add(main.EnemyStrong(app.get_resource("enemy2"), group.get_random_pos_on_game_arena(), group))
+        else:
+            group.add(main.EnemyWeak(app.get_resource("enemy1"), group.get_random_pos_on_game_arena(), group))
+    for index in range(bonuses):
+        group.add(main.Gold(app.get_resource("gold"), group.get_random_pos_on_game_arena(), 10, group.random))
+    return group
+
+
+def new_attack_wave(player, r):
+    attack_wave = main.AttackWave(player)
+    attack_wave.r = r - attack_wave.max_r * 2. * DT
+    attack_wave.update(DT)
+    return attack_wave
+
+
+def bench_group_update(app, count, options):
+    group = new_game(app, count, options.vectorized)
+
+    def call():
+        group.update(DT)
+    return call, None
+
+
+def bench_collide_player_with_enemies(app, count, options):
+    group = new_game(app, count, options.vectorized, bonuses_ratio=0.0)
+    for enemy in list(group.enemies)[:3]:  # some enemies always touch the player
+        enemy.rect.center = app.player.rect.center
+        group.enemies_hash.update(enemy)
+
+    def reset():
+        app.player.immortal = False
+        app.player.hp = app.player.max_hp
+        group.pop_up_label_group.empty()
+    return group.collide_player_with_enemies, reset
+
+
+def bench_collide_attack_waves_with_enemies(app, count, options):
+    group = new_game(app, count, options.vectorized, bonuses_ratio=0.0)
+    attack_waves = [new_attack_wave(app.player, r) for r in (30.0, 60.0, 90.0)]
+    for attack_wave in attack_waves:
+        group.add(attack_wave)
+
+    def reset():
+        for attack_wave in attack_waves:
+            del attack_wave.attacked_by_self[:]
+        group.pop_up_label_group.empty()
+    return group.collide_attack_waves_with_enemies, reset
+
+
+def bench_collide_player_with_bonuses(app, count, options):
+    group = new_game(app, count, options.vectorized, bonuses_ratio=1.0)
+    for bonus in list(group.bonuses)[:3]:
+        bonus.rect.center = app.player.rect.center
+        group.bonuses_hash.update(bonus)
+
+    def reset():
+        group.pop_up_label_group.empty()
+    return group.collide_player_with_bonuses, reset
+
+
+def bench_attack_wave_update(app, count, options):
+    new_game(app, 0)
+    attack_waves = [new_attack_wave(app.player, 1.0 + index % 118) for index in range(count)]
+
+    def call():
+        for attack_wave in attack_waves:
+            attack_wave.update(DT)
+
+    def reset():
+        for attack_wave in attack_waves:
+            if not attack_wave.is_alive():
+                attack_wave.r = 0.0
+                attack_wave.alive = True
+    return call, reset
+
+
+def bench_pop_up_label_creation(app, count, options):
+    group = new_game(app, 0)
+    pos = app.player.pos
+
+    def call():
+        for index in range(count):
+            dmg = app.render_text("small_font", "-" + str(index % 7) + " HP", True, (255, 25, 25))
+            group.add_pop_up_label(group.new_object(main.PopUpLabel, dmg, pos, False))
+
+    def reset():  # labels go back to pool like expired ones
+        for pop_up_label in group.pop_up_label_group.sprites():
+            pop_up_label.remove(group.pop_up_label_group)
+            group.release_object(pop_up_label)
+    return call, reset
+
+
+def bench_spawn(app, count, options):
+    group = new_game(app, count, options.vectorized)
+    spawn_engine = group.spawn_engine
+    population = set(group)
+
+    def call():  # spawn each kind of object
+        spawn_engine.spawn_enemy()
+        spawn_engine.spawn_gold()
+        spawn_engine.spawn_hp_bonus()
+        spawn_engine.spawn_attack_bonus()
+
+    def reset():  # population stays the same
+        for object in list(group):
+            if object not in population:
+                object.remove(group)
+    return call, reset
+
+
+def bench_bounce(app, count, options):
+    group = new_game(app, count, options.vectorized, bonuses_ratio=0.0)
+    enemies = list(group.enemies)
+    pairs = [(enemies[index], enemies[(index + 1) % len(enemies)]) for index in range(len(enemies))]
+
+    def call():
+        for a, b in pairs:
+            group.bounce(a, b)
+    return call, None
+
+
+def bench_app_draw(app, count, options):
+    new_game(app, count, options.vectorized)
+    app.game_objects_group.update(DT)
+    return app.draw, None
+
+
+def bench_app_draw_full(app, count, options):
+    new_game(app, count, options.vectorized)
+    app.game_objects_group.update(DT)
+    return app.draw_full, None
+
+
+def bench_snapshot_save(app, count, options):
+    group = new_game(app, count, options.vectorized)
+    group.update(DT)
+
+    def call():
+        main.WorldSnapshot.save(group)
+    return call, None
+
+
+def bench_snapshot_restore(app, count, options):
+    group = new_game(app, count, options.vectorized)
+    snapshot = main.WorldSnapshot.save(group)
+    for tick in range(int(1.0 / DT)):
+        group.update(DT)
+    latest = main.WorldSnapshot.save(group)
+
+    def call():  # rewind by one second
+        main.WorldSnapshot.restore(group, snapshot)
+
+    def reset():
+        main.WorldSnapshot.restore(group, latest)
+    return call, reset
+
+
+def bench_snapshot_rewind(app, count, options):
+    """
+        App.rewind() by one second (F5) from SnapshotRing which got snapshot after every update.
+    """
+    group = new_game(app, count, options.vectorized)
+    app.start_snapshots(1024 * 1024)
+    for tick in range(app.tick_rate + 1):
+        group.update(DT)
+        app.snapshots.push(main.WorldSnapshot.save(group))
+    snapshots = copy.deepcopy(app.snapshots)
+    latest = app.snapshots.get()
+
+    def call():
+        app.rewind(app.tick_rate)
+
+    def reset():  # the rewound updates are back in SnapshotRing and in the game
+        app.snapshots = copy.deepcopy(snapshots)
+        main.WorldSnapshot.restore(group, latest)
+    return call, reset
+
+
+BENCHMARKS = [
+    ("group_update", bench_group_update),
+    ("collide_player_with_enemies", bench_collide_player_with_enemies),
+    ("collide_attack_waves_with_enemies", bench_collide_attack_waves_with_enemies),
+    ("collide_player_with_bonuses", bench_collide_player_with_bonuses),
+    ("attack_wave_update", bench_attack_wave_update),
+    ("pop_up_label_creation", bench_pop_up_label_creation),
+    ("spawn", bench_spawn),
+    ("bounce", bench_bounce),
+    ("app_draw", bench_app_draw),
+    ("app_draw_full", bench_app_draw_full),
+    ("snapshot_save", bench_snapshot_save),
+    ("snapshot_restore", bench_snapshot_restore),
+    ("snapshot_rewind", bench_snapshot_rewind),
+]
+
+# p99 limits in ms for counts up to --budget-count, rewind must not stall the game
+BUDGETS = dict(snapshot_save=1.0, snapshot_restore=1.0, snapshot_rewind=1.0)
+
+
+ENTITIES = [
+    ("Player", lambda app, group, pos: main.Player(app.get_resource("player"), app.get_resource("player_low_hp"),
+                                                   app.get_resource("player_very_low_hp"), pos, group)),
+    ("AttackWave", lambda app, group, pos: main.AttackWave(app.player)),
+    ("EnemyWeak", lambda app, group, pos: main.EnemyWeak(app.get_resource("enemy1"), pos, group)),
+    ("EnemyStrong", lambda app, group, pos: main.EnemyStrong(app.get_resource("enemy2"), pos, group)),
+    ("Gold", lambda app, group, pos: main.Gold(app.get_resource("gold"), pos, 10, group.random)),
+    ("HpBonus", lambda app, group, pos: main.HpBonus(app.get_resource("hp"), pos, 1, group.random)),
+    ("AttackBonus", lambda app, group, pos: main.AttackBonus(app.get_resource("attack"), pos, group.random)),
+    ("PopUpLabel", lambda app, group, pos: main.PopUpLabel(app.get_resource("attack"), pos, False)),
+]
+
+
+def measure_entity_memory(app, count):
+    """
+        Python memory held by one entity (object, its attributes, rect and lists), surfaces are shared.
+    :return: (dict entity name -> bytes, dict entity name -> True if entity has instance __dict__)
+    """
+    group = new_game(app, 0)
+    results = dict()
+    instance_dicts = dict()
+    for name, create in ENTITIES:
+        entities = [None] * count
+        gc.collect()
+        tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        for index in range(count):
+            entities[index] = create(app, group, [index % 800, 100 + index % 500])
+        traced_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name] = (traced_after - traced_before) / count
+        instance_dicts[name] = hasattr(entities[0], "__dict__")  # checked after tracing, it can create empty dict
+        del entities
+    return results, instance_dicts
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(call, reset, options):
+    """
+        Time calls until min_time passed (at least min_iterations, at most max_iterations),
+        then measure allocations of a few calls with tracemalloc.
+    :return: dict with results
+    """
+    for warm_up in range(2):
+        if reset is not None:
+            reset()
+        call()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < options.max_iterations and \
+            (len(latencies) < options.min_iterations or time.perf_counter() - start < options.min_time):
+        if reset is not None:
+            reset()
+        call_start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    result = {
+        "iterations": len(latencies),
+        "calls_per_s": 1.0 / mean if mean > 0 else float("inf"),
+        "mean_ms": mean * 1000.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000.0,
+        "p90_ms": percentile(latencies, 0.90) * 1000.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000.0,
+        "max_ms": latencies[-1] * 1000.0,
+    }
+
+    if options.allocations:
+        peaks = []
+        blocks = []
+        tracemalloc.start()
+        for iteration in range(min(options.allocation_iterations, len(latencies))):
+            if reset is not None:
+                reset()
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+            blocks_before = sys.getallocatedblocks()
+            call()
+            blocks.append(sys.getallocatedblocks() - blocks_before)
+            peaks.append(tracemalloc.get_traced_memory()[1] - traced_before)
+        tracemalloc.stop()
+        peaks.sort()
+        blocks.sort()
+        result["alloc_peak_bytes"] = percentile(peaks, 0.5)  # memory allocated during one call
+        result["alloc_net_blocks"] = percentile(blocks, 0.5)  # blocks still allocated after one call
+    return result
+
+
+def compare(results, baseline, threshold):
+    """
+        Print p50 ratio new/baseline for every benchmark from both files.
+    :return: list of regressions (name, count, ratio)
+    """
+    regressions = []
+    print("")
+    print("%-36s %8s %12s %12s %8s" % ("benchmark", "count", "base p50 ms", "new p50 ms", "ratio"))
+    for name, counts in results.items():
+        for count, result in counts.items():
+            base = baseline.get(name, {}).get(count)
+            if base is None:
+                continue
+            ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] > 0 else 1.0
+            mark = ""
+            if ratio > 1.0 + threshold:
+                regressions.append((name, count, ratio))
+                mark = "  REGRESSION"
+            print("%-36s %8s %12.4f %12.4f %8.2f%s" % (name, count, base["p50_ms"], result["p50_ms"], ratio, mark))
+    return regressions
+
+
+def check_budgets(results, max_count):
+    """
+        Print benchmarks whose p99 is above BUDGETS.
+    :return: list of (name, count, p99 ms) over budget
+    """
+    over_budget = []
+    for name, budget in BUDGETS.items():
+        for count, result in results.get(name, {}).items():
+            if int(count) <= max_count and result["p99_ms"] > budget:
+                over_budget.append((name, count, result["p99_ms"]))
+                print("OVER BUDGET %s %s: p99 %.4f ms > %.4f ms" % (name, count, result["p99_ms"], budget))
+    return over_budget
+
+
+def compare_memory(memory, baseline):
+    print("")
+    print("%-36s %12s %12s %8s" % ("entity", "base B", "new B", "ratio"))
+    for name, size in memory.items():
+        base = baseline.get(name)
+        if base is not None:
+            print("%-36s %12.1f %12.1f %8.2f" % (name, base, size, size / base))
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Headless microbenchmarks for ECTS game")
+    parser.add_argument("--counts", default="10,100,300,1000,10000", help="comma separated entity counts")
+    parser.add_argument("--only", default="", help="comma separated benchmark names")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent in every benchmark")
+    parser.add_argument("--min-iterations", type=int, default=5)
+    parser.add_argument("--max-iterations", type=int, default=2000)
+    parser.add_argument("--allocation-iterations", type=int, default=10)
+    parser.add_argument("--no-allocations", dest="allocations", action="store_false",
+                        help="skip tracemalloc measurement")
+    parser.add_argument("--memory-count", type=int, default=10000,
+                        help="entities created to measure bytes per entity, 0 skips it")
+    parser.add_argument("--vectorized", action="store_true", help="use VectorizedPhysics in GameObjectsGroup")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="", help="earlier results, regression if p50 is slower")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p50 slowdown against baseline")
+    parser.add_argument("--budget-count", type=int, default=500,
+                        help="p99 of BUDGETS is checked for entity counts up to it")
+    options = parser.parse_args()
+
+    counts = [int(count) for count in options.counts.split(",")]
+    only = [name for name in options.only.split(",") if name]
+    app = create_app()
+
+    results = dict()
+    memory = dict()
+    instance_dicts = dict()
+    with immortal_players():
+        for name, benchmark in BENCHMARKS:
+            if only and name not in only:
+                continue
+            results[name] = dict()
+            for count in counts:
+                random.seed(options.seed)
+                call, reset = benchmark(app, count, options)
+                gc.collect()
+                result = measure(call, reset, options)
+                results[name][str(count)] = result
+                print("%-36s %8d %10.1f calls/s  p50 %9.4f ms  p99 %9.4f ms  alloc %s B" %
+                      (name, count, result["calls_per_s"], result["p50_ms"], result["p99_ms"],
+                       result.get("alloc_peak_bytes", "-")))
+
+        if options.memory_count > 0:
+            random.seed(options.seed)
+            memory, instance_dicts = measure_entity_memory(app, options.memory_count)
+            for name, size in memory.items():
+                print("%-36s %10.1f B per entity  %s" %
+                      (name, size, "has __dict__" if instance_dicts[name] else "no __dict__"))
+
+    output = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": main.numpy.__version__ if main.numpy is not None else None,
+            "platform": platform.platform(),
+            "vectorized": options.vectorized,
+            "seed": options.seed,
+        },
+        "results": results,
+        "memory": memory,
+        "instance_dict": instance_dicts,
+    }
+    with open(options.output, "w") as output_file:
+        json.dump(output, output_file, indent=2, sort_keys=True)
+    print("Results saved to " + options.output + ".")
+
+    failed = False
+    over_budget = check_budgets(results, options.budget_count)
+    if over_budget:
+        print(str(len(over_budget)) + " benchmark(s) over budget.")
+        failed = True
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline["results"], options.threshold)
+        if memory and baseline.get("memory"):
+            compare_memory(memory, baseline["memory"])
+        if regressions:
+            print(str(len(regressions)) + " regression(s) against " + options.baseline + ".")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -1,30 +1,177 @@
 __author__ = 'Krystian'
 import pygame
 from pygame.locals import *  # keyboards keys map
+import os
 import sys
+import time
+import argparse
 import math
 import random
+import struct
+import zlib
+import hashlib
+import heapq
+import operator
+import itertools
+import json
+import csv
+import mmap
 from enum import Enum
+from array import array
+from collections import OrderedDict, Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+try:  # numpy is needed only by VectorizedPhysics and WorldSnapshot.read_columns()
+    import numpy
+except ImportError:
+    numpy = None
 
+ASSET_DIRECTORY = os.path.dirname(os.path.abspath(__file__))  # images, fonts and assets.bundle
 
-class GameObject(pygame.sprite.Sprite):
+
+class InputState():
+    """
+        Player controls for one update. It is read from keyboard or supplied by program (headless mode).
+    """
+    def __init__(self, left=False, right=False, up=False, down=False, attack=False, confirm=False, quit=False):
+        self.left = left
+        self.right = right
+        self.up = up
+        self.down = down
+        self.attack = attack  # new AttackWave
+        self.confirm = confirm  # leave GAME_BEGIN and GAME_END screens
+        self.quit = quit
+
+    @staticmethod
+    def from_keyboard():
+        keys = pygame.key.get_pressed()
+        return InputState(left=keys[pygame.K_a] or keys[pygame.K_LEFT],
+                          right=keys[pygame.K_d] or keys[pygame.K_RIGHT],
+                          up=keys[pygame.K_w] or keys[pygame.K_UP],
+                          down=keys[pygame.K_s] or keys[pygame.K_DOWN],
+                          attack=keys[pygame.K_SPACE] or keys[pygame.K_LSHIFT],
+                          confirm=keys[pygame.K_SPACE],
+                          quit=keys[pygame.K_ESCAPE])
+
+    FLAGS = ("left", "right", "up", "down", "attack", "confirm", "quit")  # bit order used by to_bits()
+
+    def to_bits(self):
+        """
+        :return: int, one bit for every flag
+        """
+        bits = 0
+        for index, flag in enumerate(InputState.FLAGS):
+            if getattr(self, flag):
+                bits |= 1 << index
+        return bits
+
+    @staticmethod
+    def from_bits(bits):
+        return InputState(*[bool(bits & (1 << index)) for index in range(len(InputState.FLAGS))])
+
+
+class InputRecorder():
+    """
+        Input of every App.update() stored as one byte per tick. With seed of App and fixed dt it is enough
+        to reproduce whole game. Saved file: header, md5 digest of final game state, zlib compressed input.
+    """
+    MAGIC = b"ECTSREC1"
+    HEADER = struct.Struct("<8sQdBI16s")  # magic, seed, dt, start game mode, ticks, state digest
+
+    def __init__(self, seed, dt, game_mode):
+        self.seed = seed
+        self.dt = dt
+        self.game_mode = game_mode  # App.GameMode value when recording started
+        self.ticks = bytearray()
+
+    def record(self, input_state):
+        self.ticks.append(input_state.to_bits())
+
+    def save(self, file_name, state_digest):
+        with open(file_name, "wb") as file:
+            file.write(InputRecorder.HEADER.pack(InputRecorder.MAGIC, self.seed, self.dt, self.game_mode,
+                                                 len(self.ticks), state_digest))
+            file.write(zlib.compress(bytes(self.ticks), 9))
+
+
+class InputReplay():
+    """
+        Recording loaded from file, get_input(tick) is input_source for App.simulate().
+    """
+    def __init__(self, file_name):
+        with open(file_name, "rb") as file:
+            data = file.read()
+        magic, self.seed, self.dt, self.game_mode, ticks, self.state_digest = \
+            InputRecorder.HEADER.unpack_from(data)
+        if magic != InputRecorder.MAGIC:
+            raise ValueError(file_name + " is not input recording")
+        self.ticks = zlib.decompress(data[InputRecorder.HEADER.size:])
+        if len(self.ticks) != ticks:
+            raise ValueError(file_name + " is damaged")
+        # quit only ended the recording, replay runs all recorded ticks
+        quit_bit = 1 << InputState.FLAGS.index("quit")
+        self.input_states = [InputState.from_bits(bits & ~quit_bit) for bits in range(1 << len(InputState.FLAGS))]
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def get_input(self, tick):
+        return self.input_states[self.ticks[tick]]
+
+
+class GameObject():
     """
         Base class for player class and every object which interact with player/
+        Instance state is kept in __slots__, values which are the same for every object of a type are class
+        attributes, so objects don't have __dict__. pygame.sprite.Sprite has __dict__, so GameObject implements
+        the part of it used by ObjectGroup instead of inheriting it.
     """
-    def __init__(self, image, pos):
-        pygame.sprite.Sprite.__init__(self)
+    # groups is set of ObjectGroups with this object
+    __slots__ = ("groups", "image", "rect", "pos", "velocity", "hp", "alive", "previous_pos", "physics_slot",
+                 "object_id")
+    max_velocity = 300.
+    friction = 3000.
+    acceleration = 4000.
+    max_hp = 0
+    mass = 1
+
+    def __init__(self, image, pos, *args):
+        self.groups = set()
+        self.rect = image.get_rect()  # position and size for draw()
+        self.pos = [0.0, 0.0]
+        self.velocity = [0.0, 0.0]
+        self.reinit(image, pos, *args)
+
+    def reinit(self, image, pos):
+        """
+            Set state of new object. ObjectPool calls it again with new arguments when it reuses object,
+            rect, pos and velocity are reused too. Subclasses take the same arguments here as in constructor.
+        """
         self.image = image
-        self.rect = self.image.get_rect()  # position and size for draw()
+        self.rect.size = image.get_size()
+        self.rect.topleft = (0, 0)
         self.rect.move_ip(pos[0], pos[1])
-        self.pos = list(pos)
-        self.velocity = [0.0, 0.0]
-        self.max_velocity = 300.
-        self.friction = 3000.
-        self.acceleration = 4000.
-        self.max_hp = 0
+        self.pos[0] = pos[0]
+        self.pos[1] = pos[1]
+        self.velocity[0] = 0.0
+        self.velocity[1] = 0.0
         self.hp = 0
         self.alive = True
-        self.mass = 1
+        self.previous_pos = None  # pos before the last update, for render interpolation
+
+    def add_internal(self, group):
+        self.groups.add(group)
+
+    def remove_internal(self, group):
+        self.groups.remove(group)
+
+    def remove(self, *groups):
+        """
+            Remove object from groups which have it.
+        """
+        for group in groups:
+            if group in self.groups:
+                group.remove_internal(self)
+                self.remove_internal(group)
 
     def hurt(self, hurt_hp):
         self.hp -= hurt_hp
@@ -71,27 +218,39 @@ class PopUpLabel(GameObject):
     """
         Pop-up texts labels, which indicate in-game situations
     """
-    def __init__(self,image,pos):
-        GameObject.__init__(self, image, pos)
-        self.velocity =[0,-20.0]
-        self.image = self.image.convert_alpha()
-        self.live_time = 1.0
-        self.remaining_live_time = self.live_time
+    __slots__ = ("expiry_event",)
+    live_time = 1.0  # it is removed by GameObjectsGroup.expire_object() after this time
+
+    def reinit(self, image, pos, convert=True):
+        """
+        :param convert: False if image is already converted, e.g. it comes from TextCache
+        """
+        GameObject.reinit(self, image, pos)
+        self.velocity[1] = -20.0
+        if convert:
+            self.image = self.image.convert_alpha()
+        self.expiry_event = None
 
     def update(self,dt):
         GameObject.update(self, dt)
-        self.remaining_live_time -= dt
         self.pos[1] += self.velocity[1] * dt
         self.rect[0] = int(self.pos[0])
         self.rect[1] = int(self.pos[1])
-        if  self.remaining_live_time < 0:
-            self.kill()#suicade
 
 
 class Player(GameObject):
     """
         Main character class
     """
+    __slots__ = ("game_object_group", "low_hp_image", "very_low_hp_image", "normal_image", "immortal", "gold",
+                 "attack_level", "attack_wave_ready")
+    max_hp = 30
+    min_hp = 15
+    immortal_time_duration = 0.3
+    max_attack_level = 1.0
+    attack_restore_speed = 0.15
+    new_attack_wave_delay_duration = 0.3
+
     def __init__(self, image, low_hp_image, very_low_hp_image, pos, game_object_group):
         GameObject.__init__(self, image, pos)
 
@@ -99,19 +258,12 @@ class Player(GameObject):
         self.low_hp_image = low_hp_image
         self.very_low_hp_image = very_low_hp_image
         self.normal_image = image
-        self.max_hp = 30
-        self.hp = 30
-        self.min_hp = 15
-        self.immortal_time_duration = 0.3
-        self.immortal_time_counter = 0.0
+        self.hp = self.max_hp
         self.immortal = False
         self.gold = 0
-        self.mass = 1
-        self.max_attack_level = 1.0
         self.attack_level = self.max_attack_level
-        self.attack_restore_speed = 0.15
-        self.new_attack_wave_delay_duration = 0.3
-        self.new_attack_wave_delay = self.new_attack_wave_delay_duration
+        self.attack_wave_ready = False  # cooldown of AttackWave is ended by Scheduler
+        game_object_group.scheduler.schedule(self.new_attack_wave_delay_duration, self.end_attack_wave_cooldown)
 
     def restore_attack(self):
         self.attack_level = self.max_attack_level
@@ -120,11 +272,22 @@ class Player(GameObject):
         self.gold += value
 
     def attack(self):#new AttackWave
-        if (self.attack_level / self.max_attack_level >= 0.5) and self.new_attack_wave_delay < 0.0:
+        if (self.attack_level / self.max_attack_level >= 0.5) and self.attack_wave_ready:
             self.game_object_group.add(AttackWave(self))
-            self.new_attack_wave_delay = self.new_attack_wave_delay_duration
+            if self.game_object_group.events is not None:
+                self.game_object_group.events.append(
+                    GameEvent.WaveSpawned((self.pos[0], self.pos[1]), self.attack_level))
+            self.attack_wave_ready = False
+            self.game_object_group.scheduler.schedule(self.new_attack_wave_delay_duration,
+                                                      self.end_attack_wave_cooldown)
             self.attack_level -= self.max_attack_level * 0.5
 
+    def end_attack_wave_cooldown(self):
+        self.attack_wave_ready = True
+
+    def end_immortality(self):
+        self.immortal = False
+
     def add_hp(self, value):
         self.hp += value
         if self.hp > self.max_hp:
@@ -133,18 +296,26 @@ class Player(GameObject):
     def is_immortal(self):
         return self.immortal
 
+    def handle_input(self, input_state, dt):
+        if input_state.left:
+            self.go_left(dt)
+        if input_state.right:
+            self.go_right(dt)
+        if input_state.up:
+            self.go_up(dt)
+        if input_state.down:
+            self.go_down(dt)
+        if input_state.attack:
+            self.attack()
+
     def update(self, dt):
         GameObject.update(self, dt)
-        self.new_attack_wave_delay -= dt
         self.attack_level += dt * self.attack_restore_speed
         if self.attack_level > self.max_attack_level:
             self.attack_level = self.max_attack_level
+        self.update_image()
 
-        if self.immortal:
-            self.immortal_time_counter += dt
-            if self.immortal_time_counter > self.immortal_time_duration:
-                self.immortal = False
-
+    def update_image(self):
         if self.hp == self.min_hp:
             self.image = self.very_low_hp_image
         elif (self.max_hp - self.min_hp) / 2 + self.min_hp > self.hp:
@@ -155,26 +326,70 @@ class Player(GameObject):
     def hurt(self, hurt_hp):
         if not self.immortal:
             GameObject.hurt(self, hurt_hp)
-            self.immortal_time_counter = 0.0
             self.immortal = True
-            if self.hp < self.min_hp:#then game over
+            self.game_object_group.scheduler.schedule(self.immortal_time_duration, self.end_immortality)
+            if self.hp < self.min_hp:#then game over, App ends the game when player isn't alive
                 self.alive = False
-                self.game_object_group.app.game_mode = App.GameMode.GAME_END
+                if self.game_object_group.events is not None:
+                    self.game_object_group.events.append(GameEvent.PlayerDied((self.pos[0], self.pos[1]), self.gold))
 
 
 class AttackWave(GameObject):
     """
         Circle created by player.It can hurt and bounce enemy.
     """
+    __slots__ = ("player", "r", "attacked_by_self", "radius")
+    max_r = 120.0
+    damage = 1.25
+
     def __init__(self, player):
         GameObject.__init__(self, pygame.Surface((1, 1)), [0, 0])
         self.rect = pygame.Rect(0, 0, 0, 0)
         self.player = player
         self.pos = [0, 0]
         self.r = 0.0
-        self.max_r = 120.0
+        self.radius = 0  # radius of circle used by collide_circle(), int(r)
         self.attacked_by_self = []#list of enemys who has hit by wave
-        self.damage = 1.25
+
+    frames = dict()  # (int(2 * r), int(r), alpha, outline) -> circle surface shared by all waves
+
+    @staticmethod
+    def render_frame(INT_2R, INT_R, alpha, outline=False):
+        # creating circle
+        image = pygame.Surface((INT_2R, INT_2R))
+        COLOR = (40, 70, 255)
+        TRANSPARENT = (255, 0, 255)
+        image.fill(TRANSPARENT)
+        if outline:  # low fidelity frame used under load, only ring is blended and RLE skips the inside
+            image.set_colorkey(TRANSPARENT, RLEACCEL)
+            pygame.draw.circle(image, COLOR, (INT_R, INT_R), INT_R, min(INT_R, 3))
+        else:
+            image.set_colorkey(TRANSPARENT)
+            pygame.draw.circle(image, COLOR, (INT_R, INT_R), INT_R)
+        pygame.draw.circle(image, (40, 40, 128), (INT_R, INT_R), INT_R
+                           , INT_R > 3 if 3 else 0)#throw exception if border > r
+        image.set_alpha(alpha)
+        return image
+
+    @staticmethod
+    def get_frame(r, max_r, outline=False):
+        """
+            Circle surface for radius r, rendered only at first use. Surface can't be modified by caller.
+        :param outline: draw only border of circle, it is a few times faster to blit
+        """
+        key = (int(2 * r), int(r), int(100 * (1.1 - (r / max_r))), outline)
+        frame = AttackWave.frames.get(key)
+        if frame is None:
+            frame = AttackWave.frames[key] = AttackWave.render_frame(*key)
+        return frame
+
+    @staticmethod
+    def prerender(max_r=120.0):
+        """
+            Render frames for every integer radius up to max_r.
+        """
+        for INT_R in range(int(max_r) + 1):
+            AttackWave.get_frame(float(INT_R), max_r)
 
     def attack(self, game_object):#deal damage to game_object
         game_object.hurt(self.get_current_damage())
@@ -189,27 +404,25 @@ class AttackWave(GameObject):
         if self.r > self.max_r:
             self.r = self.max_r
             self.kill()
+        self.update_shape()
 
-        # creating circle
+    def update_shape(self):
+        """
+            Image, rect and radius for current r and position of player. Image is the full frame,
+            EventPresenter.present_attack_waves() replaces it with outline under load.
+        """
         INT_2R = int(2 * self.r)
-        self.image = pygame.Surface((INT_2R, INT_2R))
-        COLOR = (40, 70, 255)
-        TRANSPARENT = (255, 0, 255)
-        self.image.fill(TRANSPARENT)
-        self.image.set_colorkey(TRANSPARENT)
-        pygame.draw.circle(self.image, COLOR, (int(self.r), int(self.r)), int(self.r))
-        pygame.draw.circle(self.image, (40, 40, 128), (int(self.r), int(self.r)), int(self.r)
-                           , int(self.r) > 3 if 3 else 0)#throw exception if border > r
-        self.image.set_alpha(100 * (1.1 - (self.r / self.max_r)))
+        self.image = AttackWave.get_frame(self.r, self.max_r)
         self.rect = pygame.Rect([self.player.rect[x] + self.player.rect[x + 2] / 2 - self.r
                                  for x in range(len(self.player.pos))],
                                 (INT_2R, INT_2R))#rect for draw and circle_colission
-        self.radius = int(self.r)#for cicle_collision
+        self.radius = int(self.r)#for collide_circle
 
     def bounce(self, object):
         direction_vec = [0.0, 0.0]
         vec_length = lambda vec: (vec[0] ** 2 + vec[1] ** 2) ** 0.5
-        normalize = lambda vec: [vec[0] / vec_length(vec), vec[1] / vec_length(vec)]
+        # objects in the same place have no direction
+        normalize = lambda vec: [vec[0] / vec_length(vec), vec[1] / vec_length(vec)] if vec_length(vec) else vec
         for x in range(len(self.player.pos)):
             direction_vec[x] = object.pos[x] - self.player.pos[x]
             direction_vec = normalize(direction_vec)
@@ -221,13 +434,15 @@ class Enemy(GameObject):
     """
         Base class for character, which deal damage to player
     """
-    def __init__(self, image, pos, game_system_group):
-        GameObject.__init__(self, image, pos)
+    __slots__ = ("game_system_group", "move_cycle_timer")
+    damage = 1
+    attack_wave_bounce_mass = 1
+    min_hp = 1
+
+    def reinit(self, image, pos, game_system_group):
+        GameObject.reinit(self, image, pos)
         self.game_system_group = game_system_group
         self.move_cycle_timer = 0.0
-        self.damage = 1
-        self.attack_wave_bounce_mass = 1
-        self.min_hp = 1
 
     def update(self, dt):
         GameObject.update(self, dt)
@@ -250,13 +465,15 @@ class EnemyWeak(Enemy):
         UP = 4
         DOWN = 5
 
-    def __init__(self, image, pos, game_system_group):
-        Enemy.__init__(self, image, pos, game_system_group)
-        self.max_hp = 2
+    __slots__ = ("current_move_cycle_x", "current_move_cycle_y")
+    max_hp = 2
+    mass = 0.25
+    move_cycle_duration = 0.55
+    damage = 1
+
+    def reinit(self, image, pos, game_system_group):
+        Enemy.reinit(self, image, pos, game_system_group)
         self.hp = self.max_hp
-        self.mass = 0.25
-        self.move_cycle_duration = 0.55
-        self.damage = 1
         self.current_move_cycle_x = EnemyWeak.EnemyWeakMoveCycle.NONE_X
         self.current_move_cycle_y = EnemyWeak.EnemyWeakMoveCycle.NONE_Y
 
@@ -265,8 +482,8 @@ class EnemyWeak(Enemy):
         self.move_cycle_timer += dt
         if self.move_cycle_timer > self.move_cycle_duration:#choose by randomizer direction where enemy will go
             self.move_cycle_timer = 0
-            self.current_move_cycle_x = EnemyWeak.EnemyWeakMoveCycle(random.randint(0, 2))
-            self.current_move_cycle_y = EnemyWeak.EnemyWeakMoveCycle(random.randint(3, 5))
+            self.current_move_cycle_x = EnemyWeak.EnemyWeakMoveCycle(self.game_system_group.random.randint(0, 2))
+            self.current_move_cycle_y = EnemyWeak.EnemyWeakMoveCycle(self.game_system_group.random.randint(3, 5))
         if self.current_move_cycle_x == EnemyWeak.EnemyWeakMoveCycle.LEFT:
             self.go_left(dt)
         elif self.current_move_cycle_x == EnemyWeak.EnemyWeakMoveCycle.RIGHT:
@@ -277,27 +494,57 @@ class EnemyWeak(Enemy):
             self.go_down(dt)
 
 
+class DerivedValue():
+    """
+        Class attribute calculated from attributes of other classes at every read, so it follows their changes,
+        e.g. batch.py --set EnemyWeak.max_velocity=150 changes EnemyFast too. Assignment to the class attribute
+        replaces it with a fixed value.
+    """
+    def __init__(self, get_value):
+        """
+        :param get_value: function() -> value
+        """
+        self.get_value = get_value
+
+    def __get__(self, object, owner=None):
+        return self.get_value()
+
+
+class EnemyFast(EnemyWeak):
+    """
+        Faster and lighter EnemyWeak, which change direction more often.
+    """
+    __slots__ = ()
+    # differences between normal and speed enemy
+    max_velocity = DerivedValue(lambda: EnemyWeak.max_velocity * 1.3)
+    move_cycle_duration = DerivedValue(lambda: EnemyWeak.move_cycle_duration / 5.0)
+    mass = DerivedValue(lambda: EnemyWeak.mass / 1.2)
+    acceleration = DerivedValue(lambda: EnemyWeak.acceleration * 2.)
+
+
 class EnemyStrong(Enemy):
     """
         Enemy type with seperate AI.
     """
-    def __init__(self, image, pos, game_system_group):
-        Enemy.__init__(self, image, pos, game_system_group)
-        self.max_hp = 4
+    __slots__ = ("target_pos",)
+    max_hp = 4
+    mass = 10
+    max_velocity = 100.
+    move_cycle_duration = 3.
+    damage = 2
+    attack_wave_bounce_mass = 1
+
+    def reinit(self, image, pos, game_system_group):
+        Enemy.reinit(self, image, pos, game_system_group)
         self.hp = self.max_hp
-        self.mass = 10
-        self.max_velocity = 100.
-        self.move_cycle_duration = 3.
         self.target_pos = [0.0, 0.0]
-        self.damage = 2
-        self.attack_wave_bounce_mass = 1
 
     def update(self, dt):
         Enemy.update(self, dt)
         self.move_cycle_timer += dt
         if self.move_cycle_timer > self.move_cycle_duration:
             self.move_cycle_timer = 0
-            if random.randint(1, 1) == 1:
+            if self.game_system_group.random.randint(1, 1) == 1:
                 self.target_pos = self.game_system_group.player.pos
 
         if self.game_system_group.player.pos[0] < self.pos[0]:#follow player
@@ -313,9 +560,9 @@ class EnemyStrong(Enemy):
 class Bonus(GameObject):
     """
         Base class for all bonus object which can by take by player.
+        GameObjectsGroup removes it by scheduled expire_object() after time_to_live.
     """
-    def __init__(self, image, pos):
-        GameObject.__init__(self, image, pos)
+    __slots__ = ("time_to_live", "expiry_event")
 
     def use(self, player):
         pass
@@ -325,16 +572,12 @@ class Gold(Bonus):
     """
         Gold bonus which increase player gold.
     """
-    def __init__(self, image, pos, value):
-        Bonus.__init__(self, image, pos)
-        self.time_to_live = 3.0 + random.random() * 5.0
-        self.value = value
+    __slots__ = ("value",)
 
-    def update(self, dt):
-        GameObject.update(self, dt)
-        self.time_to_live -= dt
-        if self.time_to_live < 0:
-            self.alive = False
+    def reinit(self, image, pos, value, rng=random):
+        Bonus.reinit(self, image, pos)
+        self.time_to_live = 3.0 + rng.random() * 5.0
+        self.value = value
 
     def use(self, player):
         player.add_gold(self.value)
@@ -347,16 +590,12 @@ class HpBonus(Bonus):
     """
         HP bonus which increase player HP.
     """
-    def __init__(self, image, pos, value):
-        Bonus.__init__(self, image, pos)
-        self.time_to_live = 1.0 + random.random() * 4.0
-        self.value = value
+    __slots__ = ("value",)
 
-    def update(self, dt):
-        GameObject.update(self, dt)
-        self.time_to_live -= dt
-        if self.time_to_live < 0:
-            self.alive = False
+    def reinit(self, image, pos, value, rng=random):
+        Bonus.reinit(self, image, pos)
+        self.time_to_live = 1.0 + rng.random() * 4.0
+        self.value = value
 
     def use(self, player):
         player.add_hp(self.value)
@@ -369,15 +608,11 @@ class AttackBonus(Bonus):
     """
         AttackBonus bonus which increase player Attack to max value.
     """
-    def __init__(self, image, pos):
-        Bonus.__init__(self, image, pos)
-        self.time_to_live = 2.0 + random.random() * 3.0
+    __slots__ = ()
 
-    def update(self, dt):
-        GameObject.update(self, dt)
-        self.time_to_live -= dt
-        if self.time_to_live < 0:
-            self.alive = False
+    def reinit(self, image, pos, rng=random):
+        Bonus.reinit(self, image, pos)
+        self.time_to_live = 2.0 + rng.random() * 3.0
 
     def use(self, player):
         player.restore_attack()
@@ -386,7 +621,566 @@ class AttackBonus(Bonus):
         return "attack full restore"
 
 
-class GameObjectsGroup(pygame.sprite.Group):
+get_object_id = operator.attrgetter("object_id")
+get_pos = operator.attrgetter("pos")
+get_velocity = operator.attrgetter("velocity")
+get_physics_slot = operator.attrgetter("physics_slot")
+get_rect = operator.attrgetter("rect")
+get_center = operator.attrgetter("rect.center")
+get_hp = operator.attrgetter("hp")
+get_move_cycle_timer = operator.attrgetter("move_cycle_timer")
+get_time_to_live = operator.attrgetter("time_to_live")
+get_expiry_event = operator.attrgetter("expiry_event")
+get_value = operator.attrgetter("_value_")  # value of Enum member without property
+get_x = operator.itemgetter(0)
+get_y = operator.itemgetter(1)
+
+
+def get_radius(game_object):
+    """
+        Radius of circle used by collide_circle(): own radius of AttackWave, half of rect diagonal for other objects.
+    """
+    if type(game_object) is AttackWave:
+        return game_object.radius
+    rect = game_object.rect
+    return 0.5 * ((rect[2] ** 2 + rect[3] ** 2) ** 0.5)
+
+
+def collide_circle(a, b):
+    """
+        The same test as pygame.sprite.collide_circle, but radius is calculated every time. pygame stores
+        calculated radius on object, it would stay on pooled object with other image.
+    :return: True if circles of a and b overlap
+    """
+    x_distance = a.rect.centerx - b.rect.centerx
+    y_distance = a.rect.centery - b.rect.centery
+    return x_distance ** 2 + y_distance ** 2 <= (get_radius(a) + get_radius(b)) ** 2
+
+
+def collision_bounds(game_object):
+    """
+        Square which contains every shape used by collide_rect and collide_circle for game_object.
+    :param game_object: GameObject
+    :return: [x, y, w, h]
+    """
+    half_size = get_radius(game_object)
+    center = game_object.rect.center
+    return [center[0] - half_size, center[1] - half_size, 2 * half_size, 2 * half_size]
+
+
+class SpatialHash():
+    """
+        Uniform grid over play_area. It is broad phase for collisions - only objects from nearby cells
+        are tested by collide_rect/collide_circle().
+        Object is stored only in the cell with its center, so query bounds are extended by the biggest
+        collision radius of stored objects.
+    """
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = dict()  # (cell_x, cell_y) -> dict used as ordered set of objects
+        self.object_cells = dict()  # object -> (cell_x, cell_y)
+        self.max_half_size = 0.0
+
+    def insert(self, object):
+        bounds = collision_bounds(object)
+        if bounds[2] / 2 > self.max_half_size:
+            self.max_half_size = bounds[2] / 2
+        self.update(object)
+
+    def update(self, object):
+        """
+            Move object to the cell with its center. Nothing is done if object still is in the same cell.
+        """
+        center = object.rect.center
+        cell_key = (center[0] // self.cell_size, center[1] // self.cell_size)
+        old_cell_key = self.object_cells.get(object)
+        if old_cell_key == cell_key:
+            return
+        if old_cell_key is not None:
+            self.unlink(object, old_cell_key)
+        self.object_cells[object] = cell_key
+        cell = self.cells.get(cell_key)
+        if cell is None:
+            cell = self.cells[cell_key] = dict()
+        cell[object] = None
+
+    def update_objects(self, objects):
+        """
+            update() of objects which are in another cell now, cells are compared without Python loop. If most
+            objects moved, the whole hash is built again.
+        """
+        if 2 * len(objects) > len(self.object_cells):
+            self.rebuild()
+            return
+        for object in itertools.compress(objects, map(operator.ne, self.get_cell_keys(objects),
+                                                      map(self.object_cells.get, objects))):
+            self.update(object)
+
+    def rebuild(self):
+        """
+            Put every object into the cell with its center, cell keys are calculated without Python loop.
+        """
+        objects = list(self.object_cells)
+        cell_keys = self.get_cell_keys(objects)
+        self.object_cells = dict(zip(objects, cell_keys))
+        self.cells = cells = dict()
+        for object, cell_key in zip(objects, cell_keys):
+            cell = cells.get(cell_key)
+            if cell is None:
+                cell = cells[cell_key] = dict()
+            cell[object] = None
+
+    def get_cell_keys(self, objects):
+        """
+        :return: list with (cell_x, cell_y) of every object
+        """
+        size = self.cell_size
+        centers = list(map(get_center, objects))
+        return list(zip(map(operator.floordiv, map(operator.itemgetter(0), centers), itertools.repeat(size)),
+                        map(operator.floordiv, map(operator.itemgetter(1), centers), itertools.repeat(size))))
+
+    def remove(self, object):
+        cell_key = self.object_cells.pop(object, None)
+        if cell_key is not None:
+            self.unlink(object, cell_key)
+
+    def unlink(self, object, cell_key):
+        cell = self.cells[cell_key]
+        del cell[object]
+        if not cell:
+            del self.cells[cell_key]
+
+    def query(self, bounds):
+        """
+            Objects which can collide with something inside bounds, every object once, in order of object_id.
+            Order of objects inside cells depends on their moves, so it isn't used - restored game must collide
+            objects in the same order as the original one.
+        :return: list
+        """
+        size = self.cell_size
+        margin = self.max_half_size
+        min_x = int((bounds[0] - margin) // size)
+        min_y = int((bounds[1] - margin) // size)
+        max_x = int((bounds[0] + bounds[2] + margin) // size)
+        max_y = int((bounds[1] + bounds[3] + margin) // size)
+        found = dict()
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                cell = self.cells.get((x, y))
+                if cell is not None:
+                    found.update(cell)
+        return sorted(found, key=get_object_id)
+
+
+class VectorizedPhysics():
+    """
+        Structure of arrays with positions, velocities, friction, max_velocity and rect sizes of GameObjects.
+        Friction, bounce from play_area border and new positions are calculated for all objects at once.
+        pos and velocity stay plain lists of every object, so per-object code (collisions, bounce, drawing) is as
+        fast as without numpy. They are copied into arrays by read_objects() and back by step(), once per update.
+        Move cycles of enemies are kept here too and think() replaces their update(), move_cycle_timer and
+        current_move_cycle_x/y of enemy are written back when it is removed.
+    """
+    ARRAYS = ("pos", "velocity", "size", "friction", "max_velocity", "active", "int_pos", "acceleration", "ai",
+              "move_cycle_timer", "move_cycle_duration", "direction", "order")
+    AI_NONE = 0
+    AI_RANDOM_WALK = 1  # EnemyWeak and EnemyFast
+    AI_CHASE = 2  # EnemyStrong
+    X_DIRECTIONS = (0, -1, 1)  # EnemyWeakMoveCycle NONE_X, LEFT, RIGHT
+    Y_DIRECTIONS = (0, -1, 1)  # EnemyWeakMoveCycle NONE_Y, UP, DOWN
+
+    def __init__(self, play_area, capacity=64):
+        self.play_area = play_area
+        self.count = 0
+        self.objects = []  # slot -> object
+        self.added = []  # objects without slot yet, flush() writes them at once
+        self.removed = []  # slots of removed objects, flush() drops their rows at once
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        """
+            Create arrays for capacity objects and copy old values.
+        """
+        old_arrays = [getattr(self, name, None) for name in VectorizedPhysics.ARRAYS]
+        self.capacity = capacity
+        self.pos = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.size = numpy.zeros((capacity, 2))
+        self.friction = numpy.zeros(capacity)
+        self.max_velocity = numpy.zeros(capacity)
+        self.active = numpy.zeros(capacity, dtype=bool)
+        self.int_pos = numpy.zeros((capacity, 2), dtype=numpy.int64)  # last pos written into rect
+        self.acceleration = numpy.zeros(capacity)
+        self.ai = numpy.zeros(capacity, dtype=numpy.int8)
+        self.move_cycle_timer = numpy.zeros(capacity)
+        self.move_cycle_duration = numpy.zeros(capacity)
+        self.direction = numpy.zeros((capacity, 2), dtype=numpy.int8)  # -1, 0 or 1 on every axis
+        self.order = numpy.zeros(capacity, dtype=numpy.int64)  # object_id, order of GameObjectsGroup
+        for name, old_array in zip(VectorizedPhysics.ARRAYS, old_arrays):
+            if old_array is not None:
+                getattr(self, name)[:self.count] = old_array[:self.count]
+
+    def add(self, object):
+        """
+            Object gets its slot at the next flush(), a few numpy writes per update are cheaper than per object.
+        """
+        object.physics_slot = None
+        self.added.append(object)
+
+    def flush(self):
+        """
+            Drop rows of removed objects and write rows of added objects.
+        """
+        removed = self.removed
+        if removed:
+            count = self.count
+            kept = count - len(removed)
+            keep = numpy.ones(count, dtype=bool)
+            keep[removed] = False
+            for name in VectorizedPhysics.ARRAYS:
+                array = getattr(self, name)
+                array[:kept] = array[:count][keep]
+            self.objects = list(itertools.compress(self.objects, keep.tolist()))
+            list(map(setattr, self.objects, itertools.repeat("physics_slot"), range(kept)))
+            self.count = kept
+            del removed[:]
+        added = self.added
+        if not added:
+            return
+        start = self.count
+        if start + len(added) > self.capacity:
+            self.allocate(max(self.capacity * 2, start + len(added)))
+        end = start + len(added)
+        self.count = end
+        self.objects.extend(added)
+        ai = []
+        directions = []
+        timers = []
+        durations = []
+        for slot, object in enumerate(added, start):
+            object.physics_slot = slot
+            if isinstance(object, EnemyWeak):
+                ai.append(VectorizedPhysics.AI_RANDOM_WALK)
+                directions.append((VectorizedPhysics.X_DIRECTIONS[object.current_move_cycle_x.value],
+                                   VectorizedPhysics.Y_DIRECTIONS[object.current_move_cycle_y.value - 3]))
+            elif isinstance(object, EnemyStrong):
+                ai.append(VectorizedPhysics.AI_CHASE)
+                directions.append((0, 0))
+            else:
+                ai.append(VectorizedPhysics.AI_NONE)
+                directions.append((0, 0))
+            if ai[-1] != VectorizedPhysics.AI_NONE:
+                timers.append(object.move_cycle_timer)
+                durations.append(object.move_cycle_duration)
+            else:
+                timers.append(0.0)
+                durations.append(0.0)
+        self.size[start:end] = [object.rect.size for object in added]
+        self.friction[start:end] = [object.friction for object in added]
+        self.max_velocity[start:end] = [object.max_velocity for object in added]
+        self.active[start:end] = True
+        self.int_pos[start:end] = [object.rect.topleft for object in added]
+        self.acceleration[start:end] = [object.acceleration for object in added]
+        self.order[start:end] = [object.object_id for object in added]
+        self.ai[start:end] = ai
+        self.direction[start:end] = directions
+        self.move_cycle_timer[start:end] = timers
+        self.move_cycle_duration[start:end] = durations
+        del added[:]
+
+    def read_objects(self):
+        """
+            flush() and copy pos and velocity of every object into arrays.
+        """
+        self.flush()
+        count = self.count
+        if count:
+            chain = itertools.chain.from_iterable
+            self.pos[:count] = numpy.fromiter(chain(map(get_pos, self.objects)), float, 2 * count).reshape(count, 2)
+            self.velocity[:count] = numpy.fromiter(chain(map(get_velocity, self.objects)), float,
+                                                   2 * count).reshape(count, 2)
+
+    def remove(self, object):
+        """
+            Move cycle is written back into object, its row is dropped by the next flush().
+        """
+        slot = object.physics_slot
+        if slot is None:  # not flushed yet
+            self.added.remove(object)
+            return
+        object.physics_slot = None
+        if self.ai[slot] != VectorizedPhysics.AI_NONE:
+            object.move_cycle_timer = float(self.move_cycle_timer[slot])
+        if self.ai[slot] == VectorizedPhysics.AI_RANDOM_WALK:
+            object.current_move_cycle_x = EnemyWeak.EnemyWeakMoveCycle(
+                VectorizedPhysics.X_DIRECTIONS.index(self.direction[slot, 0]))
+            object.current_move_cycle_y = EnemyWeak.EnemyWeakMoveCycle(
+                3 + VectorizedPhysics.Y_DIRECTIONS.index(self.direction[slot, 1]))
+        self.removed.append(slot)
+
+    def arrange(self, objects):
+        """
+            Move rows, so objects[index] is in slot index, e.g. restored columns of snapshot are written by slices.
+        :param objects: all objects of physics
+        """
+        if not self.removed:
+            self.flush()
+            if objects == self.objects:
+                return
+        del self.removed[:]  # rows of removed objects aren't selected below
+        self.flush()
+        count = len(objects)
+        slots = numpy.fromiter(map(get_physics_slot, objects), numpy.intp, count)
+        for name in VectorizedPhysics.ARRAYS:
+            array = getattr(self, name)
+            array[:count] = array[slots]
+        self.objects = list(objects)
+        self.count = count
+        list(map(setattr, objects, itertools.repeat("physics_slot"), range(count)))
+
+    def deactivate(self, object):
+        """
+            Object isn't moved any more (it is dead and will be removed).
+        """
+        self.active[object.physics_slot] = False
+
+    def think(self, dt, player_pos, random):
+        """
+            Same calculation as update() of every EnemyWeak, EnemyFast and EnemyStrong (without death check).
+            Move cycle timers are advanced at once, new random directions are drawn only for enemies with
+            expired timer in order of object_id (order of adding), so random numbers are the same as drawn by
+            per-object updates.
+            Then go_left/go_right/go_up/go_down are applied to velocities of all enemies.
+            Only AI and movement (step()) are batched. Collisions and bounce stay per-object: they touch only
+            the few objects found by SpatialHash near the player and attack waves, and they work on plain lists.
+        :param player_pos: [x, y] of player, EnemyStrong follows it
+        :param random: random.Random of the game
+        """
+        count = self.count
+        ai = self.ai[:count]
+        enemies = ai != VectorizedPhysics.AI_NONE
+        timer = self.move_cycle_timer[:count]
+        numpy.add(timer, dt, out=timer, where=enemies)
+        expired = numpy.flatnonzero(enemies & (timer > self.move_cycle_duration[:count]))
+        if len(expired):
+            timer[expired] = 0.0
+            expired = expired[numpy.argsort(self.order[expired], kind="stable")]
+            walking = []
+            directions = []
+            randint = random.randint
+            for slot, kind in zip(expired.tolist(), ai[expired].tolist()):
+                if kind == VectorizedPhysics.AI_RANDOM_WALK:
+                    walking.append(slot)
+                    directions.append((VectorizedPhysics.X_DIRECTIONS[randint(0, 2)],
+                                       VectorizedPhysics.Y_DIRECTIONS[randint(3, 5) - 3]))
+                elif randint(1, 1) == 1:  # the same draw as EnemyStrong.update
+                    self.objects[slot].target_pos = player_pos
+            if walking:
+                self.direction[walking] = directions
+
+        pos = self.pos[:count]
+        direction = self.direction[:count]
+        chase = (ai == VectorizedPhysics.AI_CHASE)[:, None]
+        direction[:] = numpy.where(chase, numpy.where(numpy.array(player_pos) < pos, -1, 1), direction)
+
+        # go_right for direction 1 and go_left for direction -1
+        velocity = self.velocity[:count]
+        max_velocity = self.max_velocity[:count, None]
+        acceleration = (self.acceleration[:count] * dt)[:, None]
+        faster = velocity + acceleration
+        slower = velocity - acceleration
+        velocity[:] = numpy.where(
+            direction > 0,
+            numpy.where(faster > max_velocity, numpy.where(velocity < max_velocity, max_velocity, velocity), faster),
+            numpy.where(direction < 0,
+                        numpy.where(-slower > max_velocity,
+                                    numpy.where(-velocity < max_velocity, -max_velocity, velocity), slower),
+                        velocity))
+
+    def step(self, dt):
+        """
+            Same calculation as GameObjectsGroup.move for every active object. Move cycle of enemy which hit
+            border ends in the next think(). New pos and velocity are written back into objects.
+        :return: objects with new rect position
+        """
+        count = self.count
+        pos = self.pos[:count]
+        velocity = self.velocity[:count]
+        active = self.active[:count, None]
+
+        # friction
+        friction = (self.friction[:count] * dt)[:, None]
+        velocity[:] = numpy.where(active & (velocity > 0.0), numpy.maximum(velocity - friction, 0.0),
+                                  numpy.where(active & (velocity < 0.0), numpy.minimum(velocity + friction, 0.0),
+                                              velocity))
+
+        # border of play_area = [point_x,point_y,w,h]
+        low = numpy.array(self.play_area[0:2], dtype=float)
+        high = numpy.array(self.play_area[2:4], dtype=float)
+        size = self.size[:count]
+        below = active & (pos < low)
+        above = active & ~below & (pos + size > high)
+        hit = below | above
+        pos[:] = numpy.where(below, low, numpy.where(above, high - size, pos))
+        velocity[:] = numpy.where(hit, -1.0 * velocity, velocity)
+        timer = self.move_cycle_timer[:count]
+        timer[:] = numpy.where(hit.any(axis=1) & (self.ai[:count] != VectorizedPhysics.AI_NONE),
+                               self.move_cycle_duration[:count] + dt, timer)
+
+        # calculation new position -> pos = velocity * dt
+        pos[:] = numpy.where(active, pos + velocity * dt, pos)
+
+        # pos and velocity back into objects
+        objects = self.objects
+        list(map(setattr, objects, itertools.repeat("pos"), pos.tolist()))
+        list(map(setattr, objects, itertools.repeat("velocity"), velocity.tolist()))
+
+        # write back into rect only for changed integer positions
+        int_pos = pos.astype(numpy.int64)
+        moved = numpy.flatnonzero((int_pos != self.int_pos[:count]).any(axis=1))
+        self.int_pos[:count] = int_pos
+        moved_objects = []
+        for slot, xy in zip(moved.tolist(), int_pos[moved].tolist()):
+            object = objects[slot]
+            object.rect.topleft = xy
+            moved_objects.append(object)
+        return moved_objects
+
+
+class GameEvent():
+    """
+        Types of gameplay events. Simulation appends them as plain data to GameObjectsGroup.events,
+        EventPresenter turns them into pop-up labels once per frame.
+    """
+    Hit = namedtuple("Hit", ("enemy_type", "pos", "damage"))  # AttackWave hurt enemy
+    PlayerDamaged = namedtuple("PlayerDamaged", ("pos", "damage", "hp"))
+    BonusCollected = namedtuple("BonusCollected", ("bonus_type", "pos", "description"))
+    EnemyKilled = namedtuple("EnemyKilled", ("enemy_type", "pos"))
+    WaveSpawned = namedtuple("WaveSpawned", ("pos", "attack_level"))
+    PlayerDied = namedtuple("PlayerDied", ("pos", "gold"))
+
+
+class Scheduler():
+    """
+        Events on simulation time of GameObjectsGroup, kept in a heap. advance() calls only callbacks of events
+        which are due, so waiting objects cost nothing per update. Events with the same time are called in order
+        of scheduling.
+    """
+    def __init__(self):
+        self.time = 0.0  # simulation time, during callback it is time of its event
+        self.events = []  # heap of [time, number, callback, args]
+        self.scheduled = 0
+
+    def schedule(self, delay, callback, *args):
+        """
+            Call callback(*args) delay seconds after current time.
+        :return: event for cancel()
+        """
+        event = [self.time + delay, self.scheduled, callback, args]
+        self.scheduled += 1
+        heapq.heappush(self.events, event)
+        return event
+
+    def cancel(self, event):
+        """
+            Event stays in heap, but nothing is called.
+        """
+        event[2] = None
+
+    def get_remaining_time(self, event):
+        return event[0] - self.time
+
+    def advance(self, dt):
+        """
+            Move time by dt and call callbacks of all events which are due.
+        :return: number of called callbacks
+        """
+        end_time = self.time + dt
+        events = self.events
+        called = 0
+        while events and events[0][0] <= end_time:
+            event = heapq.heappop(events)
+            if event[2] is not None:
+                self.time = event[0]  # events scheduled by callback are counted from time of this event
+                event[2](*event[3])
+                called += 1
+        self.time = end_time
+        return called
+
+    def __len__(self):
+        return len(self.events)
+
+
+class ObjectPool():
+    """
+        Free instances of one GameObject class. get() reinits free instance instead of creating new one,
+        release() takes instance back when it is removed from game.
+    """
+    def __init__(self, cls, max_size=256):
+        """
+        :param cls: class with reinit() which takes the same arguments as constructor
+        :param max_size: more released instances are left to garbage collector
+        """
+        self.cls = cls
+        self.max_size = max_size
+        self.free = []
+        self.in_use = 0
+        self.high_water_mark = 0  # max instances in use at once
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, *args):
+        if self.free:
+            object = self.free.pop()
+            object.reinit(*args)
+            self.hits += 1
+        else:
+            object = self.cls(*args)
+            self.misses += 1
+        self.in_use += 1
+        if self.in_use > self.high_water_mark:
+            self.high_water_mark = self.in_use
+        return object
+
+    def release(self, object):
+        if self.in_use > 0:
+            self.in_use -= 1
+        if len(self.free) < self.max_size:
+            self.free.append(object)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return dict(size=len(self.free), in_use=self.in_use, high_water_mark=self.high_water_mark,
+                    hits=self.hits, misses=self.misses, hit_rate=self.hits / requests if requests else 0.0)
+
+
+class ObjectGroup(pygame.sprite.Group):
+    """
+        pygame.sprite.Group of GameObjects. They aren't pygame.sprite.Sprite, so add(), remove() and has() don't
+        go through pygame's slow path for other objects.
+    """
+    def add(self, *objects):
+        for object in objects:
+            if object not in self.spritedict:
+                self.add_internal(object)
+                object.add_internal(self)
+
+    def remove(self, *objects):
+        for object in objects:
+            if object in self.spritedict:
+                self.remove_internal(object)
+                object.remove_internal(self)
+
+    def has(self, *objects):
+        if not objects:
+            return False
+        for object in objects:
+            if object not in self.spritedict:
+                return False
+        return True
+
+
+class GameObjectsGroup(ObjectGroup):
     """
         Container for storing,drawing and updating GameObjects.
     """
@@ -394,80 +1188,241 @@ class GameObjectsGroup(pygame.sprite.Group):
         """
             It spawn objects like Enemyof Bonus on play_area
         """
+        # delays between spawns in seconds, (base, random part)
+        enemy_spawn_interval = (3.0, 5.0)
+        gold_spawn_interval = (0.25, 2.0)
+        hp_spawn_interval = (2.5, 10.0)
+        attack_bonus_spawn_interval = (2.0, 10.0)
+
         def __init__(self, game_object_group):
+            """
+                Every kind of object is spawned by event of Scheduler, which schedules the next one.
+                The first objects are spawned at the first update.
+            """
             self.game_objects_group = game_object_group
-            self.EnemyWeak_spawn_delay = 0.0
-            self.gold_spawn_delay = 0.0
-            self.hp_spawn_delay = 0.0
-            self.attack_bonus_spawn_delay = 0.0
-
-        def spawn(self, dt):
-            # Enemy spawn
-            self.EnemyWeak_spawn_delay -= dt
-            if self.EnemyWeak_spawn_delay <= 0.0:
-                self.EnemyWeak_spawn_delay += random.random() * 5 + 3.0
-                enemy_position = self.game_objects_group.get_random_pos_on_game_arena();
-
-                rand_result = random.randint(0, 20)
-                if rand_result < 3:
-                    speed_enemy = EnemyWeak(self.game_objects_group.app.get_resource("enemy3"), enemy_position,
-                                            self.game_objects_group)
-                    speed_enemy.max_velocity *= 1.3#differences between normal and speed enemy
-                    speed_enemy.move_cycle_duration /= 5.0
-                    speed_enemy.mass /= 1.2
-                    speed_enemy.acceleration *= 2.
-                    self.game_objects_group.add(speed_enemy)
-                elif rand_result < 6:
-                    self.game_objects_group.add(
-                        EnemyStrong(self.game_objects_group.app.get_resource("enemy2"), enemy_position,
-                                    self.game_objects_group))
-                else:
-                    self.game_objects_group.add(
-                        EnemyWeak(self.game_objects_group.app.get_resource("enemy1"), enemy_position,
-                                  self.game_objects_group))
-            # Gold spawn
-            self.gold_spawn_delay -= dt
-            if self.gold_spawn_delay <= 0.0:
-                self.gold_spawn_delay += 0.25 + random.random() * 2.0
-                gold_position = self.game_objects_group.get_random_pos_on_game_arena();
-                if random.randint(1, 10) == 1:#random amount of gold
-                    if random.randint(1, 10) == 1:
-                        gold_value = random.randint(80, 100)
-                    else:
-                        gold_value = random.randint(40, 80)
-                else:
-                    gold_value = random.randint(10, 30)
+            scheduler = game_object_group.scheduler
+            scheduler.schedule(0.0, self.spawn_enemy)
+            scheduler.schedule(0.0, self.spawn_gold)
+            scheduler.schedule(0.0, self.spawn_hp_bonus)
+            scheduler.schedule(0.0, self.spawn_attack_bonus)
+            self.max_enemies = None  # limits of spawned objects, None - no limit
+            self.max_bonuses = None
+
+        def set_limits(self, max_enemies, max_bonuses):
+            """
+                App gives limits of FrameGovernor under load, objects above them aren't spawned.
+            """
+            self.max_enemies = max_enemies
+            self.max_bonuses = max_bonuses
+
+        @staticmethod
+        def is_limit_reached(index, limit):
+            """
+            :param index: index of GameObjectsGroup with objects of spawned kind
+            :param limit: max_enemies or max_bonuses
+            """
+            return limit is not None and len(index) >= limit
+
+        def spawn_enemy(self):
+            random = self.game_objects_group.random  # seeded generator of the game
+            self.game_objects_group.scheduler.schedule(
+                random.random() * self.enemy_spawn_interval[1] + self.enemy_spawn_interval[0], self.spawn_enemy)
+            if self.is_limit_reached(self.game_objects_group.enemies, self.max_enemies):
+                return
+            enemy_position = self.game_objects_group.get_random_pos_on_game_arena();
+
+            rand_result = random.randint(0, 20)
+            if rand_result < 3:
                 self.game_objects_group.add(
-                    Gold(self.game_objects_group.app.get_resource("gold"), gold_position, gold_value))
-            # bonus HpPoints spawn
-            self.hp_spawn_delay -= dt
-            if self.hp_spawn_delay <= 0.0:
-                self.hp_spawn_delay += 2.5 + random.random() * 10.0
-                hp_position = self.game_objects_group.get_random_pos_on_game_arena();
+                    self.game_objects_group.new_object(
+                        EnemyFast, self.game_objects_group.app.get_resource("enemy3"), enemy_position,
+                        self.game_objects_group))
+            elif rand_result < 6:
                 self.game_objects_group.add(
-                    HpBonus(self.game_objects_group.app.get_resource("hp"), hp_position, 1))
-            # bonus AttackBonus spawn
-            self.attack_bonus_spawn_delay -= dt
-            if self.attack_bonus_spawn_delay <= 0.0:
-                self.attack_bonus_spawn_delay += 2. + random.random() * 10.0
-                attack_bonus_position = self.game_objects_group.get_random_pos_on_game_arena();
+                    self.game_objects_group.new_object(
+                        EnemyStrong, self.game_objects_group.app.get_resource("enemy2"), enemy_position,
+                        self.game_objects_group))
+            else:
                 self.game_objects_group.add(
-                    AttackBonus(self.game_objects_group.app.get_resource("attack"), attack_bonus_position))
-
-    def __init__(self, play_area, app):
+                    self.game_objects_group.new_object(
+                        EnemyWeak, self.game_objects_group.app.get_resource("enemy1"), enemy_position,
+                        self.game_objects_group))
+
+        def spawn_gold(self):
+            random = self.game_objects_group.random
+            self.game_objects_group.scheduler.schedule(
+                self.gold_spawn_interval[0] + random.random() * self.gold_spawn_interval[1], self.spawn_gold)
+            if self.is_limit_reached(self.game_objects_group.bonuses, self.max_bonuses):
+                return
+            gold_position = self.game_objects_group.get_random_pos_on_game_arena();
+            if random.randint(1, 10) == 1:#random amount of gold
+                if random.randint(1, 10) == 1:
+                    gold_value = random.randint(80, 100)
+                else:
+                    gold_value = random.randint(40, 80)
+            else:
+                gold_value = random.randint(10, 30)
+            self.game_objects_group.add(
+                self.game_objects_group.new_object(
+                    Gold, self.game_objects_group.app.get_resource("gold"), gold_position, gold_value, random))
+
+        def spawn_hp_bonus(self):
+            random = self.game_objects_group.random
+            self.game_objects_group.scheduler.schedule(
+                self.hp_spawn_interval[0] + random.random() * self.hp_spawn_interval[1], self.spawn_hp_bonus)
+            if self.is_limit_reached(self.game_objects_group.bonuses, self.max_bonuses):
+                return
+            hp_position = self.game_objects_group.get_random_pos_on_game_arena();
+            self.game_objects_group.add(
+                self.game_objects_group.new_object(
+                    HpBonus, self.game_objects_group.app.get_resource("hp"), hp_position, 1, random))
+
+        def spawn_attack_bonus(self):
+            random = self.game_objects_group.random
+            self.game_objects_group.scheduler.schedule(
+                self.attack_bonus_spawn_interval[0] + random.random() * self.attack_bonus_spawn_interval[1],
+                self.spawn_attack_bonus)
+            if self.is_limit_reached(self.game_objects_group.bonuses, self.max_bonuses):
+                return
+            attack_bonus_position = self.game_objects_group.get_random_pos_on_game_arena();
+            self.game_objects_group.add(
+                self.game_objects_group.new_object(
+                    AttackBonus, self.game_objects_group.app.get_resource("attack"), attack_bonus_position,
+                    random))
+
+    def __init__(self, play_area, app, vectorized_physics=False, seed=None):
+        """
+        :param seed: seed of random generator used by every random decision in this game
+        """
         self.play_area = play_area
+        self.random = random.Random(seed)
         pygame.sprite.Group.__init__(self)
+        self.scheduler = Scheduler()  # spawns, lifetimes of bonuses and labels, cooldowns of player
         self.spawn_engine = GameObjectsGroup.SpawnEngine(self)
-        self.pop_up_label_group = pygame.sprite.Group()
+        self.pop_up_label_group = ObjectGroup()
         self.app = app
+        # separate indexes for every kind of GameObject, dicts are used as ordered sets
+        self.players = dict()
+        self.enemies = dict()
+        self.attack_waves = dict()
+        self.bonuses = dict()
+        self.others = dict()
+        self.enemies_hash = SpatialHash()  # broad phase for collisions
+        self.bonuses_hash = SpatialHash()
+        self.keep_previous_positions = False  # needed by interpolate()
+        self.events = None  # list of GameEvents for EventPresenter, None - events are not needed
+        self.next_object_id = 0  # every added object gets the next id, so order of objects is order of ids
+        # short-lived objects are reused, it avoids garbage collector pauses
+        self.pools = dict((cls, ObjectPool(cls)) for cls in
+                          (PopUpLabel, Gold, HpBonus, AttackBonus, EnemyWeak, EnemyFast, EnemyStrong))
+        self.physics = None  # optional VectorizedPhysics for enemies and bonuses
+        if vectorized_physics:
+            if numpy is None:
+                print("numpy is not available, vectorized physics disabled.")
+            else:
+                self.physics = VectorizedPhysics(play_area)
+
+    def get_index(self, sprite):
+        if isinstance(sprite, Enemy):
+            return self.enemies
+        elif isinstance(sprite, Bonus):
+            return self.bonuses
+        elif isinstance(sprite, AttackWave):
+            return self.attack_waves
+        elif isinstance(sprite, Player):
+            return self.players
+        return self.others
+
+    def add_internal(self, sprite, *args):
+        pygame.sprite.Group.add_internal(self, sprite, *args)
+        sprite.object_id = self.next_object_id
+        self.next_object_id += 1
+        index = self.get_index(sprite)
+        index[sprite] = None
+        if index is self.enemies:
+            self.enemies_hash.insert(sprite)
+        elif index is self.bonuses:
+            if self.physics is None:  # bonus doesn't move, it is only placed inside play_area
+                self.move(sprite, 0.0)
+                sprite.rect[0] = int(sprite.pos[0])
+                sprite.rect[1] = int(sprite.pos[1])
+            self.bonuses_hash.insert(sprite)
+            sprite.expiry_event = self.scheduler.schedule(sprite.time_to_live, self.expire_object, sprite)
+        if self.physics is not None and (index is self.enemies or index is self.bonuses):
+            self.physics.add(sprite)
+
+    def remove_internal(self, sprite):
+        pygame.sprite.Group.remove_internal(self, sprite)
+        index = self.get_index(sprite)
+        del index[sprite]
+        if index is self.enemies:
+            self.enemies_hash.remove(sprite)
+        elif index is self.bonuses:
+            self.bonuses_hash.remove(sprite)
+            self.scheduler.cancel(sprite.expiry_event)
+        if self.physics is not None and (index is self.enemies or index is self.bonuses):
+            self.physics.remove(sprite)
+
+    def new_object(self, cls, *args):
+        """
+            New object of pooled class, e.g. new_object(Gold, image, pos, value)
+        """
+        return self.pools[cls].get(*args)
+
+    def release_object(self, object):
+        """
+            Give back object removed from game, so new_object() can reuse it.
+        """
+        pool = self.pools.get(type(object))
+        if pool is None:
+            return
+        if isinstance(object, Enemy):  # reused enemy must be hittable by current waves
+            for attack_wave in self.attack_waves:
+                if object in attack_wave.attacked_by_self:
+                    attack_wave.attacked_by_self.remove(object)
+        pool.release(object)
+
+    def pool_stats(self):
+        """
+        :return: dict class name -> ObjectPool.stats()
+        """
+        return dict((cls.__name__, pool.stats()) for cls, pool in self.pools.items())
 
     def add_pop_up_label(self,pop_up_label):
         self.pop_up_label_group.add(pop_up_label)
+        pop_up_label.expiry_event = self.scheduler.schedule(pop_up_label.live_time, self.expire_object, pop_up_label)
+
+    def expire_object(self, object):
+        """
+            Scheduled end of bonus or pop-up label, it is removed and given back to its pool.
+        """
+        object.kill()
+        if self.has_internal(object):
+            object.remove(self)
+        elif self.pop_up_label_group.has(object):
+            object.remove(self.pop_up_label_group)
+        else:  # already removed
+            return
+        self.release_object(object)
 
     def add_player(self, player):
         self.add(player)
         self.player = player
 
+    def sort_objects(self, indexes=True):
+        """
+            Put objects back in order of adding (order of object_id), e.g. after WorldSnapshot.restore() added
+            objects with old ids. Order of updates and of drawn random numbers depends on it.
+        :param indexes: sort also enemies, bonuses and attack_waves, restore() fills them in order itself
+        """
+        sprites = sorted(self.spritedict, key=get_object_id)
+        self.spritedict = dict(zip(sprites, map(self.spritedict.__getitem__, sprites)))
+        if not indexes:
+            return
+        self.enemies = dict.fromkeys(sorted(self.enemies, key=get_object_id))
+        self.bonuses = dict.fromkeys(sorted(self.bonuses, key=get_object_id))
+        self.attack_waves = dict.fromkeys(sorted(self.attack_waves, key=get_object_id))
+
     def bounce(self, a, b):
         """
             Bounce GameObject a from b by using conservation of momentum
@@ -475,7 +1430,8 @@ class GameObjectsGroup(pygame.sprite.Group):
         momentum = [0.0, 0.0]
         direction_vec = [0.0, 0.0]
         vec_length = lambda vec: (vec[0] ** 2 + vec[1] ** 2) ** 0.5
-        normalize = lambda vec: [vec[0] / vec_length(vec), vec[1] / vec_length(vec)]
+        # objects in the same place have no direction
+        normalize = lambda vec: [vec[0] / vec_length(vec), vec[1] / vec_length(vec)] if vec_length(vec) else vec
         for x in range(len(a.pos)):
             momentum[x] = a.velocity[x] * a.mass + b.velocity[x] * b.mass
             direction_vec[x] = b.pos[x] - a.pos[x]
@@ -486,98 +1442,1640 @@ class GameObjectsGroup(pygame.sprite.Group):
                 b.velocity[x] = direction_vec[x] * momentum_length / b.mass
 
     def draw(self,surface):
-        pygame.sprite.Group.draw(self,surface)
-        self.pop_up_label_group.draw(surface)
+        """
+            Draw game objects and then pop-up labels by one batched blit from texture atlas.
+        """
+        surface.blits(self.app.get_atlas().get_blits(self.sprites() + self.pop_up_label_group.sprites()), False)
+
+    def move(self, object, dt):
+        """
+            Friction, bounce from play_area border and new position of object.
+        :return: True if object hit border
+        """
+        for x in range(len(object.velocity)):  # friction
+            if object.velocity[x] > 0.0:
+                object.velocity[x] -= object.friction * dt
+                if object.velocity[x] < 0.0:
+                    object.velocity[x] = 0.0
+            elif object.velocity[x] < 0.0:
+                object.velocity[x] += object.friction * dt
+                if object.velocity[x] > 0.0:
+                    object.velocity[x] = 0.0
+
+        border_hit = False
+        for i in range(len(object.pos)):  # if object hit border of play_area
+            if object.pos[i] < self.play_area[i]:  # play_area = [point_x,point_y,w,h]
+                object.pos[i] = self.play_area[i]
+                object.velocity[i] = -1.0 * object.velocity[i]
+                border_hit = True
+            # i+1,i+2 -> 3,4 -> right and down wall
+            elif object.pos[i] + object.rect[i + 2] > self.play_area[i + 2]:
+                object.pos[i] = self.play_area[i + 2] - object.rect[i + 2]
+                object.velocity[i] = -1.0 * object.velocity[i]
+                border_hit = True
+
+        # calculation new position -> pos = velocity * dt
+        object.pos = [object.pos[0] + object.velocity[0] * dt, object.pos[1] + object.velocity[1] * dt]
+        return border_hit
+
+    def update_vectorized(self, dt, to_remove):
+        """
+            Death check of enemies, VectorizedPhysics think for enemies and step for enemies and bonuses.
+            This is the only part of update() which is faster with numpy, collisions are the same as without it.
+        """
+        self.physics.read_objects()
+        for enemy in self.enemies:
+            if enemy.hp < enemy.min_hp:
+                enemy.kill()
+                to_remove.append(enemy)
+                self.physics.deactivate(enemy)
+                if self.events is not None:
+                    self.events.append(GameEvent.EnemyKilled(type(enemy).__name__, (enemy.pos[0], enemy.pos[1])))
+        self.physics.think(dt, self.player.pos, self.random)
+        moved_objects = self.physics.step(dt)
+        for object in moved_objects:
+            if object in self.enemies:
+                self.enemies_hash.update(object)
+            else:
+                self.bonuses_hash.update(object)
 
     def update(self, dt):
         """
             Call update(dt) for every GameObject, and use relations between them.
         """
-        self.spawn_engine.spawn(dt)
+        profiler = self.app.profiler
+        if self.keep_previous_positions:
+            for object in self.sprites() + self.pop_up_label_group.sprites():
+                object.previous_pos = (object.pos[0], object.pos[1])
+        self.scheduler.advance(dt)
+        if profiler.active:
+            profiler.lap("scheduler")
         to_remove = []
-        for object in pygame.sprite.Group.sprites(self):
+        # player first - attack waves and enemies use its new position
+        for object in list(self.players) + list(self.others):
             object.update(dt)  # update object
             if not object.is_alive():
                 to_remove.append(object)  # remove if  isn't  alive
                 continue
-            for x in range(len(object.velocity)):  # friction
-                if object.velocity[x] > 0.0:
-                    object.velocity[x] -= object.friction * dt
-                    if object.velocity[x] < 0.0:
-                        object.velocity[x] = 0.0
-                elif object.velocity[x] < 0.0:
-                    object.velocity[x] += object.friction * dt
-                    if object.velocity[x] > 0.0:
-                        object.velocity[x] = 0.0
-
-            border_hit = False
-            for i in range(len(object.pos)):  # if object hit border of play_area
-                if object.pos[i] < self.play_area[i]:  # play_area = [point_x,point_y,w,h]
-                    object.pos[i] = self.play_area[i]
-                    object.velocity[i] = -1.0 * object.velocity[i]
-                    border_hit = True
-                # i+1,i+2 -> 3,4 -> right and down wall
-                elif object.pos[i] + object.rect[i + 2] > self.play_area[i + 2]:
-                    object.pos[i] = self.play_area[i + 2] - object.rect[i + 2]
-                    object.velocity[i] = -1.0 * object.velocity[i]
-                    border_hit = True
-            if border_hit and isinstance(object, Enemy):
-                object.move_cycle_timer = object.move_cycle_duration + dt
-
-            # calculation new position -> pos = velocity * dt
-            object.pos = [object.pos[0] + object.velocity[0] * dt, object.pos[1] + object.velocity[1] * dt]
-            if not isinstance(object, AttackWave):
-                object.rect[0] = int(object.pos[0])
-                object.rect[1] = int(object.pos[1])
-
-        # player<->enemy
-        if not self.player.is_immortal():
-            for object in pygame.sprite.Group.sprites(self):
-                if isinstance(object, Enemy):
-                    if pygame.sprite.collide_rect(self.player, object):
-                        object.deal_damage(self.player)
-                        dmg = app.get_resource("small_font").render(
-                        "-"+str(object.damage)+" HP", True, (255, 25, 25))
-                        self.add_pop_up_label(PopUpLabel(dmg,self.player.pos))
-                        self.bounce(self.player, object)
-
-        # attack_wave <-> enemy
-        for attack_wave in pygame.sprite.Group.sprites(self):
-            if not isinstance(attack_wave, AttackWave):
+            self.move(object, dt)
+            object.rect[0] = int(object.pos[0])
+            object.rect[1] = int(object.pos[1])
+
+        for attack_wave in list(self.attack_waves):
+            attack_wave.update(dt)  # it set own rect around player
+            if not attack_wave.is_alive():
+                to_remove.append(attack_wave)
                 continue
-            for enemy in pygame.sprite.Group.sprites(self):
-                if not isinstance(enemy, Enemy):
+            self.move(attack_wave, dt)
+
+        if self.physics is not None:
+            self.update_vectorized(dt, to_remove)
+        else:
+            for enemy in list(self.enemies):
+                enemy.update(dt)
+                if not enemy.is_alive():
+                    to_remove.append(enemy)
+                    if self.events is not None:
+                        self.events.append(GameEvent.EnemyKilled(type(enemy).__name__, (enemy.pos[0], enemy.pos[1])))
                     continue
-                if pygame.sprite.collide_circle(attack_wave, enemy) and \
+                if self.move(enemy, dt):
+                    enemy.move_cycle_timer = enemy.move_cycle_duration + dt
+                enemy.rect[0] = int(enemy.pos[0])
+                enemy.rect[1] = int(enemy.pos[1])
+                self.enemies_hash.update(enemy)
+
+        if profiler.active:
+            profiler.lap("entities")
+        self.collide_player_with_enemies()
+        if profiler.active:
+            profiler.lap("collide_player_with_enemies")
+        self.collide_attack_waves_with_enemies()
+        if profiler.active:
+            profiler.lap("collide_attack_waves_with_enemies")
+        to_remove.extend(self.collide_player_with_bonuses())
+        if profiler.active:
+            profiler.lap("collide_player_with_bonuses")
+
+        for object in to_remove:
+            if self.has_internal(object):  # used bonus can be dead too
+                object.remove(self)
+                self.release_object(object)
+
+        self.update_pop_up_labels(dt)
+        if profiler.active:
+            profiler.lap("pop_up_labels")
+
+    def collide_player_with_enemies(self):
+        """
+            Enemy deal damage to player and both are bounced.
+        """
+        if not self.player.is_immortal():
+            for object in self.enemies_hash.query(collision_bounds(self.player)):
+                if pygame.sprite.collide_rect(self.player, object):
+                    object.deal_damage(self.player)
+                    if self.events is not None:
+                        self.events.append(GameEvent.PlayerDamaged((self.player.pos[0], self.player.pos[1]),
+                                                                   object.damage, self.player.hp))
+                    self.bounce(self.player, object)
+
+    def collide_attack_waves_with_enemies(self):
+        """
+            Every AttackWave hurt and bounce each enemy once.
+        """
+        for attack_wave in self.attack_waves:
+            for enemy in self.enemies_hash.query(collision_bounds(attack_wave)):
+                if collide_circle(attack_wave, enemy) and \
                         not enemy in attack_wave.attacked_by_self:
                     attack_wave.attack(enemy)
-                    dmg = app.get_resource("small_font").render(
-                        "-"+str(round(attack_wave.get_current_damage(), 2))+" dmg", True, (239, 75, 117))
-                    self.add_pop_up_label(PopUpLabel(dmg,enemy.pos))
+                    if self.events is not None:
+                        self.events.append(GameEvent.Hit(type(enemy).__name__, (enemy.pos[0], enemy.pos[1]),
+                                                         attack_wave.get_current_damage()))
                     attack_wave.bounce(enemy)
-        #player <-> bonus
-        for object in pygame.sprite.Group.sprites(self):
-            if isinstance(object, Bonus) and pygame.sprite.collide_circle(self.player, object):
-                object.use(self.player)
-                bonus = app.get_resource("small_font").render(
-                        "+"+str(object), True, (100, 255, 100))
-                self.add_pop_up_label(PopUpLabel(bonus,object.pos))
-                to_remove.append(object)
 
-        for object in to_remove:
-            object.remove(self)
-
-        pop_up_label_to_remove = []
-        for pop_up_label in pygame.sprite.Group(self.pop_up_label_group):
+    def collide_player_with_bonuses(self):
+        """
+            Player use touched bonuses.
+        :return: list of used bonuses
+        """
+        used_bonuses = []
+        for object in self.bonuses_hash.query(collision_bounds(self.player)):
+            if collide_circle(self.player, object):
+                object.use(self.player)
+                if self.events is not None:
+                    self.events.append(GameEvent.BonusCollected(type(object).__name__, (object.pos[0], object.pos[1]),
+                                                                str(object)))
+                used_bonuses.append(object)
+        return used_bonuses
+
+    def update_pop_up_labels(self, dt):
+        for pop_up_label in self.pop_up_label_group:  # they are removed by expire_object()
             pop_up_label.update(dt)
-            if not pop_up_label.is_alive():
-                pop_up_label_to_remove.append(pop_up_label)
-        for x in pop_up_label_to_remove:
-            x.remove(self.pop_up_label_group)
+
+    def interpolate(self, alpha):
+        """
+            Move rects between previous and current positions for drawing. AttackWave follows its player.
+        :param alpha: 0.0 - previous positions, 1.0 - current positions
+        :return: list of (sprite, current rect position) for restore_positions()
+        """
+        moved = []
+        for object in self.sprites() + self.pop_up_label_group.sprites():
+            if object.previous_pos is None or object in self.attack_waves:
+                continue
+            moved.append((object, object.rect.topleft))
+            object.rect.topleft = (int(object.previous_pos[0] + (object.pos[0] - object.previous_pos[0]) * alpha),
+                                   int(object.previous_pos[1] + (object.pos[1] - object.previous_pos[1]) * alpha))
+        shifts = dict((object, (object.rect[0] - topleft[0], object.rect[1] - topleft[1]))
+                      for object, topleft in moved if object in self.players)
+        for attack_wave in self.attack_waves:
+            shift = shifts.get(attack_wave.player)
+            if shift is not None:
+                moved.append((attack_wave, attack_wave.rect.topleft))
+                attack_wave.rect.move_ip(shift)
+        return moved
+
+    def restore_positions(self, moved):
+        for object, topleft in moved:
+            object.rect.topleft = topleft
 
     def get_random_pos_on_game_arena(self):
-        return [random.randint(self.play_area[0], self.play_area[2]),
-                random.randint(self.play_area[1], self.play_area[3])]
+        return [self.random.randint(self.play_area[0], self.play_area[2]),
+                self.random.randint(self.play_area[1], self.play_area[3])]
+
+
+class WorldSnapshot():
+    """
+        Packed binary state of GameObjectsGroup between updates: scheduler with its events, random generator,
+        player, enemies with move cycles, bonuses with time_to_live and expiry time and attack waves with r and
+        attacked enemies. Pop-up labels and GameEvents belong to presentation and aren't stored.
+        Objects of every kind are stored in columns (ids of all enemies, then x of all enemies...), so most bytes
+        of the next snapshot are at the same offsets and have the same values, delta() of them is mostly zeros.
+    """
+    TYPES = (Player, EnemyWeak, EnemyFast, EnemyStrong, Gold, HpBonus, AttackBonus, AttackWave)
+    TYPE_CODES = dict((cls, code) for code, cls in enumerate(TYPES))
+    RESOURCES = dict([(EnemyWeak, "enemy1"), (EnemyStrong, "enemy2"), (EnemyFast, "enemy3"), (Gold, "gold"),
+                      (HpBonus, "hp"), (AttackBonus, "attack")])
+    # scheduler time, number of scheduled events, next object id, gauss_next of random is set, gauss_next,
+    # number of events, enemies, bonuses and attack waves
+    HEADER = struct.Struct("<dQI?dHHHH")
+    # object id, pos, velocity, hp, gold, attack level, immortal, attack wave ready, alive
+    PLAYER = struct.Struct("<I4dqqd???")
+    EVENT = struct.Struct("<dQB")  # time, number, index of callback in get_event_callbacks()
+    RANDOM_WORDS = 625  # size of internal state of random.Random
+    # columns after header, player, random generator and events in order of save(), the last one has
+    # sum(attacked_count) items
+    COLUMNS = (
+        ("enemies", "object_id", "I"), ("enemies", "type", "B"), ("enemies", "pos_x", "d"), ("enemies", "pos_y", "d"),
+        ("enemies", "velocity_x", "d"), ("enemies", "velocity_y", "d"), ("enemies", "hp", "d"),
+        ("enemies", "move_cycle_timer", "d"), ("enemies", "direction_x", "b"), ("enemies", "direction_y", "b"),
+        ("enemies", "target_x", "d"), ("enemies", "target_y", "d"),
+        ("bonuses", "object_id", "I"), ("bonuses", "type", "B"), ("bonuses", "pos_x", "d"), ("bonuses", "pos_y", "d"),
+        ("bonuses", "velocity_x", "d"), ("bonuses", "velocity_y", "d"), ("bonuses", "time_to_live", "d"),
+        ("bonuses", "expiry_time", "d"), ("bonuses", "expiry_number", "Q"), ("bonuses", "value", "i"),
+        ("attack_waves", "object_id", "I"), ("attack_waves", "pos_x", "d"), ("attack_waves", "pos_y", "d"),
+        ("attack_waves", "velocity_x", "d"), ("attack_waves", "velocity_y", "d"), ("attack_waves", "r", "d"),
+        ("attack_waves", "attacked_count", "H"), ("attack_waves", "attacked_ids", "I"),
+    )
+    VALUE_SIZES = [struct.calcsize(typecode) for section, name, typecode in COLUMNS]  # bytes of value of column
+    DELTA_HEADER = struct.Struct("<I")  # size of snapshot, HEADER of snapshot follows it
+    # stored direction -> EnemyWeakMoveCycle
+    MOVE_CYCLES_X = dict((direction, EnemyWeak.EnemyWeakMoveCycle(index))
+                         for index, direction in enumerate(VectorizedPhysics.X_DIRECTIONS))
+    MOVE_CYCLES_Y = dict((direction, EnemyWeak.EnemyWeakMoveCycle(3 + index))
+                         for index, direction in enumerate(VectorizedPhysics.Y_DIRECTIONS))
+    # value of EnemyWeakMoveCycle -> stored direction as byte, table of bytes.translate()
+    DIRECTIONS = bytes(direction & 0xFF for direction in VectorizedPhysics.X_DIRECTIONS +
+                       VectorizedPhysics.Y_DIRECTIONS).ljust(256, b"\0")
+    # type code -> 1 if objects of type have target_pos, move cycles or value, tables of bytes.translate()
+    TARGET_TYPES = bytes(cls is EnemyStrong for cls in TYPES).ljust(256, b"\0")
+    MOVE_CYCLE_TYPES = bytes(issubclass(cls, EnemyWeak) for cls in TYPES).ljust(256, b"\0")
+    VALUE_TYPES = bytes(cls is not AttackBonus for cls in TYPES).ljust(256, b"\0")
+
+    @staticmethod
+    def get_event_callbacks(group):
+        """
+            Callbacks of scheduled events stored by index. Lifetimes of bonuses are stored with bonuses.
+        """
+        spawn_engine = group.spawn_engine
+        return [spawn_engine.spawn_enemy, spawn_engine.spawn_gold, spawn_engine.spawn_hp_bonus,
+                spawn_engine.spawn_attack_bonus, group.player.end_attack_wave_cooldown, group.player.end_immortality]
+
+    @staticmethod
+    def pack_vectors(vectors):
+        """
+            x of every vector and then y of every vector.
+        """
+        return array("d", list(map(get_x, vectors)) + list(map(get_y, vectors))).tobytes()
+
+    @staticmethod
+    def save(group):
+        """
+            Columns are filled by map() with getters, so nothing is allocated for every object.
+        :return: bytes
+        """
+        scheduler = group.scheduler
+        physics = group.physics
+        player = group.player
+        kinds = dict((callback, kind) for kind, callback in enumerate(WorldSnapshot.get_event_callbacks(group)))
+        expire_object = group.expire_object
+        events = []
+        for event in scheduler.events:
+            callback = event[2]
+            if callback is None or callback == expire_object:  # cancelled, lifetime of bonus or pop-up label
+                continue
+            if callback not in kinds:
+                raise ValueError("scheduled " + str(callback) + " can't be saved")
+            events.append((event[0], event[1], kinds[callback]))
+        # in order of time, restored heap can have other order and snapshot of the same state must be the same
+        events = [WorldSnapshot.EVENT.pack(*event) for event in sorted(events)]
+        version, words, gauss_next = group.random.getstate()
+        enemies = list(group.enemies)
+        bonuses = list(group.bonuses)
+        attack_waves = list(group.attack_waves)
+        type_codes = WorldSnapshot.TYPE_CODES
+
+        parts = [WorldSnapshot.HEADER.pack(scheduler.time, scheduler.scheduled, group.next_object_id,
+                                           gauss_next is not None, gauss_next or 0.0, len(events), len(enemies),
+                                           len(bonuses), len(attack_waves)),
+                 WorldSnapshot.PLAYER.pack(player.object_id, player.pos[0], player.pos[1], player.velocity[0],
+                                           player.velocity[1], player.hp, player.gold, player.attack_level,
+                                           player.immortal, player.attack_wave_ready, player.alive),
+                 array("I", words).tobytes()]
+        parts.extend(events)
+
+        parts.append(array("I", list(map(get_object_id, enemies))).tobytes())
+        parts.append(bytes(map(type_codes.__getitem__, map(type, enemies))))
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_pos, enemies))))
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_velocity, enemies))))
+        parts.append(array("d", list(map(get_hp, enemies))).tobytes())
+        if physics is None:
+            parts.append(array("d", list(map(get_move_cycle_timer, enemies))).tobytes())
+            no_cycle = EnemyWeak.EnemyWeakMoveCycle  # enemies which aren't EnemyWeak don't move randomly
+            cycles = bytes(map(get_value, map(getattr, enemies, itertools.repeat("current_move_cycle_x"),
+                                              itertools.repeat(no_cycle.NONE_X)))) + \
+                bytes(map(get_value, map(getattr, enemies, itertools.repeat("current_move_cycle_y"),
+                                         itertools.repeat(no_cycle.NONE_Y))))
+            parts.append(cycles.translate(WorldSnapshot.DIRECTIONS))
+        else:  # move cycles are kept only in arrays
+            physics.flush()
+            slots = [enemy.physics_slot for enemy in enemies]
+            parts.append(physics.move_cycle_timer[slots].tobytes())
+            direction = physics.direction[slots]
+            direction[physics.ai[slots] != VectorizedPhysics.AI_RANDOM_WALK] = 0  # chase is set again by think()
+            parts.append(direction.T.tobytes())
+        parts.append(WorldSnapshot.pack_vectors(list(map(
+            getattr, enemies, itertools.repeat("target_pos"), itertools.repeat((0.0, 0.0))))))  # only EnemyStrong
+
+        parts.append(array("I", list(map(get_object_id, bonuses))).tobytes())
+        parts.append(bytes(map(type_codes.__getitem__, map(type, bonuses))))
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_pos, bonuses))))
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_velocity, bonuses))))
+        parts.append(array("d", list(map(get_time_to_live, bonuses))).tobytes())
+        # absolute time of expiry doesn't change between snapshots, remaining time is expiry time - scheduler time
+        expiry_events = list(map(get_expiry_event, bonuses))
+        parts.append(array("d", list(map(operator.itemgetter(0), expiry_events))).tobytes())
+        parts.append(array("Q", list(map(operator.itemgetter(1), expiry_events))).tobytes())
+        parts.append(array("i", list(map(getattr, bonuses, itertools.repeat("value"), itertools.repeat(0)))).tobytes())
+
+        parts.append(array("I", list(map(get_object_id, attack_waves))).tobytes())
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_pos, attack_waves))))
+        parts.append(WorldSnapshot.pack_vectors(list(map(get_velocity, attack_waves))))
+        parts.append(array("d", [attack_wave.r for attack_wave in attack_waves]).tobytes())
+        parts.append(array("H", [len(attack_wave.attacked_by_self) for attack_wave in attack_waves]).tobytes())
+        parts.append(array("I", [enemy.object_id for attack_wave in attack_waves
+                                 for enemy in attack_wave.attacked_by_self]).tobytes())
+        return b"".join(parts)
+
+    @staticmethod
+    def get_layout(header, size):
+        """
+            (offset, size) of every part of snapshot: header with player, random generator and events and then
+            every column of COLUMNS.
+        :param header: bytes which start with HEADER of snapshot
+        :param size: size of snapshot
+        """
+        events, enemies, bonuses, attack_waves = WorldSnapshot.HEADER.unpack_from(header)[5:]
+        counts = dict(enemies=enemies, bonuses=bonuses, attack_waves=attack_waves)
+        offset = WorldSnapshot.HEADER.size + WorldSnapshot.PLAYER.size + 4 * WorldSnapshot.RANDOM_WORDS + \
+            events * WorldSnapshot.EVENT.size
+        layout = [(0, offset)]
+        for (section, name, typecode), value_size in zip(WorldSnapshot.COLUMNS[:-1], WorldSnapshot.VALUE_SIZES):
+            column_size = counts[section] * value_size
+            layout.append((offset, column_size))
+            offset += column_size
+        layout.append((offset, size - offset))
+        return layout
+
+    @staticmethod
+    def read_columns(data):
+        """
+            Every column of COLUMNS without copying, numpy arrays over data or arrays of array module without numpy.
+        :return: dict (section, name) -> array
+        """
+        columns = dict()
+        for (section, name, typecode), value_size, (offset, size) in zip(
+                WorldSnapshot.COLUMNS, WorldSnapshot.VALUE_SIZES, WorldSnapshot.get_layout(data, len(data))[1:]):
+            if numpy is not None:
+                columns[section, name] = numpy.frombuffer(data, typecode, size // value_size, offset)
+            else:
+                columns[section, name] = array(typecode, data[offset:offset + size])
+        return columns
+
+    @staticmethod
+    def load(data, columns=None):
+        """
+            Unpack snapshot into dict, e.g. load(data)["enemies"]["hp"] is list with hp of every enemy.
+            It is used to inspect snapshots saved after crash.
+        :param columns: read_columns(data), if they are already read
+        """
+        state = WorldSnapshot.load_header(data)
+        if columns is None:
+            columns = WorldSnapshot.read_columns(data)
+        for (section, name), values in columns.items():
+            state[section][name] = values.tolist()
+        columns = state["attack_waves"]
+        columns["attacked_by_self"] = WorldSnapshot.split_attacked_ids(columns["attacked_count"],
+                                                                       columns["attacked_ids"])
+        return state
+
+    @staticmethod
+    def load_header(data):
+        """
+            load() without columns, sections "enemies", "bonuses" and "attack_waves" are empty.
+        """
+        time, scheduled, next_object_id, has_gauss_next, gauss_next, events = \
+            WorldSnapshot.HEADER.unpack_from(data)[:6]
+        offset = WorldSnapshot.HEADER.size
+        player = WorldSnapshot.PLAYER.unpack_from(data, offset)
+        offset += WorldSnapshot.PLAYER.size
+        words = array("I")
+        words.frombytes(data[offset:offset + 4 * WorldSnapshot.RANDOM_WORDS])
+        offset += 4 * WorldSnapshot.RANDOM_WORDS
+        state = {
+            "time": time,
+            "scheduled": scheduled,
+            "next_object_id": next_object_id,
+            "player": dict(zip(("object_id", "pos_x", "pos_y", "velocity_x", "velocity_y", "hp", "gold",
+                                "attack_level", "immortal", "attack_wave_ready", "alive"), player)),
+            "random_state": (random.Random.VERSION, tuple(words), gauss_next if has_gauss_next else None),
+            "events": [WorldSnapshot.EVENT.unpack_from(data, offset + index * WorldSnapshot.EVENT.size)
+                       for index in range(events)],
+            "enemies": dict(),
+            "bonuses": dict(),
+            "attack_waves": dict(),
+        }
+        return state
+
+    @staticmethod
+    def split_attacked_ids(attacked_counts, attacked_ids):
+        """
+        :return: list of enemy ids for every attack wave
+        """
+        attacked_by_self = []
+        start = 0
+        for count in attacked_counts:
+            attacked_by_self.append(attacked_ids[start:start + count])
+            start += count
+        return attacked_by_self
+
+    @staticmethod
+    def create_object(group, cls):
+        """
+            New object of cls, its state is set by restore().
+        """
+        if cls is AttackWave:
+            return AttackWave(group.player)
+        image = group.app.get_resource(WorldSnapshot.RESOURCES[cls])
+        if issubclass(cls, Enemy):
+            return group.new_object(cls, image, (0.0, 0.0), group)
+        elif cls is AttackBonus:
+            return group.new_object(cls, image, (0.0, 0.0), group.random)
+        return group.new_object(cls, image, (0.0, 0.0), 0, group.random)
+
+    @staticmethod
+    def replace_objects(group, kinds):
+        """
+            Objects are matched with rows of snapshot by object_id and type. Objects without row take ids of missing
+            objects of the same type, like objects from ObjectPool their state is set by restore(). Remaining ones
+            are removed and the rest of missing objects is created. Indexes of group are filled in order of columns,
+            only spritedict is sorted and only if ids changed.
+        :param kinds: (name of index of group, object ids, classes) for enemies, bonuses and attack waves
+        :return: list of objects in order of columns for every kind
+        """
+        kinds_objects = []
+        missing = []  # (object id, class, objects of kind, row)
+        stale = list(group.others)
+        for name, object_ids, classes in kinds:
+            index = list(getattr(group, name))
+            objects = index
+            present_ids = list(map(get_object_id, index))
+            if present_ids != object_ids or list(map(type, index)) != classes:
+                objects = list(map(dict(zip(present_ids, index)).get, object_ids))
+                rows = list(itertools.compress(itertools.count(), map(operator.is_not, map(type, objects), classes)))
+                kept = set(objects)
+                stale.extend(itertools.compress(index, map(operator.not_, map(kept.__contains__, index))))
+                missing.extend((object_ids[row], classes[row], objects, row) for row in rows)
+            kinds_objects.append(objects)
+        if not stale and not missing:  # indexes are in order of columns already
+            return kinds_objects
+        spare = dict()  # class -> stale objects
+        for sprite in stale:
+            spare.setdefault(type(sprite), []).append(sprite)
+        created = []
+        for object_id, cls, objects, row in sorted(missing, key=operator.itemgetter(0)):
+            reused = spare.get(cls)
+            if reused:
+                objects[row] = reused.pop()
+                objects[row].object_id = object_id
+            else:
+                created.append((object_id, cls, objects, row))
+        for sprite in itertools.chain.from_iterable(spare.values()):
+            sprite.kill()
+            sprite.remove(group)
+            group.release_object(sprite)
+        for object_id, cls, objects, row in created:
+            objects[row] = WorldSnapshot.create_object(group, cls)
+            group.next_object_id = object_id
+            group.add(objects[row])
+        for (name, object_ids, classes), objects in zip(kinds, kinds_objects):
+            setattr(group, name, dict.fromkeys(objects))
+        if missing:
+            group.sort_objects(indexes=False)
+        return kinds_objects
+
+    @staticmethod
+    def restore(group, data):
+        """
+            Set state of group to snapshot, the game continues exactly as after the update when it was saved.
+            Objects with the same object_id and type are reused and others get new ids or are removed or created,
+            so restore of a recent snapshot mostly changes values.
+        """
+        state = WorldSnapshot.load_header(data)
+        columns = WorldSnapshot.read_columns(data)
+        types = WorldSnapshot.TYPES
+        enemy_ids = columns["enemies", "object_id"].tolist()
+        enemy_classes = list(map(types.__getitem__, columns["enemies", "type"].tolist()))
+        bonus_classes = list(map(types.__getitem__, columns["bonuses", "type"].tolist()))
+        attack_wave_ids = columns["attack_waves", "object_id"].tolist()
+        enemy_objects, bonus_objects, attack_wave_objects = WorldSnapshot.replace_objects(group, (
+            ("enemies", enemy_ids, enemy_classes),
+            ("bonuses", columns["bonuses", "object_id"].tolist(), bonus_classes),
+            ("attack_waves", attack_wave_ids, [AttackWave] * len(attack_wave_ids))))
+        set_values = WorldSnapshot.set_values
+        set_vectors = WorldSnapshot.set_vectors
+        select = WorldSnapshot.select
+        get_type_rows = WorldSnapshot.get_type_rows
+        # rows of values which only some kinds have
+        enemy_types = columns["enemies", "type"].tobytes()
+        strong = get_type_rows(enemy_types, WorldSnapshot.TARGET_TYPES)
+        weak = get_type_rows(enemy_types, WorldSnapshot.MOVE_CYCLE_TYPES)
+        valued = get_type_rows(columns["bonuses", "type"].tobytes(), WorldSnapshot.VALUE_TYPES)
+
+        # columns are written straight into fields of objects by map(), Python loops are left only for replaced
+        # objects and for objects which moved to another cell of spatial hash. Objects in group are alive, dead
+        # ones are removed by the same update.
+        for objects_of_kind, section, spatial_hash in ((enemy_objects, "enemies", group.enemies_hash),
+                                                       (bonus_objects, "bonuses", group.bonuses_hash)):
+            set_vectors(objects_of_kind, "pos", columns[section, "pos_x"].tolist(), columns[section, "pos_y"].tolist())
+            set_values(list(map(get_rect, objects_of_kind)), "topleft", zip(  # rect is int(pos) of object
+                WorldSnapshot.get_ints(columns[section, "pos_x"]), WorldSnapshot.get_ints(columns[section, "pos_y"])))
+            spatial_hash.update_objects(objects_of_kind)
+            set_vectors(objects_of_kind, "velocity", columns[section, "velocity_x"].tolist(),
+                        columns[section, "velocity_y"].tolist())
+            if group.keep_previous_positions:  # previous_pos isn't read otherwise
+                set_values(objects_of_kind, "previous_pos", itertools.repeat(None))
+        set_values(enemy_objects, "hp", columns["enemies", "hp"].tolist())
+        # target_pos can be pos of player, so it isn't changed in place
+        set_values(select(enemy_objects, strong), "target_pos", map(list, zip(
+            select(columns["enemies", "target_x"].tolist(), strong),
+            select(columns["enemies", "target_y"].tolist(), strong))))
+        set_values(bonus_objects, "time_to_live", columns["bonuses", "time_to_live"].tolist())
+        set_values(select(bonus_objects, valued), "value", select(columns["bonuses", "value"].tolist(), valued))
+
+        physics = group.physics
+        if physics is None:
+            set_values(enemy_objects, "move_cycle_timer", columns["enemies", "move_cycle_timer"].tolist())
+            weak_objects = select(enemy_objects, weak)
+            set_values(weak_objects, "current_move_cycle_x", map(
+                WorldSnapshot.MOVE_CYCLES_X.__getitem__, select(columns["enemies", "direction_x"].tolist(), weak)))
+            set_values(weak_objects, "current_move_cycle_y", map(
+                WorldSnapshot.MOVE_CYCLES_Y.__getitem__, select(columns["enemies", "direction_y"].tolist(), weak)))
+        else:  # move cycles are kept only in arrays, rows are put in order of columns and written by slices
+            physics.arrange(enemy_objects + bonus_objects)
+            count = len(enemy_objects)
+            end = count + len(bonus_objects)
+            physics.int_pos[:count, 0] = columns["enemies", "pos_x"]  # truncated like int()
+            physics.int_pos[:count, 1] = columns["enemies", "pos_y"]
+            physics.int_pos[count:end, 0] = columns["bonuses", "pos_x"]
+            physics.int_pos[count:end, 1] = columns["bonuses", "pos_y"]
+            physics.active[:end] = True
+            physics.order[:count] = columns["enemies", "object_id"]
+            physics.order[count:end] = columns["bonuses", "object_id"]
+            physics.move_cycle_timer[:count] = columns["enemies", "move_cycle_timer"]
+            physics.direction[:count, 0] = columns["enemies", "direction_x"]
+            physics.direction[:count, 1] = columns["enemies", "direction_y"]
+
+        # lifetimes of bonuses are kept with new scheduled events
+        set_values(bonus_objects, "expiry_event", map(list, zip(
+            columns["bonuses", "expiry_time"].tolist(), columns["bonuses", "expiry_number"].tolist(),
+            itertools.repeat(group.expire_object), zip(bonus_objects))))  # [time, number, callback, (bonus,)]
+        events = list(map(get_expiry_event, bonus_objects))
+
+        player = group.player
+        values = state["player"]
+        player.pos = [values["pos_x"], values["pos_y"]]
+        player.velocity = [values["velocity_x"], values["velocity_y"]]
+        player.hp = values["hp"]
+        player.gold = values["gold"]
+        player.attack_level = values["attack_level"]
+        player.immortal = values["immortal"]
+        player.attack_wave_ready = values["attack_wave_ready"]
+        player.alive = values["alive"]
+        player.previous_pos = None
+        player.rect.topleft = (int(player.pos[0]), int(player.pos[1]))
+        player.update_image()
+
+        if attack_wave_objects:
+            enemies_by_id = dict(zip(enemy_ids, enemy_objects))
+            attack_waves = dict((name, columns["attack_waves", name].tolist())
+                                for name in ("pos_x", "pos_y", "velocity_x", "velocity_y", "r"))
+            for attack_wave, x, y, velocity_x, velocity_y, r, attacked_ids in zip(
+                    attack_wave_objects, attack_waves["pos_x"], attack_waves["pos_y"], attack_waves["velocity_x"],
+                    attack_waves["velocity_y"], attack_waves["r"], WorldSnapshot.split_attacked_ids(
+                        columns["attack_waves", "attacked_count"].tolist(),
+                        columns["attack_waves", "attacked_ids"].tolist())):
+                attack_wave.pos = [x, y]
+                attack_wave.velocity = [velocity_x, velocity_y]
+                attack_wave.r = r
+                attack_wave.previous_pos = None
+                attack_wave.attacked_by_self = [enemies_by_id[enemy_id] for enemy_id in attacked_ids
+                                                if enemy_id in enemies_by_id]
+                attack_wave.update_shape()
+
+        # pop-up labels and events of the dropped future are removed, labels' lifetimes go with the old heap
+        for pop_up_label in group.pop_up_label_group.sprites():
+            group.expire_object(pop_up_label)
+        if group.events is not None:
+            del group.events[:]
+        callbacks = WorldSnapshot.get_event_callbacks(group)
+        events.extend([time, number, callbacks[kind], ()] for time, number, kind in state["events"])
+        heapq.heapify(events)
+        scheduler = group.scheduler
+        scheduler.events = events
+        scheduler.time = state["time"]
+        scheduler.scheduled = state["scheduled"]
+        group.next_object_id = state["next_object_id"]
+        group.random.setstate(state["random_state"])
+
+    @staticmethod
+    def get_type_rows(types, table):
+        """
+            Rows of objects whose type has the value, e.g. get_type_rows(types, WorldSnapshot.TARGET_TYPES).
+        :param types: type column as bytes
+        """
+        return list(itertools.compress(itertools.count(), types.translate(table)))
+
+    @staticmethod
+    def select(values, rows):
+        """
+            Values of rows.
+        """
+        return list(map(values.__getitem__, rows))
+
+    @staticmethod
+    def set_vectors(objects, name, x, y):
+        """
+            Write x and y into vector (pos or velocity list) of every object.
+            Lists are reused like by reinit() of pooled objects.
+        """
+        vectors = list(map(operator.attrgetter(name), objects))
+        list(map(operator.setitem, vectors, itertools.repeat(0), x))
+        list(map(operator.setitem, vectors, itertools.repeat(1), y))
+
+    @staticmethod
+    def get_ints(column):
+        """
+            Column of read_columns() as list of ints truncated like int().
+        """
+        if numpy is not None:
+            return column.astype(numpy.int64).tolist()
+        return list(map(int, column))
+
+    @staticmethod
+    def set_values(objects, name, values):
+        """
+            setattr(object, name, value) for every object and value, without Python loop.
+        """
+        list(map(setattr, objects, itertools.repeat(name), values))
+
+    @staticmethod
+    def get_words(data, words):
+        """
+            data as words unsigned 4-byte ints, cut or padded with zeros.
+        """
+        data = data[:4 * words]
+        if numpy is not None:
+            values = numpy.zeros(words, dtype=numpy.uint32)
+            values.view(numpy.uint8)[:len(data)] = numpy.frombuffer(data, dtype=numpy.uint8)
+            return values
+        return array("I", bytes(data) + bytes(4 * words - len(data)))
+
+    @staticmethod
+    def align(previous, layout):
+        """
+            Previous snapshot with its parts moved to offsets of the same parts in layout of the next snapshot,
+            so added or removed objects don't shift the following columns.
+        """
+        previous_layout = WorldSnapshot.get_layout(previous, len(previous))
+        if previous_layout == layout:
+            return previous
+        aligned = bytearray(layout[-1][0] + layout[-1][1])
+        for (offset, size), (previous_offset, previous_size) in zip(layout, previous_layout):
+            size = min(size, previous_size)
+            aligned[offset:offset + size] = previous[previous_offset:previous_offset + size]
+        return aligned
+
+    @staticmethod
+    def delta(previous, snapshot):
+        """
+            Changed 4-byte words of snapshot against previous snapshot: size and HEADER of snapshot, bit mask of
+            changed words and their new values. Snapshots of the next updates differ mostly in positions, velocities
+            and timers, so delta is a few times smaller and it is made without slow compression.
+        """
+        size = len(snapshot)
+        words = (size + 3) // 4
+        new = WorldSnapshot.get_words(snapshot, words)
+        old = WorldSnapshot.get_words(WorldSnapshot.align(previous, WorldSnapshot.get_layout(snapshot, size)), words)
+        header = WorldSnapshot.DELTA_HEADER.pack(size) + snapshot[:WorldSnapshot.HEADER.size]
+        if numpy is not None:
+            changed = new != old
+            return header + numpy.packbits(changed, bitorder="little").tobytes() + new[changed].tobytes()
+        changed = [index for index in range(words) if new[index] != old[index]]
+        mask = bytearray((words + 7) // 8)
+        for index in changed:
+            mask[index >> 3] |= 1 << (index & 7)
+        return header + bytes(mask) + array("I", [new[index] for index in changed]).tobytes()
+
+    @staticmethod
+    def apply_delta(previous, delta):
+        """
+            Snapshot from previous snapshot and delta(previous, snapshot).
+        """
+        size, = WorldSnapshot.DELTA_HEADER.unpack_from(delta)
+        words = (size + 3) // 4
+        mask_offset = WorldSnapshot.DELTA_HEADER.size + WorldSnapshot.HEADER.size
+        values_offset = mask_offset + (words + 7) // 8
+        layout = WorldSnapshot.get_layout(delta[WorldSnapshot.DELTA_HEADER.size:mask_offset], size)
+        snapshot = WorldSnapshot.get_words(WorldSnapshot.align(previous, layout), words)
+        if numpy is not None:
+            changed = numpy.unpackbits(numpy.frombuffer(delta, dtype=numpy.uint8, count=values_offset - mask_offset,
+                                                        offset=mask_offset), count=words, bitorder="little").view(bool)
+            snapshot[changed] = numpy.frombuffer(delta, dtype=numpy.uint32, offset=values_offset)
+        else:
+            mask = delta[mask_offset:values_offset]
+            values = array("I")
+            values.frombytes(delta[values_offset:])
+            changed = [index for index in range(words) if mask[index >> 3] >> (index & 7) & 1]
+            for index, value in zip(changed, values):
+                snapshot[index] = value
+        return snapshot.tobytes()[:size]
+
+
+class SnapshotRing():
+    """
+        Snapshots of the last updates in fixed memory, for rewind and crash forensics. The newest frame is whole
+        snapshot and older frames are WorldSnapshot.delta() against the next one, so get() of recent updates
+        applies a few deltas from the newest snapshot. Every keyframe_interval-th frame stays whole.
+        The oldest frames are overwritten by new ones, nothing depends on them.
+    """
+    MAGIC = b"ECTSSNP1"
+
+    def __init__(self, size=8 * 1024 * 1024, keyframe_interval=4):
+        """
+        :param size: bytes of memory for frames
+        :param keyframe_interval: get() applies at most keyframe_interval - 1 deltas. Delta is about a third of
+                                  snapshot, so 4 keeps rewind by one second under 0.2 ms at 300 objects for less
+                                  than half more memory than 16.
+        """
+        self.buffer = bytearray(size)
+        self.keyframe_interval = keyframe_interval
+        self.frames = deque()  # [offset, size, is whole snapshot], from the oldest one
+        self.head = 0  # offset after the newest frame
+        self.previous = None  # snapshot of the newest frame, base of delta of the frame before it
+        self.since_keyframe = 0  # deltas before the newest frame
+
+    def __len__(self):
+        return len(self.frames)
+
+    def clear(self):
+        self.frames.clear()
+        self.head = 0
+        self.previous = None
+        self.since_keyframe = 0
+
+    def allocate(self, size):
+        """
+            Drop the oldest frames which are in place of new frame.
+        :return: offset of new frame
+        """
+        if size > len(self.buffer):
+            raise ValueError("snapshot is bigger than SnapshotRing")
+        offset = self.head
+        if offset + size > len(self.buffer):  # wrap around, frames after head are the oldest ones
+            while self.frames and self.frames[0][0] >= self.head:
+                self.frames.popleft()
+            offset = 0
+        while self.frames and self.frames[0][0] < offset + size and offset < self.frames[0][0] + self.frames[0][1]:
+            self.frames.popleft()
+        return offset
+
+    def append(self, snapshot):
+        """
+            Whole snapshot as the newest frame.
+        """
+        offset = self.allocate(len(snapshot))
+        self.buffer[offset:offset + len(snapshot)] = snapshot
+        self.frames.append([offset, len(snapshot), True])
+        self.head = offset + len(snapshot)
+        self.previous = snapshot
+
+    def push(self, snapshot):
+        if self.previous is not None and self.since_keyframe + 1 < self.keyframe_interval:
+            data = WorldSnapshot.delta(snapshot, self.previous)
+            frame = self.frames[-1]
+            if len(data) <= frame[1]:  # the newest frame becomes delta, it is written over its snapshot
+                self.buffer[frame[0]:frame[0] + len(data)] = data
+                frame[1] = len(data)
+                frame[2] = False
+                self.head = frame[0] + len(data)
+                self.since_keyframe += 1
+            else:
+                self.since_keyframe = 0
+        else:
+            self.since_keyframe = 0
+        self.append(snapshot)
+
+    def read(self, index):
+        """
+            Frame, snapshot or delta.
+        """
+        offset, size, whole = self.frames[index]
+        return bytes(self.buffer[offset:offset + size])
+
+    def get(self, back=0):
+        """
+        :param back: 0 - the newest snapshot, 1 - snapshot before it...
+        :return: snapshot
+        """
+        index = len(self.frames) - 1 - back
+        if not 0 <= index < len(self.frames):
+            raise IndexError("SnapshotRing has only " + str(len(self.frames)) + " frames")
+        whole = index
+        while not self.frames[whole][2]:
+            whole += 1
+        snapshot = self.previous if whole == len(self.frames) - 1 else self.read(whole)
+        for delta in range(whole - 1, index - 1, -1):
+            snapshot = WorldSnapshot.apply_delta(snapshot, self.read(delta))
+        return snapshot
+
+    def rewind(self, back):
+        """
+            Drop back newest frames, the next push() continues after returned snapshot.
+        :return: snapshot, the newest one now
+        """
+        snapshot = self.get(back)
+        if back == 0:
+            return snapshot
+        for frame in range(back + 1):  # returned frame is written again as whole snapshot
+            self.frames.pop()
+        self.head = self.frames[-1][0] + self.frames[-1][1] if self.frames else 0
+        self.append(snapshot)
+        self.since_keyframe = 0
+        while self.since_keyframe + 1 < len(self.frames) and not self.frames[-2 - self.since_keyframe][2]:
+            self.since_keyframe += 1
+        return snapshot
+
+    def save(self, file_name):
+        """
+            Save every frame as compressed whole snapshot, from the oldest one.
+        """
+        frames = []  # compressed snapshots are decoded from the newest one
+        snapshot = self.previous
+        for index in range(len(self.frames) - 1, -1, -1):
+            if index < len(self.frames) - 1:
+                data = self.read(index)
+                snapshot = data if self.frames[index][2] else WorldSnapshot.apply_delta(snapshot, data)
+            frames.append(zlib.compress(snapshot, 6))
+        with open(file_name, "wb") as file:
+            file.write(struct.pack("<8sI", SnapshotRing.MAGIC, len(self.frames)))
+            for data in reversed(frames):
+                file.write(struct.pack("<I", len(data)) + data)
+
+    @staticmethod
+    def load(file_name):
+        """
+        :return: list of snapshots saved by save()
+        """
+        with open(file_name, "rb") as file:
+            data = file.read()
+        magic, count = struct.unpack_from("<8sI", data)
+        if magic != SnapshotRing.MAGIC:
+            raise ValueError(file_name + " is not file with snapshots")
+        offset = struct.calcsize("<8sI")
+        snapshots = []
+        for index in range(count):
+            size, = struct.unpack_from("<I", data, offset)
+            snapshots.append(zlib.decompress(data[offset + 4:offset + 4 + size]))
+            offset += 4 + size
+        return snapshots
+
+
+class Asset():
+    """
+        One entry of App.ASSETS manifest. File names are relative to ASSET_DIRECTORY, so the game can be started
+        from any working directory.
+    """
+    def __init__(self, name, file_name, extension, size=10, preload=True):
+        """
+        :param size: font size, only for TTF
+        :param preload: decode image in background at startup, otherwise it is loaded at first use.
+                        Fonts are always loaded at first use, it is fast.
+        """
+        self.name = name
+        self.file_name = file_name
+        self.extension = extension
+        self.size = size
+        self.preload = preload
+
+    def get_path(self):
+        return os.path.join(ASSET_DIRECTORY, self.file_name + "." + self.extension)
+
+    def is_image(self):
+        return self.extension.upper() == "PNG"
+
+
+class AssetLoader():
+    """
+        Loads assets from manifest. PNG files marked as preload are decoded by thread pool while
+        App starts, every other asset is loaded at the first get(). Decoded images are converted on main thread,
+        which owns display. get() waits only for asset which is needed now.
+    """
+    def __init__(self, app, assets, workers=4, bundle=None):
+        """
+        :param bundle: AssetBundle file name, images found in it aren't decoded
+        """
+        self.app = app
+        self.bundle_file_name = bundle
+        self.bundle = None
+        self.assets = OrderedDict((asset.name, asset) for asset in assets)
+        self.workers = workers
+        self.resource = dict()
+        self.pending = dict()  # name -> Future with (decoded surface, decode time)
+        self.timings = OrderedDict()  # name -> dict(source, decode, convert, wait) in seconds
+        self.executor = None
+        self.start_time = time.perf_counter()
+
+    def start(self, background=True):
+        """
+            Check that every file exists and submit preloaded images to thread pool.
+        :param background: if False nothing is preloaded, every asset is loaded at first use
+        """
+        missing = [asset.get_path() for asset in self.assets.values() if not os.path.isfile(asset.get_path())]
+        if missing:
+            raise IOError("missing asset files: " + ", ".join(missing))
+        if self.bundle_file_name and os.path.isfile(self.bundle_file_name):
+            try:
+                self.bundle = AssetBundle(self.bundle_file_name)
+            except Exception as exception:
+                print("Asset bundle is not used: " + str(exception) + ".")
+        preload = [asset for asset in self.assets.values() if background and asset.preload and asset.is_image()
+                   and (self.bundle is None or asset.name not in self.bundle.entries)]
+        if preload:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            for asset in preload:
+                self.pending[asset.name] = self.executor.submit(AssetLoader.decode, asset)
+
+    @staticmethod
+    def decode(asset):
+        start = time.perf_counter()
+        surface = pygame.image.load(asset.get_path())
+        return surface, time.perf_counter() - start
+
+    def get(self, name):
+        resource = self.resource.get(name)
+        if resource is not None:
+            return resource
+        asset = self.assets[name]
+        start = time.perf_counter()
+        future = self.pending.pop(name, None)
+        timing = dict(source="background" if future is not None else "lazy", decode=0.0, convert=0.0, wait=0.0)
+        if future is None and self.bundle is not None and asset.is_image():
+            resource = self.bundle.get_surface(asset)  # None if it isn't in bundle or it is stale
+            if resource is not None:
+                timing["source"] = "bundle"
+                timing["decode"] = time.perf_counter() - start
+        if resource is not None:
+            pass  # mapped from bundle
+        elif asset.is_image():
+            if future is not None:
+                surface, timing["decode"] = future.result()
+                timing["wait"] = time.perf_counter() - start
+            else:
+                surface, timing["decode"] = AssetLoader.decode(asset)
+            convert_start = time.perf_counter()
+            # convert_alpha convert loaded surface into surface with mode like display_surface
+            # it's huge fps increase
+            resource = surface.convert_alpha()
+            timing["convert"] = time.perf_counter() - convert_start
+        else:
+            resource = pygame.font.Font(asset.get_path(), asset.size)
+            timing["decode"] = time.perf_counter() - start
+        timing["ready"] = time.perf_counter() - self.start_time  # since loader was created
+        self.timings[name] = timing
+        self.resource[name] = resource
+        if not self.pending and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        return resource
+
+    def load_all(self):
+        for name in self.assets:
+            self.get(name)
+
+    def report(self):
+        """
+            Print timings of loaded assets, in order of loading.
+        """
+        print("%-20s %-10s %10s %10s %10s %10s" % ("asset", "source", "decode ms", "convert ms", "wait ms",
+                                                 "ready ms"))
+        for name, timing in self.timings.items():
+            print("%-20s %-10s %10.2f %10.2f %10.2f %10.2f" % (name, timing["source"], timing["decode"] * 1000.0,
+                                                             timing["convert"] * 1000.0, timing["wait"] * 1000.0,
+                                                             timing["ready"] * 1000.0))
+        not_loaded = [name for name in self.assets if name not in self.timings]
+        if not_loaded:
+            print("Not used: " + ", ".join(not_loaded) + ".")
+
+
+class AssetBundle():
+    """
+        Images of App.ASSETS prebuilt to one file with raw pixels in display format. The file is memory-mapped
+        and surfaces are created directly on mapped pixels, so PNG decoding and convert_alpha are skipped.
+        Every entry keeps crc32 of its PNG file, image changed after the build is loaded from PNG.
+        File: header, index entries, pixels of every image aligned to 64 bytes.
+    """
+    MAGIC = b"ECTSBND1"
+    HEADER = struct.Struct("<8s4II")  # magic, masks of pixel format, number of entries
+    ENTRY = struct.Struct("<32sIIQQI")  # name, width, height, offset, size, crc32 of PNG file
+    FORMATS = {(0xff0000, 0xff00, 0xff, 0xff000000): "BGRA", (0xff, 0xff00, 0xff0000, 0xff000000): "RGBA"}
+
+    def __init__(self, file_name):
+        """
+            Open bundle, raise exception if it can't be used with current display.
+        """
+        with open(file_name, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)  # surfaces may write to own copy
+        magic, mask_r, mask_g, mask_b, mask_a, count = AssetBundle.HEADER.unpack_from(self.map)
+        if magic != AssetBundle.MAGIC:
+            raise ValueError(file_name + " is not asset bundle")
+        masks = (mask_r, mask_g, mask_b, mask_a)
+        if masks != AssetBundle.get_display_masks():
+            raise ValueError(file_name + " was built for other pixel format")
+        self.format = AssetBundle.FORMATS[masks]
+        self.entries = dict()  # name -> (size, offset, length, crc32)
+        for index in range(count):
+            name, width, height, offset, length, crc = AssetBundle.ENTRY.unpack_from(
+                self.map, AssetBundle.HEADER.size + index * AssetBundle.ENTRY.size)
+            self.entries[name.rstrip(b"\0").decode()] = ((width, height), offset, length, crc)
+
+    @staticmethod
+    def get_display_masks():
+        return pygame.Surface((1, 1), SRCALPHA).convert_alpha().get_masks()
+
+    @staticmethod
+    def get_crc(file_name):
+        with open(file_name, "rb") as file:
+            return zlib.crc32(file.read())
+
+    def get_surface(self, asset):
+        """
+        :return: surface which uses mapped pixels, None if asset isn't in bundle or its PNG was changed
+        """
+        entry = self.entries.get(asset.name)
+        if entry is None:
+            return None
+        size, offset, length, crc = entry
+        if AssetBundle.get_crc(asset.get_path()) != crc:
+            print("Asset bundle is stale for " + asset.get_path() + ", PNG is used.")
+            return None
+        return pygame.image.frombuffer(memoryview(self.map)[offset:offset + length], size, self.format)
+
+    @staticmethod
+    def build(file_name, assets):
+        """
+            Write bundle with every image from assets. Display must be initialized, its format is used.
+        :return: number of images in bundle
+        """
+        masks = AssetBundle.get_display_masks()
+        if masks not in AssetBundle.FORMATS:
+            raise ValueError("unsupported display pixel format")
+        images = [asset for asset in assets if asset.is_image()]
+        offset = AssetBundle.HEADER.size + len(images) * AssetBundle.ENTRY.size
+        index = []
+        pixels = []
+        for asset in images:
+            offset = -(-offset // 64) * 64
+            surface = pygame.image.load(asset.get_path()).convert_alpha()
+            data = pygame.image.tobytes(surface, AssetBundle.FORMATS[masks])
+            index.append(AssetBundle.ENTRY.pack(asset.name.encode(), surface.get_width(), surface.get_height(),
+                                                offset, len(data), AssetBundle.get_crc(asset.get_path())))
+            pixels.append((offset, data))
+            offset += len(data)
+        with open(file_name, "wb") as file:
+            file.write(AssetBundle.HEADER.pack(AssetBundle.MAGIC, *(masks + (len(images),))))
+            file.write(b"".join(index))
+            for offset, data in pixels:
+                file.write(b"\0" * (offset - file.tell()))
+                file.write(data)
+        return len(images)
+
+
+class TextureAtlas():
+    """
+        Images packed into one surface with index of their areas. get_blits() returns (atlas, dest, area)
+        triples for packed images and (image, dest) pairs for other images (texts, attack waves),
+        so every sprite of a frame is drawn by one Surface.blits call.
+    """
+    ALIGN = 4  # pixels, SDL blits faster when rows of source start on 16 bytes boundary
+
+    def __init__(self, images, max_width=512, padding=1):
+        """
+        :param images: OrderedDict name -> surface
+        :param max_width: width of atlas, wider images get own shelf
+        :param padding: minimal transparent pixels between images
+        """
+        align = lambda value: -(-value // TextureAtlas.ALIGN) * TextureAtlas.ALIGN
+        self.index = OrderedDict()  # name -> area on atlas
+        self.areas = dict()  # packed surface -> area on atlas
+        # shelf packing, the highest images first
+        x, y, shelf_height, width = 0, 0, 0, 0
+        for name, image in sorted(images.items(), key=lambda item: -item[1].get_height()):
+            if x > 0 and x + image.get_width() > max_width:  # next shelf
+                x, y, shelf_height = 0, y + shelf_height + padding, 0
+            self.index[name] = pygame.Rect((x, y), image.get_size())
+            width = max(width, align(x + image.get_width()))
+            x = align(x + image.get_width() + padding)
+            shelf_height = max(shelf_height, image.get_height())
+        self.surface = pygame.Surface((max(1, width), max(1, y + shelf_height)), SRCALPHA)
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+        self.surface.fill((0, 0, 0, 0))
+        for name, area in self.index.items():
+            # maximum with transparent black copies pixels with alpha, normal blit would blend them
+            self.surface.blit(images[name], area, special_flags=BLEND_RGBA_MAX)
+            self.areas[images[name]] = area
+
+    def get_blit(self, image, dest):
+        area = self.areas.get(image)
+        if area is None:
+            return image, dest
+        return self.surface, dest, area
+
+    def get_blits(self, sprites):
+        """
+        :return: blit sequence for Surface.blits which draws sprites in order
+        """
+        areas = self.areas
+        atlas = self.surface
+        return [(atlas, sprite.rect, areas[sprite.image]) if sprite.image in areas else (sprite.image, sprite.rect)
+                for sprite in sprites]
+
+
+class TextCache():
+    """
+        Bounded cache of rendered texts with LRU eviction. Fonts are taken from App resources.
+    """
+    def __init__(self, app, max_size=512):
+        self.app = app
+        self.max_size = max_size
+        self.surfaces = OrderedDict()  # (font_name, text, color, antialias) -> surface
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, font_name, text, antialias, color):
+        """
+            Same as Font.render, but surface is shared and can't be modified by caller.
+        """
+        key = (font_name, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = self.app.get_resource(font_name).render(text, antialias, color)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {"size": len(self.surfaces), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0}
+
+
+def count_full_bars(value, bars):
+    """
+        Number of bar points lower than value, it is how many of bars are drawn as full.
+    """
+    return min(bars, max(0, int(math.ceil(value))))
+
+
+class FrameProfiler():
+    """
+        Time of every phase of frame and number of entities of every type.
+        Code of a phase ends with "if profiler.active: profiler.lap(phase)", time since the previous lap is added
+        to the phase. When profiler is disabled frames aren't started, so it costs one attribute check per phase.
+    """
+    PHASES = ("events", "input", "scheduler", "entities", "collide_player_with_enemies",
+              "collide_attack_waves_with_enemies", "collide_player_with_bonuses", "pop_up_labels",
+              "background", "hud", "sprites", "flip")
+
+    def __init__(self, app, window=300, history=100000):
+        """
+        :param window: frames used by rolling average and p99
+        :param history: frames kept for export
+        """
+        self.app = app
+        self.enabled = False  # start frames in App.run and App.simulate
+        self.active = False  # frame is measured now
+        self.overlay_visible = False
+        self.recent = deque(maxlen=window)
+        self.frames = deque(maxlen=history)  # (frame index, total time, phase times, entity counts)
+        self.frame_index = 0
+        self.phase_times = dict()
+        self.frame_start = 0.0
+        self.last_lap = 0.0
+        self.overlay = None
+        self.overlay_time = 0.0
+        self.export_file_name = None  # frames are exported at exit, profiler stays enabled
+
+    def begin_frame(self):
+        self.phase_times = dict.fromkeys(FrameProfiler.PHASES, 0.0)
+        self.frame_start = self.last_lap = time.perf_counter()
+        self.active = True
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phase_times[phase] += now - self.last_lap
+        self.last_lap = now
+
+    def end_frame(self):
+        self.active = False
+        group = self.app.game_objects_group
+        counts = Counter(type(sprite).__name__ for sprite in group)
+        counts["PopUpLabel"] = len(group.pop_up_label_group)
+        record = (self.frame_index, time.perf_counter() - self.frame_start,
+                  tuple(self.phase_times[phase] for phase in FrameProfiler.PHASES), counts)
+        self.recent.append(record)
+        self.frames.append(record)
+        self.frame_index += 1
+
+    def toggle_overlay(self):
+        self.overlay_visible = not self.overlay_visible
+        self.enabled = self.overlay_visible or self.export_file_name is not None
+
+    def get_summary(self):
+        """
+        :return: OrderedDict name -> (average ms, p99 ms) for every phase and whole frame over recent frames
+        """
+        summary = OrderedDict()
+        if not self.recent:
+            return summary
+        columns = [[record[1] for record in self.recent]] + \
+            [[record[2][index] for record in self.recent] for index in range(len(FrameProfiler.PHASES))]
+        for name, values in zip(("frame",) + FrameProfiler.PHASES, columns):
+            values.sort()
+            summary[name] = (sum(values) / len(values) * 1000.0,
+                             values[min(len(values) - 1, int(0.99 * len(values)))] * 1000.0)
+        return summary
+
+    def get_overlay(self):
+        """
+        :return: surface with summary and entity counts, it is rendered again twice per second
+        """
+        now = time.perf_counter()
+        if self.overlay is not None and now - self.overlay_time < 0.5:
+            return self.overlay
+        font = self.app.get_resource("small_font")
+        rows = [("phase", "avg ms    p99 ms")]
+        for name, (average, p99) in self.get_summary().items():
+            rows.append((name, "%.3f    %.3f" % (average, p99)))
+        if self.recent:
+            rows.extend(sorted((name, str(count)) for name, count in self.recent[-1][3].items()))
+        labels = [(font.render(name, True, (255, 255, 0)), font.render(value, True, (255, 255, 0)))
+                  for name, value in rows]
+        name_width = max(name.get_width() for name, value in labels)
+        value_width = max(value.get_width() for name, value in labels)
+        self.overlay = pygame.Surface((name_width + value_width + 20, len(labels) * font.get_linesize() + 8),
+                                      SRCALPHA)
+        self.overlay.fill((0, 0, 0, 190))
+        for index, (name, value) in enumerate(labels):
+            pos_y = 4 + index * font.get_linesize()
+            self.overlay.blit(name, (4, pos_y))
+            self.overlay.blit(value, (self.overlay.get_width() - 4 - value.get_width(), pos_y))  # right aligned
+        self.overlay_time = now
+        return self.overlay
+
+    def get_overlay_rect(self):
+        overlay = self.get_overlay()
+        return overlay.get_rect(topright=(self.app.draw_surface.get_width(), self.app.get_info_bar_rect().h))
+
+    def export(self, file_name):
+        """
+            Save every kept frame, CSV if file name ends with .csv, otherwise JSON with summary.
+        """
+        types = sorted(set(name for record in self.frames for name in record[3]))
+        if file_name.lower().endswith(".csv"):
+            with open(file_name, "w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["frame", "frame_ms"] + [phase + "_ms" for phase in FrameProfiler.PHASES] + types)
+                for index, total, phase_times, counts in self.frames:
+                    writer.writerow([index, round(total * 1000.0, 4)] +
+                                    [round(phase_time * 1000.0, 4) for phase_time in phase_times] +
+                                    [counts.get(name, 0) for name in types])
+        else:
+            with open(file_name, "w") as file:
+                json.dump({
+                    "summary": dict((name, {"avg_ms": average, "p99_ms": p99})
+                                    for name, (average, p99) in self.get_summary().items()),
+                    "phases": FrameProfiler.PHASES,
+                    "frames": [{"frame": index, "frame_ms": total * 1000.0,
+                                "phases_ms": [phase_time * 1000.0 for phase_time in phase_times],
+                                "entities": dict(counts)}
+                               for index, total, phase_times, counts in self.frames],
+                }, file)
+
+
+class FrameGovernor():
+    """
+        Keeps frame time within budget on slow machines. It watches times of recent frames and raises load level
+        when they are over budget: first AttackWaves are drawn as outlines and damage labels of one frame are
+        merged into one label, then SpawnEngine stops spawning enemies and bonuses above a limit.
+        Level is lowered when frames are fast again for a while. Every change of level is logged.
+        Only App.run feeds frame times, so headless and recorded games are not affected.
+    """
+    # max_enemies/max_bonuses None - no limit
+    LEVELS = (
+        dict(merge_labels=False, wave_outline=False, max_enemies=None, max_bonuses=None),
+        dict(merge_labels=True, wave_outline=True, max_enemies=None, max_bonuses=None),
+        dict(merge_labels=True, wave_outline=True, max_enemies=150, max_bonuses=60),
+        dict(merge_labels=True, wave_outline=True, max_enemies=60, max_bonuses=25),
+    )
+
+    def __init__(self, budget, window=30, lower_ratio=0.6, lower_delay=3.0):
+        """
+        :param budget: seconds of work allowed in one frame
+        :param window: frames averaged before every decision
+        :param lower_ratio: level is lowered when average is below budget * lower_ratio
+        :param lower_delay: seconds of fast frames needed to lower level
+        """
+        self.enabled = True
+        self.budget = budget
+        self.lower_ratio = lower_ratio
+        self.lower_delay = lower_delay
+        self.frame_times = deque(maxlen=window)
+        self.fast_since = None  # time when frames became fast
+        self.level = 0
+        self.merge_labels = False
+        self.wave_outline = False
+        self.max_enemies = None
+        self.max_bonuses = None
+        self.log = []  # (time since start, old level, new level, average frame ms, reason)
+        self.start_time = time.perf_counter()
+
+    def add_frame(self, frame_time):
+        """
+            Time of work in the last frame (without waiting for the next one).
+        """
+        if not self.enabled:
+            return
+        frame_times = self.frame_times
+        frame_times.append(frame_time)
+        if len(frame_times) < frame_times.maxlen:
+            return
+        average = sum(frame_times) / len(frame_times)
+        if average > self.budget:
+            if self.level + 1 < len(FrameGovernor.LEVELS):
+                self.set_level(self.level + 1, average, "over budget")
+            self.fast_since = None
+        elif average < self.budget * self.lower_ratio:
+            now = time.perf_counter()
+            if self.fast_since is None:
+                self.fast_since = now
+            elif self.level > 0 and now - self.fast_since > self.lower_delay:
+                self.set_level(self.level - 1, average, "under budget")
+        else:
+            self.fast_since = None
+
+    def set_level(self, level, average=0.0, reason=""):
+        self.log.append((time.perf_counter() - self.start_time, self.level, level, average * 1000.0, reason))
+        print("Frame governor: level " + str(self.level) + " -> " + str(level) + " (" + reason + ", " +
+              str(round(average * 1000.0, 2)) + " ms of " + str(round(self.budget * 1000.0, 2)) + " ms budget).")
+        self.level = level
+        settings = FrameGovernor.LEVELS[level]
+        self.merge_labels = settings["merge_labels"]
+        self.wave_outline = settings["wave_outline"]
+        self.max_enemies = settings["max_enemies"]
+        self.max_bonuses = settings["max_bonuses"]
+        self.frame_times.clear()  # next decision is based on frames with new level
+        self.fast_since = None
+
+
+class EventPresenter():
+    """
+        Presentation stage. Once per frame it takes GameEvents appended by simulation and creates their pop-up
+        labels in one batch. When it is disabled (headless game which isn't drawn) GameObjectsGroup.events is None,
+        so simulation doesn't create events and texts aren't rendered. Effect level of FrameGovernor is applied
+        here too, simulation doesn't read it.
+    """
+    def __init__(self, app, enabled=True):
+        self.app = app
+        self.enabled = enabled
+
+    def present(self, group):
+        events = group.events
+        if not events:
+            return
+        group.events = []
+        render_text = self.app.render_text
+        merge_hits = self.app.governor.merge_labels  # one label with sum of damage under load
+        merged_damage = 0.0
+        merged_hits = 0
+        merged_pos = None
+        for event in events:
+            event_type = type(event)
+            if event_type is GameEvent.Hit:
+                if merge_hits:
+                    merged_damage += event.damage
+                    merged_hits += 1
+                    if merged_pos is None:
+                        merged_pos = event.pos
+                    continue
+                image = render_text("small_font", "-" + str(round(event.damage, 2)) + " dmg", True, (239, 75, 117))
+            elif event_type is GameEvent.PlayerDamaged:
+                image = render_text("small_font", "-" + str(event.damage) + " HP", True, (255, 25, 25))
+            elif event_type is GameEvent.BonusCollected:
+                image = render_text("small_font", "+" + event.description, True, (100, 255, 100))
+            else:  # EnemyKilled, WaveSpawned and PlayerDied have no label
+                continue
+            group.add_pop_up_label(group.new_object(PopUpLabel, image, event.pos, False))
+        if merged_hits:
+            text = "-" + str(round(merged_damage, 2)) + " dmg"
+            if merged_hits > 1:
+                text += " (" + str(merged_hits) + " hits)"
+            image = render_text("small_font", text, True, (239, 75, 117))
+            group.add_pop_up_label(group.new_object(PopUpLabel, image, merged_pos, False))
+
+    @staticmethod
+    def present_attack_waves(group, outline):
+        """
+            Frames of attack waves for drawing, simulated waves don't depend on effect level.
+        :param outline: draw only borders of circles, FrameGovernor.wave_outline under load
+        """
+        for attack_wave in group.attack_waves:
+            attack_wave.image = AttackWave.get_frame(attack_wave.r, attack_wave.max_r, outline)
+
+
+class Hud():
+    """
+        Info bar with HP, attack and gold information composited into one surface.
+        Surface is changed only when shown values change and then only changed bars and gold label are drawn.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.surface = None
+        self.state = None  # App.get_hud_state() shown on surface
+        self.gold_rect = None
+
+    def get_bar_rect(self, index, pos_y):
+        bar = self.app.get_resource("ects_bar_full")
+        gap = bar.get_width() + 1#gap beetween bars
+        return pygame.Rect(self.app.get_resource("ects_info").get_width() + gap * (index + 1), pos_y,
+                           bar.get_width(), bar.get_height())
+
+    def draw_bars(self, pos_y, old_full, new_full, bars):
+        """
+            Draw bars with index between old_full and new_full.
+        """
+        atlas = self.app.get_atlas()
+        background = []
+        bar_blits = []
+        for index in range(min(old_full, new_full), min(max(old_full, new_full), bars)):
+            rect = self.get_bar_rect(index, pos_y)
+            background.append((self.app.static_layer, rect, rect))
+            bar_blits.append(atlas.get_blit(
+                self.app.get_resource("ects_bar_full" if index < new_full else "ects_bar_empty"), rect))
+        self.surface.blits(background, False)
+        self.surface.blits(bar_blits, False)
+
+    def draw_gold(self, gold, pos_y):
+        if self.gold_rect is not None:
+            self.surface.blit(self.app.static_layer, self.gold_rect, self.gold_rect)
+        gold_label = self.app.render_text("big_font", str(gold), True, (255, 255, 255))
+        self.gold_rect = self.surface.blit(gold_label,
+                                           (self.app.get_resource("gold_info").get_width() + 10, pos_y - 6))
+
+    def update(self):
+        """
+            Bring surface up to date with player.
+        :return: True if surface was changed
+        """
+        state = self.app.get_hud_state()
+        if state == self.state:
+            return False
+        bars, hp_full, attack_full, gold = state
+        attack_pos_y = self.app.get_resource("ects_info").get_height() + 5
+        gold_pos_y = self.app.get_resource("attack_info").get_height() + attack_pos_y + 5
+        if self.surface is None or self.state[0] != bars:  # draw everything
+            info_bar_rect = self.app.get_info_bar_rect()
+            self.surface = self.app.static_layer.subsurface(info_bar_rect).copy()
+            self.gold_rect = None
+            self.surface.blit(self.app.get_resource("ects_info"), (0, 0))
+            self.surface.blit(self.app.get_resource("attack_info"), (0, attack_pos_y))
+            self.surface.blit(self.app.get_resource("gold_info"), (0, gold_pos_y))
+            self.draw_bars(0, 0, bars, bars)  # all bars as full, then empty ones
+            self.draw_bars(attack_pos_y, 0, bars, bars)
+            old_state = (bars, bars, bars, None)
+        else:
+            old_state = self.state
+        self.draw_bars(0, old_state[1], hp_full, bars)
+        self.draw_bars(attack_pos_y, old_state[2], attack_full, bars)
+        if old_state[3] != gold:
+            self.draw_gold(gold, gold_pos_y)
+        self.state = state
+        return True
+
+
+class DirtyRectRenderer():
+    """
+        Draw only what changed since the last frame. Background is restored under new, moved and removed
+        sprites, sprites covering these regions are drawn again, HUD is redrawn when its values change
+        and only dirty regions are pushed to display.
+        Whole frame is redrawn (App.draw_full) when game_mode changes or dirty regions cover most of display.
+    """
+    def __init__(self, app, max_dirty_area=0.5):
+        self.app = app
+        self.max_dirty_area = max_dirty_area  # fraction of display
+        self.drawn_sprites = dict()  # sprite -> (rect, image) from the last frame
+        self.game_mode = None
+        self.game_objects_group = None
+        self.hud_state = None
+        self.fps_counter = None
+        self.full_redraw = True  # set it to force App.draw_full in next frame
+        self.profiler_overlay_rect = None  # where FrameProfiler overlay was drawn
+
+    def get_sprites(self):
+        """
+            Sprites in the same order as GameObjectsGroup.draw use.
+        """
+        group = self.app.game_objects_group
+        return group.sprites() + group.pop_up_label_group.sprites()
+
+    def remember(self, sprites, hud_state, fps_counter):
+        self.drawn_sprites = dict((sprite, (sprite.rect.copy(), sprite.image)) for sprite in sprites)
+        self.game_mode = self.app.game_mode
+        self.game_objects_group = self.app.game_objects_group
+        self.hud_state = hud_state
+        self.fps_counter = fps_counter
+        self.full_redraw = False
+        profiler = self.app.profiler
+        self.profiler_overlay_rect = profiler.get_overlay_rect() if profiler.overlay_visible else None
+
+    def draw_full(self):
+        self.app.draw_full()
+        self.remember(self.get_sprites(), self.app.get_hud_state(), self.app.get_fps_counter())
+
+    def draw(self):
+        app = self.app
+        if self.full_redraw or app.game_mode != self.game_mode or \
+                app.game_objects_group is not self.game_objects_group:
+            self.draw_full()
+            return
+        if app.game_mode != App.GameMode.GAME_MAIN:
+            return  # game is stopped and information window is already drawn
+
+        surface = app.draw_surface
+        display_rect = surface.get_rect()
+        sprites = self.get_sprites()
+        current_sprites = dict.fromkeys(sprites)
+        redraw = dict()  # sprites to draw, dict is used as ordered set
+        dirty = []
+        for sprite in sprites:
+            drawn = self.drawn_sprites.get(sprite)
+            if drawn is None or drawn[1] is not sprite.image or drawn[0] != sprite.rect:
+                redraw[sprite] = None
+                dirty.append(sprite.rect.clip(display_rect))
+                if drawn is not None:
+                    dirty.append(drawn[0].clip(display_rect))
+        for sprite, drawn in self.drawn_sprites.items():
+            if sprite not in current_sprites:  # removed
+                dirty.append(drawn[0].clip(display_rect))
+
+        info_bar_rect = app.get_info_bar_rect()
+        hud_state = app.get_hud_state()
+        fps_counter = app.get_fps_counter()
+        redraw_info_bar = hud_state != self.hud_state or fps_counter[0] is not self.fps_counter[0] or \
+            fps_counter[1] != self.fps_counter[1]
+        if redraw_info_bar:
+            dirty.append(info_bar_rect)
+        profiler = app.profiler
+        if profiler.overlay_visible:  # it is drawn on top every frame
+            dirty.append(profiler.get_overlay_rect())
+        if self.profiler_overlay_rect is not None:
+            dirty.append(self.profiler_overlay_rect)
+
+        if sum(rect.w * rect.h for rect in dirty) > self.max_dirty_area * display_rect.w * display_rect.h:
+            self.draw_full()
+            return
+
+        # background under unchanged sprites can be restored too, so they have to be drawn again
+        expanded = True
+        while expanded:
+            expanded = False
+            if not redraw_info_bar and info_bar_rect.collidelist(dirty) != -1:
+                redraw_info_bar = True
+                dirty.append(info_bar_rect)
+            for sprite in sprites:
+                if sprite not in redraw and sprite.rect.collidelist(dirty) != -1:
+                    redraw[sprite] = None
+                    dirty.append(sprite.rect.clip(display_rect))
+                    expanded = True
+
+        for rect in dirty:
+            surface.blit(app.static_layer, rect, rect)
+        if profiler.active:
+            profiler.lap("background")
+        if redraw_info_bar:
+            app.draw_hud()
+            app.draw_fps_counter()
+        if profiler.active:
+            profiler.lap("hud")
+        surface.blits(app.get_atlas().get_blits([sprite for sprite in sprites if sprite in redraw]), False)
+        if profiler.overlay_visible:
+            surface.blit(profiler.get_overlay(), profiler.get_overlay_rect())
+        if profiler.active:
+            profiler.lap("sprites")
+        if not app.headless:
+            pygame.display.update(dirty)
+        if profiler.active:
+            profiler.lap("flip")
+        self.remember(sprites, hud_state, fps_counter)
 
 
 class App:
@@ -590,37 +3088,80 @@ class App:
         GAME_MAIN = 1
         GAME_END = 2
 
-    def __init__(self, window_size):
+    ASSETS = [
+        # hud and information window of GAME_BEGIN
+        Asset("background", "background", "png"),
+        Asset("ects_info", "ects_info", "png"),
+        Asset("attack_info", "attack_info", "png"),
+        Asset("ects_bar_full", "ects_bar_full", "png"),
+        Asset("ects_bar_empty", "ects_bar_empty", "png", preload=False),  # drawn after the first hit
+        Asset("gold_info", "gold_info", "png"),
+        Asset("wasd", "wasd", "png"),
+        Asset("space", "space", "png"),
+        Asset("big_font", "font", "ttf", size=23),
+        Asset("medium_font", "font", "ttf", size=15),
+        Asset("small_font", "font", "ttf", size=14),
+        Asset("huge_font", "font", "ttf", size=32),
+        # game objects
+        Asset("player", "player", "png"),
+        Asset("player_low_hp", "player_low_hp", "png"),
+        Asset("player_very_low_hp", "player_very_low_hp", "png"),
+        Asset("enemy1", "enemy1", "png"),
+        Asset("enemy2", "enemy2", "png"),
+        Asset("enemy3", "enemy3", "png"),
+        Asset("gold", "gold", "png"),
+        Asset("hp", "hp", "png"),
+        Asset("attack", "attack", "png"),
+    ]
+
+    ATLAS_IMAGES = ("player", "player_low_hp", "player_very_low_hp", "enemy1", "enemy2", "enemy3", "gold", "hp",
+                    "attack", "ects_bar_full", "ects_bar_empty", "ects_info", "attack_info", "gold_info")
+
+    def __init__(self, window_size, headless=False, dirty_rendering=True, tick_rate=70, max_fps=70,
+                 max_frame_steps=5, seed=None, bundle=os.path.join(ASSET_DIRECTORY, "assets.bundle"),
+                 vectorized_physics=False):
+        """
+        :param window_size: (w, h)
+        :param headless: use SDL dummy video driver, nothing is shown and display is never flipped
+        :param dirty_rendering: use DirtyRectRenderer, if False whole display is redrawn every frame
+        :param tick_rate: simulation updates per second in run()
+        :param max_fps: frames per second limit in run()
+        :param max_frame_steps: more simulation updates in one frame are dropped (overloaded machine)
+        :param seed: seed of the seeds of every game, if None then games are not reproducible
+        :param bundle: AssetBundle built by --build-bundle, PNG files are used if it doesn't exist
+        :param vectorized_physics: move enemies and bonuses and update enemies with VectorizedPhysics (numpy)
+        """
+        self.headless = headless
+        self.vectorized_physics = vectorized_physics
+        self.seed = seed
+        self.seed_random = random.Random(seed)
+        self.input_recorder = None  # InputRecorder, it stores input of every update()
+        self.snapshots = None  # SnapshotRing with WorldSnapshot of every update, it is used by rewind()
+        self.tick_rate = tick_rate
+        self.max_fps = max_fps
+        self.max_frame_steps = max_frame_steps
+        self.render_interpolation = False  # draw positions between the last two simulation states
+        self.interpolation = 1.0  # position of drawn frame between these states
+        self.dropped_steps = 0
+        self.first_frame_time = None  # seconds from start of __init__ to the first frame drawn by run()
+        self.profiler = FrameProfiler(self)
+        self.governor = FrameGovernor(1.0 / max_fps)
+        self.event_presenter = EventPresenter(self, enabled=not headless)  # headless game isn't drawn
+        self.asset_loader = AssetLoader(self, App.ASSETS, bundle=bundle)
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"  # must be set before pygame.init()
         pygame.init()
         self.window = pygame.display.set_mode(window_size)  # create game display and init video mode
-        self.resource = dict()
-        try:  # load resources
-            self.load_resource("background", "png")
-            self.load_resource("ects_info", "png")
-            self.load_resource("attack_info", "png")
-            self.load_resource("ects_bar_full", "png")
-            self.load_resource("ects_bar_empty", "png")
-            self.load_resource("gold_info", "png")
-            self.load_resource(file_name="font", extension="ttf", size=23, name="big_font")
-            self.load_resource(file_name="font", extension="ttf", size=15, name="medium_font")
-            self.load_resource(file_name="font", extension="ttf", size=14, name="small_font")
-            self.load_resource(file_name="font", extension="ttf", size=32, name="huge_font")
-            self.load_resource("player", "png")
-            self.load_resource("player_low_hp", "png")
-            self.load_resource("player_very_low_hp", "png")
-            self.load_resource("enemy1", "png")
-            self.load_resource("enemy2", "png")
-            self.load_resource("enemy3", "png")
-            self.load_resource("gold", "png")
-            self.load_resource("hp", "png")
-            self.load_resource("attack", "png")
-            self.load_resource("wasd", "png")
-            self.load_resource("space", "png")
+        self.resource = self.asset_loader.resource
+        self.atlas = None  # TextureAtlas with ATLAS_IMAGES, built at the first draw
+        try:  # start loading resources, headless game needs only a few images
+            self.asset_loader.start(background=not headless)
         except Exception as exception:
             print("fail.")
             print(exception)
-            sys.exit(0)
+            sys.exit(1)
 
+        self.text_cache = TextCache(self)
         self.done = False#for main loop
         self.draw_surface = pygame.display.get_surface()
         pygame.display.set_caption("ECTS", "")  # setting display name
@@ -628,12 +3169,21 @@ class App:
         self.black_filter = pygame.Surface((self.window.get_width(), self.window.get_height()))
         self.black_filter.fill((0, 0, 0))
         self.black_filter.set_alpha(180)
+        if not headless:
+            AttackWave.prerender()
         self.init_game()
         self.game_mode = App.GameMode.GAME_BEGIN
+        self.static_layer = self.create_static_layer()
+        self.hud = Hud(self)
+        self.overlay_cache = None  # (key, whole GAME_BEGIN/GAME_END frame)
+        self.overlay_game_mode = None
+        self.dirty_rect_renderer = DirtyRectRenderer(self) if dirty_rendering else None
 
     def init_game(self):
+        self.game_seed = self.seed_random.getrandbits(32)
         self.game_objects_group = GameObjectsGroup(
-            [0, 100, self.window.get_width(), self.window.get_height()], self)
+            [0, 100, self.window.get_width(), self.window.get_height()], self, self.vectorized_physics,
+            seed=self.game_seed)
         play_area_center = (self.game_objects_group.play_area[2] / 2, self.game_objects_group.play_area[3] / 2)
         self.player = Player(self.get_resource("player"), self.get_resource("player_low_hp"),
                              self.get_resource("player_very_low_hp"),
@@ -641,92 +3191,171 @@ class App:
                              self.game_objects_group)
 
         self.game_objects_group.add_player(self.player)
+        self.game_objects_group.keep_previous_positions = self.render_interpolation
+        self.game_objects_group.events = [] if self.event_presenter.enabled else None
         self.gold_goal = 2000 #game goal
+        if self.snapshots is not None:
+            self.snapshots.clear()
 
     def load_resource(self, file_name, extension, name="", size=10):
+        """
+            Load asset which is not in App.ASSETS.
+        """
         if name == "":
             name = file_name
-        print("Loading " + file_name + "." + extension + " and.... ", end="")
-        if (extension.upper() == "PNG"):
-            # convert_alpha convert loaded surface into surface with mode like display_surface
-            # it's huge fps increase
-            self.resource[name] = pygame.image.load(file_name + "." + extension).convert_alpha()
-        elif (extension.upper() == "TTF"):
-            self.resource[name] = pygame.font.Font(file_name + "." + extension, size)
-        print("success.")
+        asset = Asset(name, file_name, extension, size, preload=False)
+        self.asset_loader.assets[name] = asset
+        return self.asset_loader.get(name)
 
     def get_resource(self, name):
         try:
-            return self.resource[name]
+            return self.asset_loader.get(name)
         except Exception as exception:
             print("Cannot get resource " + str(exception) + ".")
-            sys.exit(0)
+            sys.exit(1)
+
+    def get_atlas(self):
+        """
+            TextureAtlas with preloaded images of ATLAS_IMAGES. Lazy images aren't packed, atlas would load them
+            at the first draw, they are drawn by own blit.
+        """
+        if self.atlas is None:
+            assets = self.asset_loader.assets
+            self.atlas = TextureAtlas(OrderedDict((name, self.get_resource(name)) for name in App.ATLAS_IMAGES
+                                                  if assets[name].preload))
+        return self.atlas
+
+    def render_text(self, font_name, text, antialias, color):
+        return self.text_cache.render(font_name, text, antialias, color)
+
+    def set_presentation(self, enabled):
+        """
+            Collect gameplay events and show them as pop-up labels, headless game needs it only if it is drawn.
+        """
+        self.event_presenter.enabled = enabled
+        self.game_objects_group.events = [] if enabled else None
 
     def events_loop(self, events):
         for event in events:
             if event.type == QUIT:
                 self.done = True
+            elif event.type == KEYDOWN and event.key == K_F3:
+                self.profiler.toggle_overlay()
+            elif event.type == KEYDOWN and event.key == K_F5 and self.snapshots is not None and len(self.snapshots):
+                self.rewind(min(self.tick_rate, len(self.snapshots) - 1))  # one second back
 
     def draw(self):
         """
             Main draw function.
         :return: None
         """
+        self.event_presenter.present(self.game_objects_group)
+        self.event_presenter.present_attack_waves(self.game_objects_group, self.governor.wave_outline)
+        moved = None
+        if self.game_mode == App.GameMode.GAME_MAIN and self.game_objects_group.keep_previous_positions:
+            moved = self.game_objects_group.interpolate(self.interpolation)
+        if self.dirty_rect_renderer is not None:
+            self.dirty_rect_renderer.draw()
+        else:
+            self.draw_full()
+        if moved is not None:
+            self.game_objects_group.restore_positions(moved)
+
+    def create_static_layer(self):
+        """
+            Background, info bar and borders. They never change, so they are drawn only once.
+        :return: Surface with size of display
+        """
+        static_layer = pygame.Surface(self.draw_surface.get_size()).convert()
         # background
-        self.draw_surface.blit(self.get_resource("background"), (0, self.game_objects_group.play_area[1]))
+        static_layer.blit(self.get_resource("background"), (0, self.game_objects_group.play_area[1]))
 
         # info bar fill
-        self.draw_surface.fill((35, 9, 9),
-                               pygame.Rect(0, 0, self.game_objects_group.play_area[2],
-                                           self.game_objects_group.play_area[1]))
+        static_layer.fill((35, 9, 9), self.get_info_bar_rect())
         # info bar border
-        pygame.draw.rect(self.draw_surface, (0, 0, 0),
-                         pygame.Rect(0, 0,self.game_objects_group.play_area[2],
-                                     self.game_objects_group.play_area[1]),
-                         2)
+        pygame.draw.rect(static_layer, (0, 0, 0), self.get_info_bar_rect(), 2)
         # display  border
-        pygame.draw.rect(self.draw_surface, (0, 0, 0),
+        pygame.draw.rect(static_layer, (0, 0, 0),
                          pygame.Rect(0, 0,
                                      self.draw_surface.get_width(), self.draw_surface.get_height()),
                          5)
+        return static_layer
+
+    def get_info_bar_rect(self):
+        return pygame.Rect(0, 0, self.game_objects_group.play_area[2], self.game_objects_group.play_area[1])
+
+    def draw_full(self):
+        """
+            Redraw whole display and flip it.
+            GAME_BEGIN and GAME_END frames are drawn once per state entry (and score) and then copied from cache.
+        :return: None
+        """
+        if self.game_mode != self.overlay_game_mode:  # new state entry
+            self.overlay_cache = None
+            self.overlay_game_mode = self.game_mode
+        overlay_key = (self.game_mode, self.player.gold, self.gold_goal)
+        if self.game_mode != App.GameMode.GAME_MAIN and self.overlay_cache is not None and \
+                self.overlay_cache[0] == overlay_key:
+            self.draw_surface.blit(self.overlay_cache[1], (0, 0))
+        else:
+            self.draw_surface.blit(self.static_layer, (0, 0))
+            if self.profiler.active:
+                self.profiler.lap("background")
+            self.draw_hud()
+            self.draw_fps_counter()
+            if self.profiler.active:
+                self.profiler.lap("hud")
+
+            # draw every GameObjects
+            self.game_objects_group.draw(self.draw_surface)
+
+            if self.game_mode != App.GameMode.GAME_MAIN:
+                self.draw_overlay()
+                self.overlay_cache = (overlay_key, self.draw_surface.copy())
+        if self.profiler.overlay_visible:
+            self.draw_surface.blit(self.profiler.get_overlay(), self.profiler.get_overlay_rect())
+        if self.profiler.active:
+            self.profiler.lap("sprites")
+        if not self.headless:
+            pygame.display.flip()  # update display
+        if self.profiler.active:
+            self.profiler.lap("flip")
+
+    def get_hud_state(self):
+        """
+            Values shown by draw_hud(), HUD is redrawn only if they change.
+        :return: (number of bars, full hp bars, full attack bars, gold)
+        """
+        bars = self.player.max_hp
+        return bars, count_full_bars(self.player.hp, bars), \
+            count_full_bars(bars * self.player.attack_level / self.player.max_attack_level, bars), self.player.gold
 
-        # hp points information
-        self.draw_surface.blit(self.get_resource("ects_info"), (0, 0))
-        hp_bar = self.get_resource("ects_bar_full")
-        gap = hp_bar.get_width() + 1;#gap beetween bars
-        bar_placement = self.get_resource("ects_info").get_width() + gap
-        for hp_point in range(self.player.max_hp):
-            if self.player.hp <= hp_point:
-                hp_bar = self.get_resource("ects_bar_empty")
-            self.draw_surface.blit(hp_bar, (bar_placement, 0))
-            bar_placement += gap
-
-        # Attack percentage information
-        attack_pos_y = self.get_resource("ects_info").get_height() + 5
-        self.draw_surface.blit(self.get_resource("attack_info"), (0, attack_pos_y))
-        attack_bar = self.get_resource("ects_bar_full")
-        bar_placement = self.get_resource("ects_info").get_width() + gap
-        for attack_point in range(self.player.max_hp):
-            if self.player.max_hp * self.player.attack_level / self.player.max_attack_level <= attack_point:
-                attack_bar = self.get_resource("ects_bar_empty")
-            self.draw_surface.blit(attack_bar, (bar_placement, attack_pos_y))
-            bar_placement += gap
-
-        # gold points information
-        gold_pos_y = self.get_resource("attack_info").get_height() + attack_pos_y + 5
-        self.draw_surface.blit(self.get_resource("gold_info"), (0, gold_pos_y))
-        self.draw_surface.blit(self.get_resource("big_font").render(
-            str(self.player.gold), True, (255, 255, 255)),
-            (self.get_resource("gold_info").get_width() + 10, gold_pos_y - 6))
-
-        #fps counter
-        fps_counter = self.get_resource("small_font").render(
+    def draw_hud(self):
+        """
+            HP, attack and gold information on info bar.
+        :return: None
+        """
+        self.hud.update()
+        self.draw_surface.blit(self.hud.surface, (0, 0))
+
+    def get_fps_counter(self):
+        """
+        :return: (fps counter surface, its rect)
+        """
+        fps_counter = self.render_text("small_font",
             "FPS:" + str(round(self.clock.get_fps(), 1)), True, (255, 255, 255))
-        self.draw_surface.blit(fps_counter, (self.draw_surface.get_width() - fps_counter.get_width() - 5, 0))
+        return fps_counter, fps_counter.get_rect(topleft=(
+            self.draw_surface.get_width() - fps_counter.get_width() - 5, 0))
 
-        # draw every GameObjects
-        self.game_objects_group.draw(self.draw_surface)
+    def draw_fps_counter(self):
+        fps_counter, fps_counter_rect = self.get_fps_counter()
+        self.draw_surface.blit(fps_counter, fps_counter_rect)
 
+    def draw_overlay(self):
+        """
+            Information windows for GAME_BEGIN and GAME_END.
+        :return: None
+        """
         if self.game_mode == App.GameMode.GAME_BEGIN:#for GAME_BEGIN information
             self.draw_surface.blit(self.black_filter, (0, 0))#black filter
             info_width = self.draw_surface.get_width() * 0.55#calculatin information window size
@@ -739,14 +3368,14 @@ class App:
             pos = [info_rect[0], info_rect[1]]
             pos[1] += 3
             #description label
-            description = self.get_resource("big_font").render(
+            description = self.render_text("big_font",
                 "Collect enough gold to buy \"warunek\".", True, (255, 255, 255))
             self.draw_surface.blit(description, ((self.draw_surface.get_width() - description.get_width()) / 2,
                                                  pos[1]))
 
             pos[1] += description.get_height() + 10
             #goal label
-            goal = self.get_resource("medium_font").render("Goal: " + str(self.gold_goal), True, (255, 255, 0))
+            goal = self.render_text("medium_font", "Goal: " + str(self.gold_goal), True, (255, 255, 0))
             self.draw_surface.blit(goal, ((self.draw_surface.get_width() - goal.get_width()) / 2,
                                           pos[1]))
             self.draw_surface.blit(self.get_resource("gold"), (
@@ -781,8 +3410,8 @@ class App:
             self.draw_game_object_information(self.get_resource("space"), "to attack", pos, segment_size,
                                               (1, 6))
             #press space to continue
-            press_space_to_continue = self.get_resource("medium_font").render("Press [SPACE] to continue.",
-                                                                              True, (255, 255, 255))
+            press_space_to_continue = self.render_text("medium_font", "Press [SPACE] to continue.",
+                                                           True, (255, 255, 255))
             self.draw_surface.blit(press_space_to_continue,
                                    ((self.draw_surface.get_width() - press_space_to_continue.get_width()) / 2,
                                     info_rect[1] + info_rect[3] - press_space_to_continue.get_height() * 1.5))
@@ -801,7 +3430,7 @@ class App:
             pos = [x for x in info_rect]
             pos[1] += 2.0
             #game over
-            game_over = self.get_resource("huge_font").render("Game Over", True, (255, 255, 255))
+            game_over = self.render_text("huge_font", "Game Over", True, (255, 255, 255))
             self.draw_surface.blit(game_over, ((self.draw_surface.get_width() - game_over.get_width()) / 2,
                                                pos[1]))
             percentage_score = (100 * self.player.gold / self.gold_goal)
@@ -809,17 +3438,14 @@ class App:
             #calculating approximate length of "You Score:..." line
             approximate_line_length_string = "Your    score:K/K=   %"+str(self.player.gold)+\
             str(self.gold_goal)+str(int(percentage_score))
-            pos[0] += (info_width -
-                       self.get_resource("big_font").render(approximate_line_length_string
-                                                            , False, (255, 255, 255)).get_width())/2
-            big_font = self.get_resource("big_font")
+            pos[0] += (info_width - self.get_resource("big_font").size(approximate_line_length_string)[0])/2
             #Your Score:
-            your_score = big_font.render("Your score:", True, (255, 255, 255))
+            your_score = self.render_text("big_font", "Your score:", True, (255, 255, 255))
             self.draw_surface.blit(your_score, (pos[0] + 5, pos[1]))
             pos[0] += your_score.get_width() + 10;
             pos[1] += 2
             #player gold
-            score = big_font.render(str(self.player.gold), True, (255, 255, 0))
+            score = self.render_text("big_font", str(self.player.gold), True, (255, 255, 0))
             self.draw_surface.blit(score, (pos[0], pos[1]))
             pos[0] += score.get_width() + 3
             #gold icon
@@ -827,40 +3453,39 @@ class App:
             self.draw_surface.blit(gold, (pos[0], pos[1] + abs(gold.get_height() - score.get_height()) / 2))
             pos[0] += gold.get_width() + 3
             #/
-            divided = big_font.render("/", True, (255, 255, 255))
+            divided = self.render_text("big_font", "/", True, (255, 255, 255))
             self.draw_surface.blit(divided, (pos[0], pos[1]))
             pos[0] += divided.get_width() + 3
-            goal = big_font.render(str(self.gold_goal), True, (255, 255, 0))
+            goal = self.render_text("big_font", str(self.gold_goal), True, (255, 255, 0))
             self.draw_surface.blit(goal, (pos[0], pos[1]))
             pos[0] += goal.get_width() + 3
             #gold icon
             self.draw_surface.blit(gold, (pos[0], pos[1] + abs(gold.get_height() - goal.get_height()) / 2))
             pos[0] += gold.get_width() + 3
             #=
-            equal = big_font.render("= ", True, (255, 255, 255))
+            equal = self.render_text("big_font", "= ", True, (255, 255, 255))
             self.draw_surface.blit(equal, (pos[0], pos[1]))
             pos[0] += equal.get_width() + 3
             #red collor for % < 100, green for >= 100
             percentage_score_color = (205, 238, 106) if (percentage_score >= 100.0) else (249, 85, 85)
             #SCORE%
-            percentage_score_label = big_font.render(str(int(percentage_score)) + "%", True,
-                                                     percentage_score_color)
+            percentage_score_label = self.render_text("big_font", str(int(percentage_score)) + "%", True,
+                                                      percentage_score_color)
             self.draw_surface.blit(percentage_score_label, (pos[0], pos[1]))
             #press space to continue
-            press_space_to_continue = self.get_resource("medium_font").render("Press [SPACE] to continue.",
-                                                                              True, (255, 255, 255))
+            press_space_to_continue = self.render_text("medium_font", "Press [SPACE] to continue.",
+                                                           True, (255, 255, 255))
             self.draw_surface.blit(press_space_to_continue,
                                    ((self.draw_surface.get_width() - press_space_to_continue.get_width()) / 2,
                                     info_rect[1] + info_rect[3] - press_space_to_continue.get_height() * 2.5))
             #press esc to continue
-            press_esc_to_quit = self.get_resource("medium_font").render("Press [ESC] to quit.",
-                                                                        True, (255, 255, 255))
+            press_esc_to_quit = self.render_text("medium_font", "Press [ESC] to quit.",
+                                                 True, (255, 255, 255))
             self.draw_surface.blit(press_esc_to_quit,
                                    ((self.draw_surface.get_width() - press_esc_to_quit.get_width()) / 2,
                                     info_rect[1] + info_rect[3] - press_esc_to_quit.get_height() * 1.5))
 
             pygame.draw.rect(self.draw_surface, (0, 0, 0), info_rect, 4)#border
-        pygame.display.flip()  # update display
 
     def draw_game_object_information(self, image, description, pos, segment_size, segment):
         """
@@ -872,7 +3497,7 @@ class App:
         :param segment:
         :return:
         """
-        label = self.get_resource("medium_font").render(" -> " + description, True, (255, 255, 255))
+        label = self.render_text("medium_font", " -> " + description, True, (255, 255, 255))
         size = [image.get_width() + label.get_width(), image.get_height() + label.get_height()]
         image_pos = [pos[i] + segment[i] * segment_size[i] + (segment_size[i] - size[i]) / 2
                      for i in range(len(pos))]
@@ -881,34 +3506,36 @@ class App:
         self.draw_surface.blit(label, [image_pos[0] + image.get_width(),
                                        image_pos[1] + (image.get_height() - label.get_height()) / 2])
 
-    def update(self, dt):
+    def update(self, dt, input_state=None):
         """
             Handle keyboard events and use update(dt) on GameObjectsGroup object.
         :param dt: float
+        :param input_state: InputState, if None then keyboard is read
         :return:None
         """
-        keys = pygame.key.get_pressed()
-        if keys[pygame.K_ESCAPE]:
+        if input_state is None:
+            input_state = InputState.from_keyboard()
+        if self.input_recorder is not None:
+            self.input_recorder.record(input_state)
+        if input_state.quit:
             pygame.event.post(pygame.event.Event(QUIT))
 
         if self.game_mode == App.GameMode.GAME_BEGIN:
-            if keys[pygame.K_SPACE]:
+            if input_state.confirm:
                 self.game_mode = App.GameMode.GAME_MAIN
 
         elif self.game_mode == App.GameMode.GAME_MAIN:
-            if keys[pygame.K_a] or keys[pygame.K_LEFT]:
-                self.player.go_left(dt)
-            if keys[pygame.K_d] or keys[pygame.K_RIGHT]:
-                self.player.go_right(dt)
-            if keys[pygame.K_w] or keys[pygame.K_UP]:
-                self.player.go_up(dt)
-            if keys[pygame.K_s] or keys[pygame.K_DOWN]:
-                self.player.go_down(dt)
-            if keys[pygame.K_SPACE] or keys[pygame.K_LSHIFT]:
-                self.player.attack()
+            self.player.handle_input(input_state, dt)
+            if self.profiler.active:
+                self.profiler.lap("input")
+            self.game_objects_group.spawn_engine.set_limits(self.governor.max_enemies, self.governor.max_bonuses)
             self.game_objects_group.update(dt)
+            if not self.player.is_alive():  # simulation only marks player dead
+                self.game_mode = App.GameMode.GAME_END
+            if self.snapshots is not None:
+                self.snapshots.push(WorldSnapshot.save(self.game_objects_group))
         elif self.game_mode == App.GameMode.GAME_END:
-            if keys[pygame.K_SPACE]:
+            if input_state.confirm:
                 self.init_game()
                 self.game_mode = App.GameMode.GAME_MAIN
 
@@ -917,14 +3544,210 @@ class App:
         Main application procedure
         :return: None
         """
+        step = 1.0 / self.tick_rate  # simulation runs with fixed dt
+        accumulator = 0.0
+        self.render_interpolation = True
+        self.game_objects_group.keep_previous_positions = True
+        profiler = self.profiler
+        governor = self.governor
         while not self.done:  # main loop
-            self.clock.tick(70)  # time system update
+            self.clock.tick(self.max_fps)  # time system update
+            frame_start = time.perf_counter()
+            if profiler.enabled:
+                profiler.begin_frame()
             self.events_loop(pygame.event.get())  # event handling
-            self.update(self.clock.get_time() / 1000.0)  #
+            if profiler.active:
+                profiler.lap("events")
+            accumulator += self.clock.get_time() / 1000.0
+            steps = 0
+            while accumulator >= step:
+                if steps == self.max_frame_steps:  # spiral of death, drop simulation time
+                    dropped = int(accumulator / step)
+                    self.dropped_steps += dropped
+                    accumulator -= dropped * step
+                    break
+                self.update(step)
+                accumulator -= step
+                steps += 1
+            self.interpolation = accumulator / step
             self.draw()
+            governor.add_frame(time.perf_counter() - frame_start)
+            if profiler.active:
+                profiler.end_frame()
+            if self.first_frame_time is None:
+                self.first_frame_time = time.perf_counter() - self.asset_loader.start_time
+
+    def simulate(self, steps, dt=1.0 / 70.0, input_source=None, draw=False):
+        """
+            Uncapped loop with fixed dt, as fast as CPU allows. It is used in headless mode.
+        :param steps: number of updates
+        :param dt: float, fixed time step
+        :param input_source: function(tick) -> InputState, if None then nothing is pressed
+        :param draw: call draw() after every update
+        :return: number of done updates
+        """
+        no_input = InputState()
+        profiler = self.profiler
+        if draw and not self.event_presenter.enabled:
+            self.set_presentation(True)
+        for tick in range(steps):
+            if profiler.enabled:
+                profiler.begin_frame()
+            self.events_loop(pygame.event.get())
+            if self.done:
+                profiler.active = False
+                return tick
+            if profiler.active:
+                profiler.lap("events")
+            self.update(dt, input_source(tick) if input_source is not None else no_input)
+            if draw:
+                self.draw()
+            if profiler.active:
+                profiler.end_frame()
+        return steps
+
+    def start_recording(self, dt):
+        """
+            Record input of following updates. App must be created with seed and started in this state.
+        :param dt: fixed time step of updates
+        """
+        self.input_recorder = InputRecorder(self.seed, dt, self.game_mode.value)
+        self.governor.enabled = False  # its limits depend on speed of machine, replay would diverge
+
+    def start_snapshots(self, size):
+        """
+            Save snapshot of the game after every update of GAME_MAIN.
+        :param size: bytes of memory for snapshots, the oldest ones are overwritten
+        """
+        self.snapshots = SnapshotRing(size)
+
+    def rewind(self, back):
+        """
+            Restore the game from back updates ago, the game continues from there.
+        :param back: number of updates, 0 - state after the last update
+        """
+        WorldSnapshot.restore(self.game_objects_group, self.snapshots.rewind(back))
+        self.game_mode = App.GameMode.GAME_MAIN if self.player.alive else App.GameMode.GAME_END
+
+    def save_snapshots(self, file_name):
+        if self.snapshots is not None and len(self.snapshots):
+            self.snapshots.save(file_name)
+            print(str(len(self.snapshots)) + " snapshots saved to " + file_name + ".")
+
+    def get_state_digest(self):
+        """
+        :return: md5 digest (16 bytes) of game state, equal digests after replay mean identical game
+        """
+        digest = hashlib.md5()
+        digest.update(struct.pack("<BddI", self.game_mode.value, self.player.gold, self.player.attack_level,
+                                  len(self.game_objects_group)))
+        for sprite in self.game_objects_group:
+            digest.update(type(sprite).__name__.encode())
+            digest.update(struct.pack("<4dd", sprite.pos[0], sprite.pos[1], sprite.velocity[0], sprite.velocity[1],
+                                      sprite.hp))
+        digest.update(repr(self.game_objects_group.random.getstate()).encode())
+        return digest.digest()
 
 
 if __name__ == "__main__":
-    app = App((800, 600))
-    app.run()
+    parser = argparse.ArgumentParser(description="ECTS game")
+    parser.add_argument("--headless", action="store_true", help="run simulation without display")
+    parser.add_argument("--steps", type=int, default=70 * 60, help="number of updates in headless mode")
+    parser.add_argument("--dt", type=float, default=1.0 / 70.0, help="fixed time step in headless mode")
+    parser.add_argument("--draw", action="store_true", help="call draw() in headless mode")
+    parser.add_argument("--full-redraw", action="store_true", help="redraw whole display every frame")
+    parser.add_argument("--tick-rate", type=int, default=70, help="simulation updates per second")
+    parser.add_argument("--seed", type=int, default=None, help="seed of random generators")
+    parser.add_argument("--vectorized", action="store_true", help="update enemies and bonuses with numpy arrays")
+    parser.add_argument("--pool-stats", action="store_true", help="print ObjectPool statistics at exit")
+    parser.add_argument("--bundle", default=os.path.join(ASSET_DIRECTORY, "assets.bundle"),
+                        help="prebuilt images, empty to load PNG files")
+    parser.add_argument("--build-bundle", action="store_true", help="build --bundle from PNG files and exit")
+    parser.add_argument("--no-governor", action="store_true", help="don't lower effects and limit spawns under load")
+    parser.add_argument("--profile", default="", help="measure phases of every frame and export them to CSV/JSON")
+    parser.add_argument("--asset-report", action="store_true", help="print loading time of every asset at exit")
+    parser.add_argument("--record", default="", help="save input of every update to this file")
+    parser.add_argument("--replay", default="", help="replay input recorded with --record")
+    parser.add_argument("--snapshot-memory", type=int, default=0,
+                        help="KB of memory for snapshots of the last updates, F5 rewinds one second, 0 - disabled")
+    parser.add_argument("--snapshot-file", default="snapshots.bin", help="snapshots are saved here when game crashes")
+    parser.add_argument("--inspect-snapshots", default="", help="print snapshots saved after crash and exit")
+    arguments = parser.parse_args()
+    if arguments.inspect_snapshots:
+        for index, snapshot in enumerate(SnapshotRing.load(arguments.inspect_snapshots)):
+            state = WorldSnapshot.load(snapshot)
+            player = state["player"]
+            print("%5d  time %8.3f  enemies %4d  bonuses %4d  attack waves %2d  hp %6.2f  gold %6d  pos %s" %
+                  (index, state["time"], len(state["enemies"]["object_id"]), len(state["bonuses"]["object_id"]),
+                   len(state["attack_waves"]["object_id"]), player["hp"], player["gold"],
+                   (round(player["pos_x"], 1), round(player["pos_y"], 1))))
+        sys.exit(0)
+    if arguments.build_bundle:
+        pygame.init()
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)  # pixel format of display is stored in bundle
+        images = AssetBundle.build(arguments.bundle, App.ASSETS)
+        print(str(images) + " images saved to " + arguments.bundle + ".")
+        sys.exit(0)
+    if arguments.replay:
+        replay = InputReplay(arguments.replay)
+        app = App((800, 600), headless=True, seed=replay.seed, bundle=arguments.bundle,
+                  vectorized_physics=arguments.vectorized)
+        app.game_mode = App.GameMode(replay.game_mode)
+        start = time.perf_counter()
+        done_steps = app.simulate(len(replay), replay.dt, input_source=replay.get_input, draw=arguments.draw)
+        elapsed = time.perf_counter() - start
+        print("Replayed " + str(done_steps) + " updates in " + str(round(elapsed, 2)) + " s.")
+        if app.get_state_digest() != replay.state_digest:
+            print("Replay diverged from recorded game.")
+            sys.exit(1)
+        print("Replay identical to recorded game.")
+        sys.exit(0)
+    seed = arguments.seed
+    if seed is None and arguments.record:  # recorded game must be reproducible
+        seed = random.getrandbits(32)
+    app = App((800, 600), headless=arguments.headless, dirty_rendering=not arguments.full_redraw,
+              tick_rate=arguments.tick_rate, seed=seed, bundle=arguments.bundle,
+              vectorized_physics=arguments.vectorized)
+    if arguments.profile:
+        app.profiler.export_file_name = arguments.profile
+        app.profiler.enabled = True
+    if arguments.no_governor:
+        app.governor.enabled = False
+    if arguments.snapshot_memory > 0:
+        app.start_snapshots(arguments.snapshot_memory * 1024)
+    if arguments.headless:
+        app.game_mode = App.GameMode.GAME_MAIN
+        if arguments.record:
+            app.start_recording(arguments.dt)
+        start = time.perf_counter()
+        try:
+            done_steps = app.simulate(arguments.steps, arguments.dt, draw=arguments.draw)
+        except Exception:
+            app.save_snapshots(arguments.snapshot_file)
+            raise
+        elapsed = time.perf_counter() - start
+        print("Simulated " + str(round(done_steps * arguments.dt, 1)) + " s in " + str(round(elapsed, 2)) +
+              " s (" + str(round(done_steps / elapsed, 1)) + " updates/s).")
+    else:
+        if arguments.record:
+            app.start_recording(1.0 / app.tick_rate)
+        try:
+            app.run()
+        except Exception:
+            app.save_snapshots(arguments.snapshot_file)
+            raise
+    if arguments.profile:
+        app.profiler.export(arguments.profile)
+        print("Profile of " + str(len(app.profiler.frames)) + " frames saved to " + arguments.profile + ".")
+    if arguments.asset_report:
+        app.asset_loader.report()
+        if app.first_frame_time is not None:
+            print("First frame after " + str(round(app.first_frame_time * 1000.0, 1)) + " ms.")
+    if arguments.pool_stats:
+        for name, stats in app.game_objects_group.pool_stats().items():
+            print("%-12s size %4d  in use %4d  high-water mark %4d  hit rate %5.1f%%" %
+                  (name, stats["size"], stats["in_use"], stats["high_water_mark"], stats["hit_rate"] * 100.0))
+    if arguments.record:
+        app.input_recorder.save(arguments.record, app.get_state_digest())
+        print("Input of " + str(len(app.input_recorder.ticks)) + " updates saved to " + arguments.record + ".")
     sys.exit(0)
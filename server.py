@@ -0,0 +1,428 @@
+"""
+    Simulation server with many concurrent game sessions in one process.
+    Every connection gets its own GameObjectsGroup with its own seed. All sessions are updated by one shared tick
+    loop, player input comes over local TCP or Unix socket and compact state frames are sent back:
+
+        python server.py --port 7777
+        python server.py --port 7777 --client 8 --seed 1
+
+    Protocol, little-endian:
+        client -> server  JOIN (magic, seed), then INPUT (type, InputState bits), ACK (type, 0) after every
+                          handled STATE or QUIT (type, 0)
+        server -> client  message header (type, payload size) and payload:
+                          WELCOME (session id, seed, dt), STATE (tick, game mode, hp, gold, attack level,
+                          number of entities and (type, x, y) of every entity), END (ticks, gold)
+
+    Slow client doesn't slow down other sessions and doesn't get old states: at most window STATE frames are
+    not acknowledged, the following ones are dropped until ACK comes, so client gets the newest state.
+    Buffers of sockets can't fill up with old frames.
+"""
+__author__ = 'Krystian'
+import io
+import os
+import sys
+import time
+import random
+import struct
+import asyncio
+import argparse
+import traceback
+import contextlib
+from collections import deque
+
+import main
+
+MAGIC = b"ECTSNET1"
+JOIN = struct.Struct("<8sQ")  # magic, seed
+CLIENT_MESSAGE = struct.Struct("<BB")  # type, InputState bits
+HEADER = struct.Struct("<BI")  # type, size of payload
+WELCOME = struct.Struct("<IQd")  # session id, seed, dt
+STATE = struct.Struct("<IBfIfH")  # tick, game mode, hp, gold, attack level, number of entities
+ENTITY = struct.Struct("<Bhh")  # type, rect x, rect y
+END = struct.Struct("<II")  # ticks, gold
+
+MESSAGE_INPUT = 1
+MESSAGE_QUIT = 2
+MESSAGE_ACK = 3
+MESSAGE_WELCOME = 16
+MESSAGE_STATE = 17
+MESSAGE_END = 18
+
+ENTITY_TYPES = dict((cls, index) for index, cls in enumerate(
+    (main.Player, main.EnemyWeak, main.EnemyFast, main.EnemyStrong, main.Gold, main.HpBonus, main.AttackBonus,
+     main.AttackWave)))
+ENEMY_TYPES = (1, 2, 3)
+BONUS_TYPES = (4, 5, 6)
+
+
+class Session():
+    """
+        One game played by one client. Session is App of its GameObjectsGroup - it has game_mode,
+        profiler and get_resource() used by game objects, resources are shared with headless App of server.
+    """
+    def __init__(self, server, session_id, seed, writer):
+        self.server = server
+        self.session_id = session_id
+        self.seed = seed
+        self.writer = writer
+        self.game_mode = main.App.GameMode.GAME_MAIN
+        self.profiler = server.app.profiler
+        self.group = main.GameObjectsGroup([0, 100, server.app.window.get_width(), server.app.window.get_height()],
+                                           self, server.vectorized_physics, seed=seed)
+        play_area_center = (self.group.play_area[2] / 2, self.group.play_area[3] / 2)
+        self.player = main.Player(self.get_resource("player"), self.get_resource("player_low_hp"),
+                                  self.get_resource("player_very_low_hp"), play_area_center, self.group)
+        self.group.add_player(self.player)
+        self.input_state = main.InputState()  # the last input from client, it is used until the next one comes
+        self.credits = server.window  # STATE frames which can be sent before the next ACK
+        self.tick = 0
+        self.closed = False
+        # metrics
+        self.tick_times = deque(maxlen=1000)
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.start_time = time.perf_counter()
+
+    def get_resource(self, name):
+        return self.server.app.get_resource(name)
+
+    def update(self, dt):
+        """
+            The same as App.update in GAME_MAIN with input from client.
+        """
+        start = time.perf_counter()
+        self.player.handle_input(self.input_state, dt)
+        self.group.update(dt)
+        if not self.player.is_alive():
+            self.game_mode = main.App.GameMode.GAME_END
+        self.tick += 1
+        if self.tick % self.server.state_interval == 0 or self.game_mode != main.App.GameMode.GAME_MAIN:
+            self.send_state()
+        self.tick_times.append(time.perf_counter() - start)
+
+    def encode_state(self):
+        entities = [(ENTITY_TYPES[type(sprite)], sprite.rect[0], sprite.rect[1])
+                    for sprite in self.group if type(sprite) in ENTITY_TYPES]
+        parts = [STATE.pack(self.tick, self.game_mode.value, self.player.hp, self.player.gold,
+                            self.player.attack_level, len(entities))]
+        parts.extend(ENTITY.pack(*entity) for entity in entities)
+        return b"".join(parts)
+
+    def send(self, message_type, payload):
+        self.writer.write(HEADER.pack(message_type, len(payload)) + payload)
+        self.sent_bytes += HEADER.size + len(payload)
+
+    def send_state(self):
+        """
+            Write state frame without waiting, frame is dropped when client hasn't acknowledged window frames
+            or its write buffer is full.
+        """
+        if self.credits == 0 or self.writer.transport.get_write_buffer_size() > self.server.max_buffer:
+            self.dropped_frames += 1
+            return
+        self.credits -= 1
+        self.send(MESSAGE_STATE, self.encode_state())
+        self.sent_frames += 1
+
+    def acknowledge(self):
+        """
+            Client has handled one STATE frame.
+        """
+        if self.credits < self.server.window:
+            self.credits += 1
+
+    def get_metrics(self):
+        """
+        :return: dict with number of ticks, tick cost and sent data
+        """
+        tick_times = sorted(self.tick_times)
+        return {
+            "session": self.session_id,
+            "ticks": self.tick,
+            "mean_tick_ms": sum(tick_times) / len(tick_times) * 1000.0 if tick_times else 0.0,
+            "p99_tick_ms": tick_times[int(0.99 * (len(tick_times) - 1))] * 1000.0 if tick_times else 0.0,
+            "max_tick_ms": tick_times[-1] * 1000.0 if tick_times else 0.0,
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+            "sent_kb": self.sent_bytes / 1024.0,
+            "entities": len(self.group),
+        }
+
+
+class GameServer():
+    """
+        Accepts connections and updates all sessions by one tick loop.
+    """
+    def __init__(self, tick_rate=70, max_sessions=256, max_buffer=64 * 1024, state_interval=1,
+                 vectorized_physics=False, max_frame_steps=5, window=2):
+        """
+        :param max_buffer: bytes waiting for slow client, more state frames are dropped
+        :param window: STATE frames sent to client before it acknowledges them, more frames are dropped
+        :param state_interval: state frame is sent every state_interval ticks
+        :param max_frame_steps: more ticks in a row are dropped when server is overloaded
+        """
+        self.dt = 1.0 / tick_rate
+        self.max_sessions = max_sessions
+        self.max_buffer = max_buffer
+        self.state_interval = state_interval
+        self.vectorized_physics = vectorized_physics
+        self.max_frame_steps = max_frame_steps
+        self.window = window
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):  # hide resource loading messages
+                self.app = main.App((800, 600), headless=True)
+        except SystemExit:
+            sys.stderr.write(output.getvalue())
+            raise
+        self.sessions = dict()  # session id -> Session
+        self.next_session_id = 1
+        self.dropped_ticks = 0
+        self.servers = []
+
+    async def start(self, host="127.0.0.1", port=7777, unix_path=""):
+        if unix_path:
+            self.servers.append(await asyncio.start_unix_server(self.handle_connection, unix_path))
+        else:
+            self.servers.append(await asyncio.start_server(self.handle_connection, host, port))
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        for session in list(self.sessions.values()):
+            self.close_session(session)
+
+    async def handle_connection(self, reader, writer):
+        session = None
+        try:
+            magic, seed = JOIN.unpack(await reader.readexactly(JOIN.size))
+            if magic != MAGIC or len(self.sessions) >= self.max_sessions:
+                writer.close()
+                return
+            if seed == 0:
+                seed = random.getrandbits(32)
+            session = Session(self, self.next_session_id, seed, writer)
+            self.next_session_id += 1
+            self.sessions[session.session_id] = session
+            session.send(MESSAGE_WELCOME, WELCOME.pack(session.session_id, seed, self.dt))
+            while not session.closed:
+                message_type, bits = CLIENT_MESSAGE.unpack(await reader.readexactly(CLIENT_MESSAGE.size))
+                if message_type == MESSAGE_INPUT:
+                    session.input_state = main.InputState.from_bits(bits)
+                elif message_type == MESSAGE_ACK:
+                    session.acknowledge()
+                else:  # MESSAGE_QUIT or unknown message
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if session is not None:
+                self.close_session(session)
+            else:
+                writer.close()
+
+    def close_session(self, session, failed=False):
+        """
+        :param failed: update of session raised exception, client gets no END
+        """
+        if session.closed:
+            return
+        session.closed = True
+        del self.sessions[session.session_id]
+        if not session.writer.is_closing():
+            if not failed:
+                session.send(MESSAGE_END, END.pack(session.tick, session.player.gold))
+            session.writer.close()
+        metrics = session.get_metrics()
+        print("Session %d closed after %d ticks: tick %.3f ms mean, %.3f ms p99, %d frames sent, %d dropped, "
+              "%.1f KB" % (session.session_id, metrics["ticks"], metrics["mean_tick_ms"], metrics["p99_tick_ms"],
+                           metrics["sent_frames"], metrics["dropped_frames"], metrics["sent_kb"]))
+
+    def tick(self):
+        for session in list(self.sessions.values()):
+            try:
+                session.update(self.dt)
+            except Exception:  # one broken session must not stop the others
+                print("Session " + str(session.session_id) + " failed at tick " + str(session.tick) + ":")
+                traceback.print_exc()
+                self.close_session(session, failed=True)
+                continue
+            if session.game_mode != main.App.GameMode.GAME_MAIN:  # player is dead
+                self.close_session(session)
+
+    async def run(self, stats_interval=0.0, duration=0.0):
+        """
+            Tick loop with fixed dt shared by all sessions.
+        :param stats_interval: seconds between printed metrics, 0 - never
+        :param duration: stop after this many seconds, 0 - never
+        """
+        loop = asyncio.get_running_loop()
+        start = next_tick = loop.time()
+        next_stats = start + stats_interval
+        while not duration or loop.time() - start < duration:
+            steps = 0
+            while loop.time() >= next_tick:
+                if steps == self.max_frame_steps:  # overloaded, drop ticks instead of running behind forever
+                    dropped = int((loop.time() - next_tick) / self.dt) + 1
+                    self.dropped_ticks += dropped
+                    next_tick += dropped * self.dt
+                    break
+                self.tick()
+                next_tick += self.dt
+                steps += 1
+            if stats_interval and loop.time() >= next_stats:
+                next_stats += stats_interval
+                self.print_stats()
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    def print_stats(self):
+        sessions = [session.get_metrics() for session in self.sessions.values()]
+        print("%d sessions, %d dropped ticks" % (len(sessions), self.dropped_ticks))
+        for metrics in sessions:
+            print("  session %4d  ticks %7d  tick %.3f ms mean  %.3f ms p99  entities %4d  frames %d sent %d dropped"
+                  % (metrics["session"], metrics["ticks"], metrics["mean_tick_ms"], metrics["p99_tick_ms"],
+                     metrics["entities"], metrics["sent_frames"], metrics["dropped_frames"]))
+
+
+class GameClient():
+    """
+        Thin headless client. It reads state frames and sends input of a simple policy: go to the nearest bonus
+        and attack when enemy is close.
+    """
+    def __init__(self, seed=0, max_ticks=0, read_delay=0.0, attack_distance=80.0):
+        """
+        :param max_ticks: quit after this many ticks, 0 - play until player dies
+        :param read_delay: seconds of sleep after every frame, it simulates slow client
+        """
+        self.seed = seed
+        self.max_ticks = max_ticks
+        self.read_delay = read_delay
+        self.attack_distance = attack_distance
+        self.session_id = None
+        self.tick = 0
+        self.gold = 0
+        self.frames = 0
+        self.max_lag = 0.0  # seconds between the newest tick of server and tick of received state
+        self.ended = False
+
+    def decide(self, player, entities):
+        """
+        :param player: (x, y) of player
+        :param entities: list of (type, x, y)
+        :return: InputState
+        """
+        enemy_distance = min([(x - player[0]) ** 2 + (y - player[1]) ** 2
+                              for entity_type, x, y in entities if entity_type in ENEMY_TYPES] or [float("inf")])
+        bonuses = [((x - player[0]) ** 2 + (y - player[1]) ** 2, x, y)
+                   for entity_type, x, y in entities if entity_type in BONUS_TYPES]
+        attack = enemy_distance < self.attack_distance ** 2
+        if not bonuses:
+            return main.InputState(attack=attack)
+        distance, x, y = min(bonuses)
+        return main.InputState(left=x < player[0] - 4, right=x > player[0] + 4, up=y < player[1] - 4,
+                               down=y > player[1] + 4, attack=attack)
+
+    async def play(self, host="127.0.0.1", port=7777, unix_path=""):
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        writer.write(JOIN.pack(MAGIC, self.seed))
+        bits = None
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message_type, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(size)
+                if message_type == MESSAGE_WELCOME:
+                    self.session_id, self.seed, dt = WELCOME.unpack(payload)
+                    start = loop.time()
+                elif message_type == MESSAGE_STATE:
+                    self.tick, game_mode, hp, self.gold, attack_level, count = STATE.unpack_from(payload)
+                    entities = list(ENTITY.iter_unpack(payload[STATE.size:]))
+                    self.frames += 1
+                    self.max_lag = max(self.max_lag, loop.time() - start - self.tick * dt)
+                    player = [(x, y) for entity_type, x, y in entities if entity_type == 0][0]
+                    new_bits = self.decide(player, entities).to_bits()
+                    if new_bits != bits:  # input is sent only when it changes
+                        bits = new_bits
+                        writer.write(CLIENT_MESSAGE.pack(MESSAGE_INPUT, bits))
+                    if self.max_ticks and self.tick >= self.max_ticks:
+                        writer.write(CLIENT_MESSAGE.pack(MESSAGE_QUIT, 0))
+                    if self.read_delay:
+                        await asyncio.sleep(self.read_delay)
+                    writer.write(CLIENT_MESSAGE.pack(MESSAGE_ACK, 0))
+                elif message_type == MESSAGE_END:
+                    self.tick, self.gold = END.unpack(payload)
+                    self.ended = True
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+        return self
+
+
+async def run_clients(options):
+    seeds = random.Random(options.seed)
+    clients = [GameClient(seeds.getrandbits(32) if options.seed else 0, options.max_ticks,
+                          options.read_delay if index < options.slow_clients else 0.0)
+               for index in range(options.client)]
+    start = time.perf_counter()
+    await asyncio.gather(*[client.play(options.host, options.port, options.unix) for client in clients])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        print("Session %s (seed %d): %d ticks, %d frames received, max lag %.0f ms, %d gold%s" %
+              (client.session_id, client.seed, client.tick, client.frames, client.max_lag * 1000.0, client.gold,
+               "" if client.ended else ", disconnected"))
+    print(str(len(clients)) + " clients finished in " + str(round(elapsed, 2)) + " s.")
+
+
+async def run_server(options):
+    server = GameServer(options.tick_rate, options.max_sessions, options.max_buffer, options.state_interval,
+                        options.vectorized, window=options.window)
+    await server.start(options.host, options.port, options.unix)
+    print("Listening on " + (options.unix or options.host + ":" + str(options.port)) + ".")
+    try:
+        await server.run(options.stats_interval, options.duration)
+    finally:
+        server.close()
+
+
+def main_server():
+    parser = argparse.ArgumentParser(description="Server with many ECTS game sessions and its test client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", default="", help="path of Unix socket used instead of TCP")
+    parser.add_argument("--tick-rate", type=int, default=70, help="updates of every session per second")
+    parser.add_argument("--max-sessions", type=int, default=256)
+    parser.add_argument("--max-buffer", type=int, default=64 * 1024,
+                        help="bytes waiting for slow client, more state frames are dropped")
+    parser.add_argument("--state-interval", type=int, default=1, help="send state every N ticks")
+    parser.add_argument("--window", type=int, default=2,
+                        help="state frames sent before client acknowledges them, more frames are dropped")
+    parser.add_argument("--vectorized", action="store_true", help="update enemies and bonuses with numpy arrays")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between printed metrics")
+    parser.add_argument("--duration", type=float, default=0.0, help="stop server after this many seconds")
+    parser.add_argument("--client", type=int, default=0, help="run this many test clients instead of server")
+    parser.add_argument("--seed", type=int, default=0, help="seed of session seeds of clients, 0 - random")
+    parser.add_argument("--max-ticks", type=int, default=0, help="client quits after this many ticks")
+    parser.add_argument("--slow-clients", type=int, default=0, help="number of clients which read slowly")
+    parser.add_argument("--read-delay", type=float, default=0.05, help="sleep of slow client after every frame")
+    options = parser.parse_args()
+    try:
+        if options.client:
+            asyncio.run(run_clients(options))
+        else:
+            asyncio.run(run_server(options))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if options.unix and not options.client and os.path.exists(options.unix):
+            os.remove(options.unix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_server())
@@ -0,0 +1,64 @@
+"""
+    Fixtures of tests: headless App and played games. Tests run from any directory with plain pytest:
+
+        python -m pytest -q tests
+"""
+import os
+import io
+import sys
+import random
+import contextlib
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"  # must be set before pygame.init()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import main
+
+DT = 1.0 / 70.0
+
+
+@pytest.fixture
+def make_app():
+    """
+        Function(seed=1, vectorized=False) -> headless App in GAME_MAIN with hidden resource loading messages.
+    """
+    def make(seed=1, vectorized=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = main.App((800, 600), headless=True, seed=seed, vectorized_physics=vectorized)
+        app.governor.enabled = False  # its limits depend on speed of machine
+        app.game_mode = main.App.GameMode.GAME_MAIN
+        return app
+    return make
+
+
+@pytest.fixture
+def inputs():
+    """
+        Random inputs of 2000 updates, the same in every test.
+    """
+    rng = random.Random(3)
+    return [main.InputState(*[rng.random() < 0.4 for direction in range(4)], attack=rng.random() < 0.5)
+            for tick in range(2000)]
+
+
+@pytest.fixture
+def busy(monkeypatch):
+    """
+        Objects are spawned often and player never dies, so a short game has hundreds of objects.
+    """
+    spawn_engine = main.GameObjectsGroup.SpawnEngine
+    monkeypatch.setattr(spawn_engine, "enemy_spawn_interval", (0.02, 0.05))
+    monkeypatch.setattr(spawn_engine, "gold_spawn_interval", (0.02, 0.05))
+    monkeypatch.setattr(spawn_engine, "hp_spawn_interval", (0.5, 1.0))
+    monkeypatch.setattr(spawn_engine, "attack_bonus_spawn_interval", (0.3, 0.5))
+    monkeypatch.setattr(main.Player, "min_hp", -10 ** 9)
+    monkeypatch.setattr(main.Player, "new_attack_wave_delay_duration", 0.1)
+
+
+def play(app, inputs, start, end):
+    """
+        update() of app with inputs[start:end].
+    """
+    for tick in range(start, end):
+        app.update(DT, inputs[tick])
@@ -0,0 +1,66 @@
+import shutil
+
+import pygame
+import main
+
+
+def get_pixels(surface):
+    return surface.get_size(), pygame.image.tobytes(surface, "RGBA")
+
+
+def get_png(asset):
+    return pygame.image.load(asset.get_path()).convert_alpha()
+
+
+def copy_assets(directory, monkeypatch):
+    for asset in main.App.ASSETS:
+        shutil.copy(asset.get_path(), str(directory))
+    monkeypatch.setattr(main, "ASSET_DIRECTORY", str(directory))
+    return dict((asset.name, asset) for asset in main.App.ASSETS)
+
+
+def test_bundle_has_pixels_of_png_files(make_app, tmp_path, monkeypatch):
+    app = make_app()  # display is initialized
+    assets = copy_assets(tmp_path, monkeypatch)
+    file_name = str(tmp_path / "assets.bundle")
+    assert main.AssetBundle.build(file_name, main.App.ASSETS) == len([asset for asset in assets.values()
+                                                                      if asset.is_image()])
+    bundle = main.AssetBundle(file_name)
+    for asset in assets.values():
+        if asset.is_image():
+            assert get_pixels(bundle.get_surface(asset)) == get_pixels(get_png(asset))
+    loader = main.AssetLoader(app, main.App.ASSETS, bundle=file_name)
+    loader.start(background=False)
+    loader.get("gold")
+    assert loader.timings["gold"]["source"] == "bundle"
+
+
+def test_changed_png_is_loaded_instead_of_bundle(make_app, tmp_path, monkeypatch, capsys):
+    app = make_app()
+    assets = copy_assets(tmp_path, monkeypatch)
+    file_name = str(tmp_path / "assets.bundle")
+    main.AssetBundle.build(file_name, main.App.ASSETS)
+    shutil.copy(assets["hp"].get_path(), assets["gold"].get_path())  # gold.png changed after the build
+    bundle = main.AssetBundle(file_name)
+    assert bundle.get_surface(assets["gold"]) is None
+    assert "stale" in capsys.readouterr().out
+    loader = main.AssetLoader(app, main.App.ASSETS, bundle=file_name)
+    loader.start(background=False)
+    assert get_pixels(loader.get("gold")) == get_pixels(get_png(assets["hp"]))
+    assert loader.timings["gold"]["source"] == "lazy"
+    loader.get("hp")
+    assert loader.timings["hp"]["source"] == "bundle"
+
+
+def test_damaged_bundle_isnt_used(make_app, tmp_path, monkeypatch, capsys):
+    app = make_app()
+    copy_assets(tmp_path, monkeypatch)
+    file_name = str(tmp_path / "assets.bundle")
+    with open(file_name, "wb") as file:
+        file.write(b"\xff" * 4096)
+    loader = main.AssetLoader(app, main.App.ASSETS, bundle=file_name)
+    loader.start(background=False)
+    assert loader.bundle is None
+    assert "not used" in capsys.readouterr().out
+    loader.get("gold")
+    assert loader.timings["gold"]["source"] == "lazy"
@@ -0,0 +1,41 @@
+import pygame
+
+import main
+from conftest import DT
+
+
+def get_pixels(app):
+    return pygame.image.tobytes(app.draw_surface, "RGB")
+
+
+def test_dirty_frames_are_the_same_as_full_redraw(make_app, inputs, busy):
+    app = make_app()
+    assert app.dirty_rect_renderer is not None
+    app.set_presentation(True)  # pop-up labels and attack wave outlines are drawn too
+    draw_full = app.draw_full
+    full_frames = []
+    app.draw_full = lambda: full_frames.append(draw_full())  # called by DirtyRectRenderer
+    app.draw()
+    for tick in range(400):
+        app.update(DT, inputs[tick])
+        app.draw()
+        frame = get_pixels(app)
+        draw_full()  # exact frame, the next dirty frame is drawn over it like over its own one
+        assert get_pixels(app) == frame, "frame %d" % tick
+    assert app.game_mode == main.App.GameMode.GAME_MAIN
+    assert len(full_frames) < 400  # the others were dirty frames
+
+
+def test_removed_sprites_are_erased(make_app):
+    app = make_app()
+    app.draw()
+    group = app.game_objects_group
+    gold = main.Gold(app.get_resource("gold"), (100.0, 500.0), 10, group.random)
+    group.add(gold)
+    app.draw()
+    area = gold.rect.copy()
+    group.remove(gold)
+    app.draw()
+    drawn = app.draw_surface.subsurface(area)
+    background = app.static_layer.subsurface(area)
+    assert pygame.image.tobytes(drawn, "RGB") == pygame.image.tobytes(background, "RGB")
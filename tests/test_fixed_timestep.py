@@ -0,0 +1,59 @@
+import main
+
+
+class FakeClock():
+    """
+        pygame.time.Clock with given frame times, App.run() stops after the last frame.
+    """
+    def __init__(self, app, frame_times):
+        self.app = app
+        self.frame_times = frame_times
+        self.interpolations = []
+        app.draw = self.draw
+
+    def tick(self, framerate=0):
+        pass
+
+    def get_time(self):
+        return self.frame_times[len(self.interpolations)]
+
+    def get_fps(self):
+        return 0.0
+
+    def draw(self):
+        self.interpolations.append(self.app.interpolation)
+        self.app.done = len(self.interpolations) == len(self.frame_times)
+
+
+def run(app, frame_times):
+    """
+    :return: (number of updates, interpolation of every frame)
+    """
+    updates = []
+    update = app.update
+    app.update = lambda dt: updates.append(update(dt, main.InputState()) or dt)
+    app.clock = FakeClock(app, frame_times)
+    app.run()
+    return updates, app.clock.interpolations
+
+
+def test_updates_dont_depend_on_frame_rate(make_app):
+    step = 1.0 / 70
+    for frame_times in ([16] * 250, [7, 33, 5, 50, 1, 25] * 25 + [0] * 100, [40] * 100):
+        app = make_app()
+        updates, interpolations = run(app, frame_times)
+        assert set(updates) == {step}
+        assert len(updates) == int(sum(frame_times) / 1000.0 / step + 1e-9)
+        assert all(0.0 <= interpolation < 1.0 for interpolation in interpolations)
+        assert len(updates) > 200
+        reference = make_app()  # the same state after the same number of updates
+        for tick in range(len(updates)):
+            reference.update(step, main.InputState())
+        assert reference.get_state_digest() == app.get_state_digest()
+
+
+def test_slow_frames_drop_simulation_time(make_app):
+    app = make_app()
+    updates, interpolations = run(app, [1000, 1000, 16])
+    assert len(updates) == 2 * app.max_frame_steps + 1
+    assert app.dropped_steps == 2 * (70 - app.max_frame_steps)
@@ -0,0 +1,37 @@
+import main
+from conftest import play
+
+
+def check_indexes(group):
+    kinds = ((group.enemies, main.Enemy), (group.bonuses, main.Bonus), (group.attack_waves, main.AttackWave),
+             (group.players, main.Player))
+    for index, cls in kinds:
+        assert list(index) == [sprite for sprite in group if isinstance(sprite, cls)]
+    assert sum(len(index) for index, cls in kinds) + len(group.others) == len(group)
+    assert set(group.enemies_hash.object_cells) == set(group.enemies)
+    assert set(group.bonuses_hash.object_cells) == set(group.bonuses)
+
+
+def test_indexes_follow_added_and_removed_objects(make_app, inputs, busy):
+    app = make_app()
+    group = app.game_objects_group
+    attack_waves = 0
+    for start in range(0, 600, 10):
+        play(app, inputs, start, start + 10)
+        check_indexes(group)
+        attack_waves += len(group.attack_waves)
+    assert group.enemies and group.bonuses and attack_waves
+    removed = list(group.enemies)[::2] + list(group.bonuses)[::3]
+    group.remove(*removed)
+    check_indexes(group)
+    assert not set(removed).intersection(group.enemies) and not set(removed).intersection(group.bonuses)
+
+
+def test_unknown_sprite_goes_to_others(make_app):
+    app = make_app()
+    group = app.game_objects_group
+    sprite = main.GameObject(app.get_resource("gold"), (10.0, 200.0))
+    group.add(sprite)
+    assert sprite in group.others and sprite not in group.bonuses
+    group.remove(sprite)
+    assert not group.others
@@ -0,0 +1,50 @@
+import main
+from conftest import play
+
+
+def test_released_object_is_reused(make_app):
+    app = make_app()
+    pool = main.ObjectPool(main.Gold, max_size=1)
+    group = app.game_objects_group
+    gold = pool.get(app.get_resource("gold"), (10.0, 200.0), 10, group.random)
+    other = pool.get(app.get_resource("gold"), (20.0, 200.0), 10, group.random)
+    pool.release(gold)
+    pool.release(other)  # above max_size, left to garbage collector
+    reused = pool.get(app.get_resource("gold"), (30.0, 300.0), 20, group.random)
+    assert reused is gold and reused.pos == [30.0, 300.0] and reused.velocity == [0.0, 0.0] and reused.alive
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["high_water_mark"], stats["hits"], stats["misses"]) == \
+        (0, 1, 2, 1, 2)
+
+
+def test_pooled_game_is_the_same_as_game_without_pools(make_app, inputs, busy):
+    pooled = make_app(seed=5)
+    unpooled = make_app(seed=5)
+    for pool in unpooled.game_objects_group.pools.values():
+        pool.max_size = 0
+    for start in range(0, 1200, 100):
+        play(pooled, inputs, start, start + 100)
+        play(unpooled, inputs, start, start + 100)
+        assert pooled.get_state_digest() == unpooled.get_state_digest()
+        assert main.WorldSnapshot.save(pooled.game_objects_group) == \
+            main.WorldSnapshot.save(unpooled.game_objects_group)
+    stats = pooled.game_objects_group.pool_stats()
+    assert stats["EnemyWeak"]["hits"] and stats["Gold"]["hits"]
+    assert not any(stats["hits"] for stats in unpooled.game_objects_group.pool_stats().values())
+
+
+def test_released_enemy_can_be_hit_again(make_app, inputs, busy):
+    app = make_app()
+    group = app.game_objects_group
+    attacked = []
+    for tick in range(1000):  # until an attack wave hits enemies
+        play(app, inputs, tick, tick + 1)
+        attacked = [enemy for attack_wave in group.attack_waves for enemy in attack_wave.attacked_by_self]
+        if attacked:
+            break
+    assert attacked
+    for enemy in attacked:
+        if group.has(enemy):
+            group.remove(enemy)
+            group.release_object(enemy)
+    assert not any(attack_wave.attacked_by_self for attack_wave in group.attack_waves)
@@ -0,0 +1,38 @@
+import main
+from conftest import DT
+
+
+def record(app, inputs, file_name):
+    app.start_recording(DT)
+    app.simulate(len(inputs), DT, input_source=inputs.__getitem__)
+    app.input_recorder.save(file_name, app.get_state_digest())
+
+
+def test_replay_has_the_same_digest(make_app, inputs, busy, tmp_path):
+    file_name = str(tmp_path / "game.rec")
+    app = make_app(seed=11)
+    record(app, inputs[:1500], file_name)
+    replay = main.InputReplay(file_name)
+    assert (replay.seed, replay.dt, len(replay)) == (11, DT, 1500)
+    for vectorized in (False, True) if main.numpy is not None else (False, ):
+        replayed = make_app(seed=replay.seed, vectorized=vectorized)
+        replayed.game_mode = main.App.GameMode(replay.game_mode)
+        assert replayed.simulate(len(replay), replay.dt, input_source=replay.get_input) == len(replay)
+        assert replayed.get_state_digest() == replay.state_digest
+
+
+def test_other_seed_or_input_changes_digest(make_app, inputs, busy, tmp_path):
+    file_name = str(tmp_path / "game.rec")
+    record(make_app(seed=11), inputs[:500], file_name)
+    digest = main.InputReplay(file_name).state_digest
+    other_seed = make_app(seed=12)
+    other_seed.simulate(500, DT, input_source=inputs.__getitem__)
+    other_input = make_app(seed=11)
+    other_input.simulate(500, DT, input_source=inputs[1:].__getitem__)
+    assert other_seed.get_state_digest() != digest
+    assert other_input.get_state_digest() != digest
+
+
+def test_input_state_bits_round_trip():
+    for bits in range(1 << len(main.InputState.FLAGS)):
+        assert main.InputState.from_bits(bits).to_bits() == bits
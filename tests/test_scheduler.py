@@ -0,0 +1,53 @@
+import main
+from conftest import DT
+
+
+def test_events_are_called_in_order_of_time_and_scheduling():
+    scheduler = main.Scheduler()
+    called = []
+    for name, delay in (("c", 0.3), ("a", 0.1), ("b", 0.1), ("d", 1.0)):
+        scheduler.schedule(delay, called.append, name)
+    assert scheduler.advance(0.05) == 0
+    assert scheduler.advance(0.25) == 3
+    assert called == ["a", "b", "c"]
+    assert scheduler.time == 0.3
+    assert scheduler.advance(1.0) == 1 and called[-1] == "d"
+
+
+def test_cancelled_event_isnt_called():
+    scheduler = main.Scheduler()
+    called = []
+    event = scheduler.schedule(0.1, called.append, "cancelled")
+    scheduler.schedule(0.2, called.append, "kept")
+    scheduler.cancel(event)
+    assert scheduler.advance(1.0) == 1
+    assert called == ["kept"]
+    assert not len(scheduler)
+
+
+def test_events_scheduled_by_callback_count_from_time_of_event():
+    scheduler = main.Scheduler()
+    times = []
+
+    def repeat():
+        times.append(scheduler.time)
+        if len(times) < 5:
+            scheduler.schedule(0.25, repeat)
+    scheduler.schedule(0.25, repeat)
+    scheduler.advance(10.0)  # one big step calls every repeated event
+    assert times == [0.25, 0.5, 0.75, 1.0, 1.25]
+    assert scheduler.get_remaining_time(scheduler.schedule(1.0, repeat)) == 1.0
+
+
+def test_bonus_expires_after_its_time_to_live(make_app):
+    app = make_app()
+    group = app.game_objects_group
+    gold = group.new_object(main.Gold, app.get_resource("gold"), (100.0, 500.0), 10, group.random)
+    group.add(gold)
+    assert group.scheduler.get_remaining_time(gold.expiry_event) == gold.time_to_live
+    group.scheduler.advance(gold.time_to_live - DT)
+    assert group.has(gold)
+    group.scheduler.advance(2 * DT)
+    assert not group.has(gold)
+    assert gold not in group.bonuses and gold not in group.bonuses_hash.object_cells
+    assert gold in group.pools[main.Gold].free
@@ -0,0 +1,92 @@
+import asyncio
+
+import server
+
+
+class FakeTransport():
+    def __init__(self):
+        self.buffer_size = 0
+
+    def get_write_buffer_size(self):
+        return self.buffer_size
+
+
+class FakeWriter():
+    """
+        asyncio.StreamWriter of client which never reads, written messages are kept.
+    """
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.messages = []
+        self.closed = False
+
+    def write(self, data):
+        self.messages.append(server.HEADER.unpack_from(data)[0])
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def test_states_are_dropped_until_client_acknowledges():
+    game_server = server.GameServer(window=2)
+    session = server.Session(game_server, 1, 5, FakeWriter())
+    for tick in range(10):
+        session.update(game_server.dt)
+    assert (session.sent_frames, session.dropped_frames) == (2, 8)
+    session.acknowledge()
+    session.update(game_server.dt)
+    session.update(game_server.dt)
+    assert (session.sent_frames, session.dropped_frames) == (3, 9)
+    for ack in range(5):  # more ACKs than sent frames don't raise the window
+        session.acknowledge()
+    assert session.credits == game_server.window
+    assert session.writer.messages == [server.MESSAGE_STATE] * 3
+
+
+def test_states_are_dropped_when_write_buffer_is_full():
+    game_server = server.GameServer(window=100, max_buffer=1024)
+    session = server.Session(game_server, 1, 5, FakeWriter())
+    session.update(game_server.dt)
+    session.writer.transport.buffer_size = 4096
+    session.update(game_server.dt)
+    session.writer.transport.buffer_size = 0
+    session.update(game_server.dt)
+    assert (session.sent_frames, session.dropped_frames) == (2, 1)
+
+
+def test_client_gets_window_states_and_more_after_ack():
+    game_server = server.GameServer(window=2)
+
+    async def play():
+        await game_server.start(port=0)
+        port = game_server.servers[0].sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(server.JOIN.pack(server.MAGIC, 9))
+        await writer.drain()
+
+        async def read_message():
+            message_type, size = server.HEADER.unpack(await reader.readexactly(server.HEADER.size))
+            return message_type, await reader.readexactly(size)
+        message_type, payload = await read_message()
+        assert message_type == server.MESSAGE_WELCOME
+        session_id, seed, dt = server.WELCOME.unpack(payload)
+        assert seed == 9
+        session = game_server.sessions[session_id]
+        for tick in range(5):
+            game_server.tick()
+        states = [server.STATE.unpack_from((await read_message())[1])[0] for frame in range(2)]
+        assert states == [1, 2] and session.dropped_frames == 3
+        writer.write(server.CLIENT_MESSAGE.pack(server.MESSAGE_ACK, 0))
+        await writer.drain()
+        while session.credits == 0:
+            await asyncio.sleep(0.001)
+        game_server.tick()
+        assert server.STATE.unpack_from((await read_message())[1])[0] == 6  # the newest state, not the old ones
+        writer.write(server.CLIENT_MESSAGE.pack(server.MESSAGE_QUIT, 0))
+        assert (await read_message())[0] == server.MESSAGE_END
+        writer.close()
+        game_server.close()
+    asyncio.run(asyncio.wait_for(play(), 10.0))
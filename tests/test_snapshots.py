@@ -0,0 +1,71 @@
+import pytest
+
+import main
+from conftest import play
+
+
+def save(app):
+    return main.WorldSnapshot.save(app.game_objects_group)
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_restored_game_continues_like_the_original(make_app, inputs, busy, vectorized):
+    if vectorized and main.numpy is None:
+        pytest.skip("VectorizedPhysics needs numpy")
+    app = make_app(seed=7, vectorized=vectorized)
+    snapshots = dict()
+    for start, end in ((0, 500), (500, 880), (880, 900)):
+        play(app, inputs, start, end)
+        snapshots[end] = save(app)
+    digest = app.get_state_digest()
+    assert len(app.game_objects_group.enemies) > 50
+    for tick in (500, 880):  # long and short rewind, objects are reused, removed and created
+        main.WorldSnapshot.restore(app.game_objects_group, snapshots[tick])
+        assert save(app) == snapshots[tick]
+        play(app, inputs, tick, 900)
+        assert app.get_state_digest() == digest and save(app) == snapshots[900]
+    other = make_app(seed=5, vectorized=not vectorized)  # other game and other physics
+    main.WorldSnapshot.restore(other.game_objects_group, snapshots[500])
+    play(other, inputs, 500, 900)
+    assert other.get_state_digest() == digest
+
+
+def test_ring_returns_every_pushed_snapshot(make_app, inputs, busy, tmp_path):
+    app = make_app()
+    app.start_snapshots(1024 * 1024)
+    snapshots = []
+    for tick in range(300):
+        play(app, inputs, tick, tick + 1)
+        snapshots.append(save(app))
+    ring = app.snapshots
+    assert 0 < len(ring) < 300  # the oldest ones are overwritten
+    assert [ring.get(back) for back in range(len(ring) - 1, -1, -1)] == snapshots[-len(ring):]
+    file_name = str(tmp_path / "snapshots.bin")
+    ring.save(file_name)
+    assert main.SnapshotRing.load(file_name) == snapshots[-len(ring):]
+
+
+def test_rewind_drops_newer_snapshots(make_app, inputs, busy):
+    app = make_app()
+    app.start_snapshots(4 * 1024 * 1024)
+    play(app, inputs, 0, 200)
+    expected = app.snapshots.get(app.tick_rate)
+    count = len(app.snapshots)
+    app.rewind(app.tick_rate)
+    assert save(app) == expected
+    assert len(app.snapshots) == count - app.tick_rate and app.snapshots.get() == expected
+    play(app, inputs, 200, 230)
+    assert app.snapshots.get(30) == expected and app.snapshots.get() == save(app)
+
+
+def test_delta_without_numpy(make_app, inputs, busy, monkeypatch):
+    app = make_app()
+    play(app, inputs, 0, 300)
+    previous = save(app)
+    play(app, inputs, 300, 301)
+    snapshot = save(app)
+    delta = main.WorldSnapshot.delta(previous, snapshot)
+    assert main.WorldSnapshot.apply_delta(previous, delta) == snapshot
+    monkeypatch.setattr(main, "numpy", None)
+    assert main.WorldSnapshot.delta(previous, snapshot) == delta
+    assert main.WorldSnapshot.apply_delta(previous, delta) == snapshot
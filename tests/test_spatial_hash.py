@@ -0,0 +1,47 @@
+import random
+
+import pygame
+import main
+from conftest import DT, play
+
+
+def brute_force(objects, probe, collide):
+    return [object for object in sorted(objects, key=main.get_object_id) if collide(probe, object)]
+
+
+def test_query_finds_the_same_collisions_as_brute_force(make_app, inputs, busy):
+    app = make_app()
+    play(app, inputs, 0, 300)
+    group = app.game_objects_group
+    assert len(group.enemies) > 50 and len(group.bonuses) > 50
+    rng = random.Random(0)
+    for probe_index in range(200):
+        group.player.rect.center = (rng.randrange(-50, 850), rng.randrange(50, 650))
+        for spatial_hash, objects, collide in (
+                (group.enemies_hash, group.enemies, pygame.sprite.collide_rect),
+                (group.bonuses_hash, group.bonuses, main.collide_circle)):
+            found = [object for object in spatial_hash.query(main.collision_bounds(group.player))
+                     if collide(group.player, object)]
+            assert found == brute_force(objects, group.player, collide)
+    for attack_wave in group.attack_waves:
+        found = [enemy for enemy in group.enemies_hash.query(main.collision_bounds(attack_wave))
+                 if main.collide_circle(attack_wave, enemy)]
+        assert found == brute_force(group.enemies, attack_wave, main.collide_circle)
+
+
+def test_moved_objects_are_in_cells_of_their_centers(make_app, inputs, busy):
+    app = make_app()
+    play(app, inputs, 0, 100)
+    group = app.game_objects_group
+    rng = random.Random(1)
+    for moved_count in (1, 10, len(group.enemies)):  # single updates and rebuild
+        moved = rng.sample(list(group.enemies), moved_count)
+        for enemy in moved:
+            enemy.rect.center = (rng.randrange(0, 800), rng.randrange(100, 600))
+        group.enemies_hash.update_objects(moved)
+        spatial_hash = group.enemies_hash
+        assert spatial_hash.object_cells == dict(zip(group.enemies, spatial_hash.get_cell_keys(list(group.enemies))))
+        assert sorted(map(main.get_object_id, [object for cell in spatial_hash.cells.values() for object in cell])) \
+            == sorted(map(main.get_object_id, group.enemies))
+        assert all(spatial_hash.cells.values())
+        group.update(DT)
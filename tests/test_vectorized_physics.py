@@ -0,0 +1,29 @@
+import pytest
+
+import main
+from conftest import play
+
+pytestmark = pytest.mark.skipif(main.numpy is None, reason="VectorizedPhysics needs numpy")
+
+
+def test_vectorized_game_is_the_same_as_scalar_one(make_app, inputs, busy):
+    scalar = make_app(seed=7)
+    vectorized = make_app(seed=7, vectorized=True)
+    assert vectorized.game_objects_group.physics is not None
+    for start in range(0, 900, 50):
+        play(scalar, inputs, start, start + 50)
+        play(vectorized, inputs, start, start + 50)
+        assert vectorized.get_state_digest() == scalar.get_state_digest()
+        assert main.WorldSnapshot.save(vectorized.game_objects_group) == \
+            main.WorldSnapshot.save(scalar.game_objects_group)
+    assert len(scalar.game_objects_group.enemies) > 50
+
+
+def test_vectorized_game_continues_scalar_snapshot(make_app, inputs, busy):
+    scalar = make_app(seed=7)
+    vectorized = make_app(seed=8, vectorized=True)
+    play(scalar, inputs, 0, 300)
+    main.WorldSnapshot.restore(vectorized.game_objects_group, main.WorldSnapshot.save(scalar.game_objects_group))
+    play(scalar, inputs, 300, 500)
+    play(vectorized, inputs, 300, 500)
+    assert vectorized.get_state_digest() == scalar.get_state_digest()